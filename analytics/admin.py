@@ -0,0 +1,114 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from store.models import Collection, Product
+from . import models, rollups
+
+
+DASHBOARD_PERIODS = [7, 30, 90, 365]
+
+
+class RollupAdmin(admin.ModelAdmin):
+    """The rollups are written by update_sales_rollups only."""
+    date_hierarchy = 'day'
+    ordering = ['-day']
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.DailyProductSales)
+class DailyProductSalesAdmin(RollupAdmin):
+    list_display = ['day', 'product', 'orders', 'units', 'revenue']
+    list_select_related = ['product']
+
+    def get_urls(self):
+        return [
+            path(
+                'dashboard/',
+                self.admin_site.admin_view(self.dashboard),
+                name='analytics_dashboard'
+            ),
+            path(
+                'report/',
+                self.admin_site.admin_view(self.report),
+                name='analytics_report'
+            ),
+        ] + super().get_urls()
+
+    def period_context(self, request, title: str) -> dict:
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        try:
+            period = int(request.GET.get('days', settings.ANALYTICS_DASHBOARD_DAYS))
+        except ValueError:
+            period = settings.ANALYTICS_DASHBOARD_DAYS
+        period = min(max(period, 1), max(DASHBOARD_PERIODS))
+        end = timezone.localdate()
+        start = end - datetime.timedelta(days=period - 1)
+
+        return {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': title,
+            'period': period,
+            'periods': DASHBOARD_PERIODS,
+            'start': start,
+            'end': end,
+        }
+
+    def dashboard(self, request):
+        context = self.period_context(request, "Sales dashboard")
+        context.update({
+            'watermark': models.SalesWatermark.objects.filter(name=rollups.WATERMARK).first(),
+            **rollups.summarize(context['start'], context['end']),
+        })
+        return TemplateResponse(request, 'admin/analytics/dashboard.html', context)
+
+    def report(self, request):
+        # NumPy is only needed for the reports
+        from .cube import sales_cube
+
+        context = self.period_context(request, "Sales report")
+        start, end = context['start'], context['end']
+        if sales_cube.load():
+            products = sales_cube.top('product', 20, start=start, end=end)
+            collections = sales_cube.group_by(['collection', 'month'], start=start, end=end)
+            product_titles = Product.objects.only('title').in_bulk([pk for pk, _ in products])
+            collection_titles = Collection.objects.only('title') \
+                .in_bulk({pk for (pk, _), _ in collections})
+            context.update({
+                'cube_rows': len(sales_cube),
+                'products': [(product_titles.get(pk, pk), revenue) for pk, revenue in products],
+                'collections': [
+                    (collection_titles.get(pk, pk), month, revenue)
+                    for (pk, month), revenue in collections
+                ],
+                'basket_sizes': sales_cube.basket_sizes(start=start, end=end),
+            })
+        return TemplateResponse(request, 'admin/analytics/report.html', context)
+
+
+@admin.register(models.DailyCollectionSales)
+class DailyCollectionSalesAdmin(RollupAdmin):
+    list_display = ['day', 'collection', 'units', 'revenue']
+    list_select_related = ['collection']
+
+
+@admin.register(models.DailyMembershipSales)
+class DailyMembershipSalesAdmin(RollupAdmin):
+    list_display = ['day', 'membership', 'orders', 'units', 'revenue']
+    list_filter = ['membership']
@@ -0,0 +1,370 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from store.models import Customer, Order, OrderItem
+from .rollups import after, up_to
+
+
+# Bumped when the columns or their meaning change
+FORMAT_VERSION = 2
+
+COLUMNS = {
+    'id': np.int64,
+    'order_id': np.int64,
+    'product_id': np.int64,
+    'collection_id': np.int64,
+    'membership': np.uint8,
+    'day': 'datetime64[D]',
+    'quantity': np.int32,
+    # unit_price in paise, so sums are exact
+    'price': np.int64,
+}
+
+MEMBERSHIPS = [code for code, _ in Customer.MEMBERSHIP_CHOICES]
+
+# Group by dimensions and the column they come from, dates at their precision
+DIMENSIONS = {
+    'product': ('product_id', None),
+    'collection': ('collection_id', None),
+    'membership': ('membership', None),
+    'day': ('day', 'D'),
+    'month': ('day', 'M'),
+    'year': ('day', 'Y'),
+}
+
+MEASURES = ['revenue', 'units', 'lines']
+
+CURRENT = 'current.json'
+
+
+class SalesCube:
+    """
+    Columnar copy of the order items, for ad-hoc reports computed with
+    NumPy instead of GROUP BY queries.
+
+    The columns are saved as .npy files in ANALYTICS_CUBE_DIR and memory
+    mapped, so processes share them through the page cache. ``refresh``
+    writes the items of the orders placed since the last refresh as a new
+    part, leaving the existing parts alone, and merges the parts into one
+    once there are ANALYTICS_CUBE_MAX_PARTS of them.
+
+    Like the rollups, orders are loaded in (``placed_at``, id) order and
+    the ones placed in the last ANALYTICS_ROLLUP_LAG seconds are left for
+    the next refresh, so an order still being written isn't skipped. Items
+    are copied once, with the collection of their product and the
+    membership of their customer at that time. ``rebuild`` after editing,
+    deleting or adding items of older orders in the admin, moving products
+    between collections or changing memberships.
+
+    Refresh from one process at a time, e.g. a cron job running
+    refresh_sales_cube.
+    """
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self.lock = threading.Lock()
+        self.state = None
+        self.parts = []
+
+    @property
+    def directory(self) -> Path:
+        return Path(self._directory or settings.ANALYTICS_CUBE_DIR)
+
+    def __len__(self) -> int:
+        return sum(len(part['id']) for part in self.parts)
+
+    @property
+    def watermark(self) -> tuple:
+        """(``placed_at``, id) of the last order loaded, or None."""
+        if self.state is None or self.state['placed_at'] is None:
+            return None
+        return parse_datetime(self.state['placed_at']), self.state['order_id']
+
+    # Storage
+
+    def current(self) -> dict:
+        try:
+            with open(self.directory / CURRENT) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if state.get('version') != FORMAT_VERSION or state.get('columns') != list(COLUMNS):
+            return None
+        return state
+
+    def load(self) -> bool:
+        """Map the latest saved parts, unless they are already mapped."""
+        state = self.current()
+        if state is None:
+            return False
+        if state != self.state:
+            mapped = {}
+            if self.state is not None and self.state['generation'] == state['generation']:
+                mapped = dict(zip(self.state['parts'], self.parts))
+            path = self.directory / state['generation']
+            self.parts = [
+                mapped[name] if name in mapped else
+                {column: np.load(path / name / f'{column}.npy', mmap_mode='r') for column in COLUMNS}
+                for name in state['parts']
+            ]
+            self.state = state
+        return True
+
+    def write_part(self, generation: str, columns: dict) -> str:
+        name = uuid.uuid4().hex
+        path = self.directory / generation / name
+        path.mkdir(parents=True)
+        for column in COLUMNS:
+            np.save(path / f'{column}.npy', columns[column])
+        return name
+
+    def write_state(self, generation: str, parts: list, rows: int, watermark: tuple):
+        """Point current.json at ``parts`` of ``generation``, atomically."""
+        placed_at, order_id = watermark or (None, 0)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump({
+                'version': FORMAT_VERSION,
+                'columns': list(COLUMNS),
+                'generation': generation,
+                'parts': parts,
+                'rows': rows,
+                'placed_at': placed_at.isoformat() if placed_at is not None else None,
+                'order_id': order_id,
+            }, file)
+        os.replace(tmp_path, self.directory / CURRENT)
+
+    def append(self, columns: dict, watermark: tuple):
+        """Add ``columns`` as a new part of the current generation."""
+        part = self.write_part(self.state['generation'], columns)
+        self.write_state(self.state['generation'], [*self.state['parts'], part],
+                         self.state['rows'] + len(columns['id']), watermark)
+
+    def save(self, parts: list, watermark: tuple):
+        """
+        Write ``parts`` merged into a single part of a new generation
+        directory, then point current.json at it and delete the previous
+        generation. Readers mapping it keep their data until they load
+        again.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = self.current()
+        generation = uuid.uuid4().hex
+        columns = {
+            name: np.concatenate([np.empty(0, dtype)] + [part[name] for part in parts])
+            for name, dtype in COLUMNS.items()
+        }
+        part = self.write_part(generation, columns)
+        self.write_state(generation, [part], len(columns['id']), watermark)
+
+        if previous is not None:
+            shutil.rmtree(self.directory / previous['generation'], ignore_errors=True)
+
+    # Loading from the database
+
+    def fetch(self, watermark: tuple = None, chunk_size: int = None):
+        """
+        Return the items of the orders placed after ``watermark`` and
+        before the lag as a dict of arrays, or None if there are none, and
+        the new watermark. Items are read ``chunk_size`` orders at a time.
+        """
+        if chunk_size is None:
+            chunk_size = settings.ANALYTICS_CUBE_CHUNK_SIZE
+        cutoff = timezone.now() - datetime.timedelta(seconds=settings.ANALYTICS_ROLLUP_LAG)
+        membership_codes = {code: index for index, code in enumerate(MEMBERSHIPS)}
+        orders = Order.objects.filter(placed_at__lte=cutoff).values_list('placed_at', 'id')
+        items = OrderItem.objects \
+            .order_by() \
+            .annotate(day=TruncDate('order__placed_at')) \
+            .values_list('id', 'order_id', 'product_id', 'product__collection_id',
+                         'order__customer__membership', 'day', 'quantity', 'unit_price')
+
+        chunks = []
+        while True:
+            batch = orders if watermark is None else orders.filter(after(*watermark))
+            last = batch.order_by('placed_at', 'id')[chunk_size - 1:chunk_size].first()
+            finished = last is None
+            if finished:
+                last = batch.order_by('-placed_at', '-id').first()
+                if last is None:
+                    break
+
+            batch = items.filter(up_to(*last, 'order__'))
+            if watermark is not None:
+                batch = batch.filter(after(*watermark, 'order__'))
+            rows = list(batch)
+            if rows:
+                ids, order_ids, product_ids, collection_ids, memberships, days, quantities, prices = zip(*rows)
+                chunks.append({
+                    'id': np.array(ids, np.int64),
+                    'order_id': np.array(order_ids, np.int64),
+                    'product_id': np.array(product_ids, np.int64),
+                    'collection_id': np.array(collection_ids, np.int64),
+                    'membership': np.array([membership_codes.get(code, 255) for code in memberships], np.uint8),
+                    'day': np.array(days, 'datetime64[D]'),
+                    'quantity': np.array(quantities, np.int32),
+                    'price': np.array([int(price * 100) for price in prices], np.int64),
+                })
+            watermark = last
+            if finished:
+                break
+
+        if not chunks:
+            return None, watermark
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}, watermark
+
+    def refresh(self, chunk_size: int = None) -> int:
+        """Append the items of the orders placed since the last refresh, return their number."""
+        with self.lock:
+            self.load()
+            columns, watermark = self.fetch(self.watermark, chunk_size)
+            if columns is None:
+                return 0
+            if self.state is None or len(self.state['parts']) >= settings.ANALYTICS_CUBE_MAX_PARTS:
+                self.save([*self.parts, columns], watermark)
+            else:
+                self.append(columns, watermark)
+            self.load()
+            return len(columns['id'])
+
+    def rebuild(self, chunk_size: int = None) -> int:
+        with self.lock:
+            columns, watermark = self.fetch(None, chunk_size)
+            self.save([] if columns is None else [columns], watermark)
+            self.load()
+            return len(self)
+
+    # Reports
+
+    def column(self, name: str, mask) -> np.ndarray:
+        """The rows of ``mask`` in column ``name``, across the parts."""
+        offsets = np.cumsum([len(part['id']) for part in self.parts])[:-1]
+        arrays = [part[name][part_mask] for part, part_mask in zip(self.parts, np.split(mask, offsets))]
+        if not arrays:
+            return np.empty(0, COLUMNS[name])
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+    def select(self, start=None, end=None) -> np.ndarray:
+        """Boolean mask of the items placed between ``start`` and ``end`` inclusive."""
+        masks = [np.ones(0, bool)]
+        for part in self.parts:
+            days = part['day']
+            mask = np.ones(len(days), bool)
+            if start is not None:
+                mask &= days >= np.datetime64(start, 'D')
+            if end is not None:
+                mask &= days <= np.datetime64(end, 'D')
+            masks.append(mask)
+        return np.concatenate(masks)
+
+    def measure(self, name: str, mask) -> np.ndarray:
+        quantities = self.column('quantity', mask)
+        if name == 'revenue':
+            return quantities.astype(np.int64) * self.column('price', mask)
+        if name == 'units':
+            return quantities.astype(np.int64)
+        if name == 'lines':
+            return np.ones(len(quantities), np.int64)
+        raise ValueError(f"Unknown measure: {name}")
+
+    def key(self, dimension: str, mask) -> np.ndarray:
+        try:
+            column, unit = DIMENSIONS[dimension]
+        except KeyError:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        values = self.column(column, mask)
+        return values.astype(f'datetime64[{unit}]') if unit else values
+
+    def label(self, dimension: str, value):
+        if dimension == 'membership':
+            return MEMBERSHIPS[value] if value < len(MEMBERSHIPS) else None
+        if DIMENSIONS[dimension][1]:
+            return str(value)
+        return int(value)
+
+    @staticmethod
+    def total(name: str, value):
+        value = int(np.rint(value))
+        return Decimal(value).scaleb(-2) if name == 'revenue' else value
+
+    def group_by(self, dimensions, measure: str = 'revenue', start=None, end=None) -> list:
+        """
+        Sum ``measure`` by every combination of ``dimensions`` present in
+        the items placed between ``start`` and ``end``. Returns a list of
+        ``(keys, total)``, largest total first.
+
+        Each dimension is factorized with np.unique, the codes are combined
+        into one integer key and summed with np.bincount.
+        """
+        if not dimensions:
+            raise ValueError("At least one dimension is required.")
+        mask = self.select(start, end)
+        if not mask.any():
+            return []
+        values = self.measure(measure, mask)
+        uniques, codes = [], []
+        for dimension in dimensions:
+            unique, inverse = np.unique(self.key(dimension, mask), return_inverse=True)
+            uniques.append(unique)
+            codes.append(inverse.ravel())
+
+        combined = np.ravel_multi_index(codes, [len(unique) for unique in uniques])
+        keys, inverse = np.unique(combined, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=values, minlength=len(keys))
+
+        order = np.argsort(-sums, kind='stable')
+        positions = np.unravel_index(keys[order], [len(unique) for unique in uniques])
+        return [
+            (tuple(self.label(dimension, unique[position[row]])
+                   for dimension, unique, position in zip(dimensions, uniques, positions)),
+             self.total(measure, sums[index]))
+            for row, index in enumerate(order)
+        ]
+
+    def top(self, dimension: str, k: int = 10, measure: str = 'revenue', start=None, end=None) -> list:
+        """
+        The ``k`` largest ``(key, total)`` of ``dimension``, found with
+        np.argpartition rather than sorting every group.
+        """
+        mask = self.select(start, end)
+        unique, inverse = np.unique(self.key(dimension, mask), return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=self.measure(measure, mask), minlength=len(unique))
+        if k < len(sums):
+            best = np.argpartition(-sums, k)[:k]
+        else:
+            best = np.arange(len(sums))
+        best = best[np.lexsort((unique[best], -sums[best]))]
+        return [(self.label(dimension, unique[index]), self.total(measure, sums[index])) for index in best]
+
+    def basket_sizes(self, bins=None, measure: str = 'units', start=None, end=None) -> list:
+        """
+        Histogram of ``measure`` per order, as ``(low, high, orders)`` with
+        ``high`` excluded. ``bins`` are the bin edges, roughly logarithmic
+        by default.
+        """
+        mask = self.select(start, end)
+        _, inverse = np.unique(self.column('order_id', mask), return_inverse=True)
+        per_order = np.bincount(inverse.ravel(), weights=self.measure(measure, mask))
+        if measure == 'revenue':
+            per_order = per_order / 100
+        if bins is None:
+            largest = int(per_order.max()) if len(per_order) else 0
+            bins = [edge for edge in [1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000] if edge <= largest]
+            bins = [0] + bins + [largest + 1]
+        counts, _ = np.histogram(per_order, bins=bins)
+        return [(bins[index], bins[index + 1], int(count)) for index, count in enumerate(counts)]
+
+
+sales_cube = SalesCube()
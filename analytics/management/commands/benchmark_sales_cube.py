@@ -0,0 +1,143 @@
+import time
+import random
+import shutil
+import tempfile
+import datetime
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from analytics.cube import SalesCube
+from store.counters import repair_customer_orders_count
+from store.models import Customer, Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = 'Compares the sales cube with the equivalent ORM aggregations on the current orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, default=0, metavar='ITEMS',
+                            help='First add this many random order items, e.g. 10000000.')
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread generated orders over this many past days.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            self.generate(options['generate'], options['items_per_order'], options['days'])
+
+        # A cube of its own, the shared one is left alone
+        directory = tempfile.mkdtemp()
+        try:
+            self.benchmark(SalesCube(directory), options['repeat'])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def benchmark(self, cube, repeat: int):
+        start = time.perf_counter()
+        cube.refresh()
+        self.stdout.write(f"Loaded {len(cube)} items into the cube in {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        added = cube.refresh()
+        self.stdout.write(f"Refreshed ({added} new items) in {time.perf_counter() - start:.2f}s")
+
+        revenue = Sum(F('quantity') * F('unit_price'),
+                      output_field=DecimalField(max_digits=12, decimal_places=2))
+        reports = [
+            (
+                'Top 10 products by revenue',
+                lambda: list(OrderItem.objects
+                             .values('product_id')
+                             .annotate(revenue=revenue)
+                             .order_by('-revenue')[:10]),
+                lambda: cube.top('product', 10),
+            ),
+            (
+                'Revenue by collection x month',
+                lambda: list(OrderItem.objects
+                             .annotate(month=TruncMonth('order__placed_at'))
+                             .values('product__collection_id', 'month')
+                             .annotate(revenue=revenue)
+                             .order_by('-revenue')),
+                lambda: cube.group_by(['collection', 'month']),
+            ),
+            (
+                'Units per order histogram',
+                lambda: Counter(
+                    OrderItem.objects
+                             .values('order_id')
+                             .annotate(units=Sum('quantity'))
+                             .order_by()
+                             .values_list('units', flat=True)
+                ),
+                lambda: cube.basket_sizes(),
+            ),
+        ]
+
+        orm_total = cube_total = 0
+        for name, orm, vectorized in reports:
+            orm_time = self.time(orm, repeat)
+            cube_time = self.time(vectorized, repeat)
+            orm_total += orm_time
+            cube_total += cube_time
+            self.stdout.write(
+                f"{name}: ORM {orm_time * 1000:.1f}ms, cube {cube_time * 1000:.1f}ms, "
+                f"speedup x{orm_time / max(cube_time, 1e-9):.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Total: ORM {orm_total:.2f}s, cube {cube_total:.2f}s, "
+            f"speedup x{orm_total / max(cube_total, 1e-9):.1f}"
+        ))
+
+    def time(self, run, repeat: int) -> float:
+        """Best of ``repeat`` runs, in seconds."""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def generate(self, count: int, items_per_order: int, days: int, batch_size: int = 5000):
+        """
+        Bulk insert random orders of the existing customers and products.
+        bulk_create sends no signals, so caches and counters are untouched
+        apart from Customer.orders_count, repaired at the end.
+        """
+        customer_ids = list(Customer.objects.values_list('id', flat=True))
+        products = list(Product.objects.values_list('id', 'unit_price'))
+        if not customer_ids or not products:
+            raise CommandError('Generating orders needs at least one customer and one product.')
+
+        now = timezone.now()
+        created = 0
+        while created < count:
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    Order(customer_id=random.choice(customer_ids))
+                    for _ in range(max(min(batch_size, count - created) // items_per_order, 1))
+                ])
+                if orders[0].id is None:
+                    # Backends that don't return ids from bulk inserts
+                    orders = list(Order.objects.order_by('-id')[:len(orders)])
+                # placed_at is set by auto_now_add, spread each batch over a random day
+                placed_at = now - datetime.timedelta(days=random.randrange(days),
+                                                     seconds=random.randrange(24 * 60 * 60))
+                Order.objects.filter(id__in=[order.id for order in orders]).update(placed_at=placed_at)
+
+                items = []
+                for order in orders:
+                    for product_id, unit_price in random.sample(products, min(items_per_order, len(products))):
+                        items.append(OrderItem(order_id=order.id, product_id=product_id,
+                                               quantity=random.randint(1, 5), unit_price=unit_price))
+                OrderItem.objects.bulk_create(items[:count - created])
+                created += min(len(items), count - created)
+            self.stdout.write(f"Generated {created} of {count} items", ending='\r')
+
+        self.stdout.write('')
+        repair_customer_orders_count()
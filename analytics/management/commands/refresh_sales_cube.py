@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from analytics.cube import sales_cube
+
+
+class Command(BaseCommand):
+    help = 'Appends the items of the orders placed since the last run to the sales cube in ANALYTICS_CUBE_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Reload every item, e.g. after items were edited or products changed collection.')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Orders whose items are read per query.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            sales_cube.rebuild(options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the sales cube with {len(sales_cube)} items."))
+        else:
+            added = sales_cube.refresh(options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Added {added} items to the sales cube, {len(sales_cube)} in total."
+            ))
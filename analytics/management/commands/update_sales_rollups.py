@@ -0,0 +1,35 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from analytics.rollups import rebuild_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Aggregates the orders placed since the last run into the sales rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Delete the rollups and aggregate every order again.')
+        parser.add_argument('--since', metavar='YYYY-MM-DD',
+                            help='With --rebuild, only rebuild the days from this date.')
+        parser.add_argument('--batch-size', type=int,
+                            help='Orders aggregated per transaction.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        since = None
+        if options['since']:
+            if not options['rebuild']:
+                raise CommandError('--since requires --rebuild.')
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['since']}")
+
+        if options['rebuild']:
+            counted = rebuild_rollups(since, options['batch_size'])
+        else:
+            counted = update_rollups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Counted {counted} orders."))
@@ -0,0 +1,91 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('store', '0010_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCollectionSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'daily collection sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyMembershipSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('membership', models.CharField(choices=[('B', 'Bronze'), ('S', 'Silver'), ('G', 'Gold')], max_length=1)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'daily membership sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('placed_at', models.DateTimeField(null=True)),
+                ('order_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailymembershipsales',
+            constraint=models.UniqueConstraint(fields=('day', 'membership'), name='unique_membership_sales_day'),
+        ),
+        migrations.AddField(
+            model_name='dailycollectionsales',
+            name='collection',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.collection'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyproductsales',
+            index=models.Index(fields=['product', 'day'], name='analytics_d_product_09f712_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='unique_product_sales_day'),
+        ),
+        migrations.AddIndex(
+            model_name='dailycollectionsales',
+            index=models.Index(fields=['collection', 'day'], name='analytics_d_collect_672793_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycollectionsales',
+            constraint=models.UniqueConstraint(fields=('day', 'collection'), name='unique_collection_sales_day'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import models
+from store.models import Collection, Customer, Product
+
+
+class SalesWatermark(models.Model):
+    """
+    How far the rollups have been aggregated: every order up to and
+    including (``placed_at``, ``order_id``) is counted.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    placed_at = models.DateTimeField(null=True)
+    order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily product sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_product_sales_day'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day']),
+        ]
+
+
+class DailyCollectionSales(models.Model):
+    day = models.DateField()
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily collection sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'collection'], name='unique_collection_sales_day'),
+        ]
+        indexes = [
+            models.Index(fields=['collection', 'day']),
+        ]
+
+
+class DailyMembershipSales(models.Model):
+    day = models.DateField()
+    membership = models.CharField(max_length=1, choices=Customer.MEMBERSHIP_CHOICES)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily membership sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'membership'], name='unique_membership_sales_day'),
+        ]
@@ -0,0 +1,197 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from store.models import Collection, Customer, Order, OrderItem, Product
+from .models import DailyCollectionSales, DailyMembershipSales, DailyProductSales, SalesWatermark
+
+
+WATERMARK = 'sales'
+
+REVENUE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+# Rollup model, its dimension field, the OrderItem lookup filling it, and
+# its measures. Collections have no order count, an order can span several.
+ROLLUPS = [
+    (DailyProductSales, 'product_id', 'product_id', ['orders', 'units', 'revenue']),
+    (DailyCollectionSales, 'collection_id', 'product__collection_id', ['units', 'revenue']),
+    (DailyMembershipSales, 'membership', 'order__customer__membership', ['orders', 'units', 'revenue']),
+]
+
+
+def measures(fields) -> dict:
+    aggregates = {
+        'orders': Count('order_id', distinct=True),
+        'units': Sum('quantity'),
+        'revenue': Sum(F('quantity') * F('unit_price'), output_field=REVENUE_FIELD),
+    }
+    return {field: aggregates[field] for field in fields}
+
+
+def after(placed_at, order_id, prefix: str = '') -> Q:
+    """Orders strictly after (``placed_at``, ``order_id``), the keyset order."""
+    return Q(**{f'{prefix}placed_at__gt': placed_at}) \
+        | Q(**{f'{prefix}placed_at': placed_at, f'{prefix}id__gt': order_id})
+
+
+def up_to(placed_at, order_id, prefix: str = '') -> Q:
+    return Q(**{f'{prefix}placed_at__lt': placed_at}) \
+        | Q(**{f'{prefix}placed_at': placed_at, f'{prefix}id__lte': order_id})
+
+
+def merge(model, dimension: str, fields, rows: dict, batch_size: int):
+    """
+    Add ``rows``, a dict of (day, dimension value) to measures, to the
+    rollup rows, creating the missing ones.
+    """
+    if not rows:
+        return
+    existing = model.objects.filter(**{
+        'day__in': {day for day, _ in rows},
+        f'{dimension}__in': {value for _, value in rows},
+    })
+    changed = []
+    for rollup in existing:
+        sums = rows.pop((rollup.day, getattr(rollup, dimension)), None)
+        if sums is not None:
+            for field in fields:
+                setattr(rollup, field, getattr(rollup, field) + sums[field])
+            changed.append(rollup)
+
+    model.objects.bulk_update(changed, fields, batch_size=batch_size)
+    model.objects.bulk_create(
+        [model(day=day, **{dimension: value}, **sums) for (day, value), sums in rows.items()],
+        batch_size=batch_size
+    )
+
+
+def aggregate_items(items, batch_size: int):
+    items = items.annotate(day=TruncDate('order__placed_at'))
+    for model, dimension, lookup, fields in ROLLUPS:
+        rows = {}
+        for row in items.values('day', lookup).annotate(**measures(fields)).order_by():
+            rows[(row['day'], row[lookup])] = {field: row[field] for field in fields}
+        merge(model, dimension, fields, rows, batch_size)
+
+
+def update_rollups(batch_size: int = None) -> int:
+    """
+    Aggregate the orders placed since the watermark into the rollups, in
+    one transaction per ``batch_size`` orders, and return their number.
+
+    Orders placed in the last ANALYTICS_ROLLUP_LAG seconds are left for the
+    next run. ``placed_at`` is set before an order's transaction commits, so
+    an order still being written could otherwise end up behind the
+    watermark and never be counted.
+
+    Orders are counted once, with the collection of their products and the
+    membership of their customer at that time. Items changed after that
+    are only picked up by ``rebuild_rollups``.
+    """
+    if batch_size is None:
+        batch_size = settings.ANALYTICS_ROLLUP_BATCH_SIZE
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, not {batch_size}.")
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.ANALYTICS_ROLLUP_LAG)
+    SalesWatermark.objects.get_or_create(name=WATERMARK)
+
+    counted = 0
+    while True:
+        with transaction.atomic():
+            # Also keeps concurrent runs from counting the same orders
+            watermark = SalesWatermark.objects.select_for_update().get(name=WATERMARK)
+            orders = Order.objects.filter(placed_at__lte=cutoff)
+            items = OrderItem.objects.all()
+            if watermark.placed_at is not None:
+                orders = orders.filter(after(watermark.placed_at, watermark.order_id))
+                items = items.filter(after(watermark.placed_at, watermark.order_id, 'order__'))
+
+            orders = orders.values_list('placed_at', 'id')
+            last = orders.order_by('placed_at', 'id')[batch_size - 1:batch_size].first()
+            finished = last is None
+            if finished:
+                last = orders.order_by('-placed_at', '-id').first()
+                if last is None:
+                    return counted
+
+            batch = orders.filter(up_to(*last)).count()
+            aggregate_items(items.filter(up_to(*last, 'order__')), batch_size)
+            watermark.placed_at, watermark.order_id = last
+            watermark.save()
+            counted += batch
+        if finished:
+            return counted
+
+
+def rebuild_rollups(since: datetime.date = None, batch_size: int = None) -> int:
+    """
+    Delete the rollups from ``since``, or all of them, and aggregate those
+    days again from the orders. Returns the number of orders counted.
+    """
+    with transaction.atomic():
+        watermark, _ = SalesWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        for model, *_ in ROLLUPS:
+            rollups = model.objects.all()
+            if since is not None:
+                rollups = rollups.filter(day__gte=since)
+            rollups.delete()
+
+        if since is None:
+            watermark.placed_at, watermark.order_id = None, 0
+        else:
+            # Days are truncated in the current time zone
+            start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+            if watermark.placed_at is not None and start <= watermark.placed_at:
+                watermark.placed_at, watermark.order_id = start, 0
+        watermark.save()
+    return update_rollups(batch_size)
+
+
+def summarize(start: datetime.date, end: datetime.date, top: int = 10) -> dict:
+    """
+    Sales between ``start`` and ``end`` inclusive, read from the rollups:
+    totals, daily figures, revenue by membership and collection, and the
+    ``top`` products by revenue.
+    """
+    days = {'day__gte': start, 'day__lte': end}
+    totals = dict(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+    sales = DailyMembershipSales.objects.filter(**days)
+
+    membership_labels = dict(Customer.MEMBERSHIP_CHOICES)
+    memberships = [
+        {**row, 'membership': membership_labels.get(row['membership'], row['membership'])}
+        for row in sales.values('membership').annotate(**totals).order_by('-revenue')
+    ]
+
+    products = list(
+        DailyProductSales.objects
+                         .filter(**days)
+                         .values('product_id')
+                         .annotate(**totals)
+                         .order_by('-revenue', 'product_id')[:top]
+    )
+    titles = Product.objects.only('title').in_bulk([row['product_id'] for row in products])
+    for row in products:
+        row['product'] = titles.get(row['product_id'])
+
+    collections = list(
+        DailyCollectionSales.objects
+                            .filter(**days)
+                            .values('collection_id')
+                            .annotate(units=Sum('units'), revenue=Sum('revenue'))
+                            .order_by('-revenue', 'collection_id')
+    )
+    titles = Collection.objects.only('title').in_bulk([row['collection_id'] for row in collections])
+    for row in collections:
+        row['collection'] = titles.get(row['collection_id'])
+
+    return {
+        'totals': sales.aggregate(**totals),
+        'days': list(sales.values('day').annotate(**totals).order_by('day')),
+        'memberships': memberships,
+        'products': products,
+        'collections': collections,
+    }
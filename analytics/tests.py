@@ -0,0 +1,316 @@
+import io
+import datetime
+import shutil
+import tempfile
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from store.models import Collection, Customer, Order, OrderItem, Product
+from . import rollups
+from .cube import SalesCube
+from .models import SalesWatermark
+
+
+REVENUE = Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+class SalesData:
+    """Orders of a few customers and products, spread over several months."""
+
+    @classmethod
+    def create_catalog(cls):
+        cls.now = timezone.now().replace(microsecond=0)
+        cls.collections = [Collection.objects.create(title=f'Collection {index}') for index in range(3)]
+        cls.products = [
+            Product.objects.create(
+                title=f'Product {index}', slug=f'product-{index}', description='',
+                unit_price=Decimal('10.00') + index, inventory=100,
+                collection=cls.collections[index % 3]
+            )
+            for index in range(6)
+        ]
+        cls.customers = [
+            Customer.objects.create(
+                first_name='Customer', last_name=str(index), email=f'{index}@example.com',
+                phone='1234567890', membership=membership
+            )
+            for index, membership in enumerate('BSGB')
+        ]
+
+    @classmethod
+    def create_order(cls, placed_at, lines, customer=None, **kwargs) -> Order:
+        """``lines`` are (product index, quantity) pairs."""
+        order = Order.objects.create(customer=customer or cls.customers[0], **kwargs)
+        Order.objects.filter(pk=order.pk).update(placed_at=placed_at)
+        for index, quantity in lines:
+            product = cls.products[index]
+            OrderItem.objects.create(order=order, product=product, quantity=quantity,
+                                     unit_price=product.unit_price)
+        return order
+
+    @classmethod
+    def create_orders(cls):
+        for day in range(0, 120, 7):
+            cls.create_order(
+                cls.now - datetime.timedelta(days=day, hours=1),
+                [(day % 6, 1 + day % 3), ((day + 1) % 6, 2)],
+                customer=cls.customers[day % 4],
+            )
+        cls.create_order(cls.now - datetime.timedelta(days=3, hours=1), [(5, 4)])
+
+
+class SalesCubeTests(SalesData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_catalog()
+        cls.create_orders()
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.cube = SalesCube(directory)
+
+    def refreshed(self, **kwargs) -> SalesCube:
+        self.cube.refresh(**kwargs)
+        return self.cube
+
+    def assertMatchesOrm(self, cube):
+        self.assertEqual(len(cube), OrderItem.objects.count())
+
+        self.assertEqual(
+            dict(cube.group_by(['collection', 'month'])),
+            {
+                (row['product__collection_id'], row['month'].strftime('%Y-%m')): row['revenue']
+                for row in OrderItem.objects
+                                    .annotate(month=TruncMonth('order__placed_at'))
+                                    .values('product__collection_id', 'month')
+                                    .annotate(revenue=REVENUE)
+            }
+        )
+        self.assertEqual(
+            dict(cube.group_by(['membership'], 'units')),
+            {
+                (row['order__customer__membership'],): row['units']
+                for row in OrderItem.objects
+                                    .values('order__customer__membership')
+                                    .annotate(units=Sum('quantity'))
+            }
+        )
+        self.assertEqual(
+            cube.top('product', 3),
+            [
+                (row['product_id'], row['revenue'])
+                for row in OrderItem.objects
+                                    .values('product_id')
+                                    .annotate(revenue=REVENUE)
+                                    .order_by('-revenue', 'product_id')[:3]
+            ]
+        )
+
+        units = Counter(
+            OrderItem.objects.values('order_id').annotate(units=Sum('quantity'))
+                     .order_by().values_list('units', flat=True)
+        )
+        self.assertEqual(
+            cube.basket_sizes(bins=[0, 3, 5, 100]),
+            [(low, high, sum(count for size, count in units.items() if low <= size < high))
+             for low, high in [(0, 3), (3, 5), (5, 100)]]
+        )
+
+    def test_matches_orm(self):
+        self.assertMatchesOrm(self.refreshed())
+
+    def test_date_range(self):
+        cube = self.refreshed()
+        start = (self.now - datetime.timedelta(days=30)).date()
+        end = (self.now - datetime.timedelta(days=7)).date()
+        self.assertEqual(
+            dict(cube.group_by(['day'], 'lines', start=start, end=end)),
+            {
+                (str(row['day']),): row['lines']
+                for row in OrderItem.objects
+                                    .filter(order__placed_at__date__gte=start, order__placed_at__date__lte=end)
+                                    .values(day=F('order__placed_at__date'))
+                                    .annotate(lines=Sum(1))
+            }
+        )
+
+    def test_refresh_appends_parts(self):
+        cube = self.refreshed(chunk_size=3)
+        self.create_order(self.now - datetime.timedelta(hours=1), [(0, 1)])
+        self.assertEqual(cube.refresh(), 1)
+        self.create_order(self.now - datetime.timedelta(hours=1), [(1, 2), (2, 1)])
+        self.assertEqual(cube.refresh(), 2)
+
+        self.assertEqual(len(cube.parts), 3)
+        self.assertMatchesOrm(cube)
+        # Another process maps the same parts
+        other = SalesCube(cube.directory)
+        self.assertTrue(other.load())
+        self.assertMatchesOrm(other)
+
+    @override_settings(ANALYTICS_CUBE_MAX_PARTS=2)
+    def test_refresh_merges_parts(self):
+        cube = self.refreshed()
+        generation = cube.state['generation']
+        for _ in range(3):
+            self.create_order(self.now - datetime.timedelta(hours=1), [(3, 1)])
+            self.assertEqual(cube.refresh(), 1)
+
+        self.assertNotEqual(cube.state['generation'], generation)
+        self.assertFalse((cube.directory / generation).exists())
+        self.assertEqual(len(cube.parts), 2)
+        self.assertMatchesOrm(cube)
+
+    @override_settings(ANALYTICS_ROLLUP_LAG=300)
+    def test_refresh_waits_for_the_lag(self):
+        cube = self.refreshed()
+        order = self.create_order(self.now, [(0, 1)])
+        self.assertEqual(cube.refresh(), 0)
+
+        Order.objects.filter(pk=order.pk).update(placed_at=self.now - datetime.timedelta(minutes=6))
+        self.assertEqual(cube.refresh(), 1)
+        self.assertMatchesOrm(cube)
+
+    def test_refresh_loads_orders_committed_out_of_id_order(self):
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True).first()
+        self.create_order(self.now - datetime.timedelta(minutes=20), [(0, 1)], id=last_id + 10)
+        cube = self.refreshed()
+
+        # A lower id, committed after the refresh
+        self.create_order(self.now - datetime.timedelta(minutes=10), [(1, 1)], id=last_id + 5)
+        self.assertEqual(cube.refresh(), 1)
+        self.assertMatchesOrm(cube)
+
+    def test_rebuild(self):
+        cube = self.refreshed()
+        OrderItem.objects.filter(product=self.products[0]).update(quantity=9)
+        self.assertEqual(cube.rebuild(chunk_size=4), OrderItem.objects.count())
+        self.assertMatchesOrm(cube)
+
+    def test_empty(self):
+        OrderItem.objects.all().delete()
+        cube = SalesCube(self.cube.directory)
+        self.assertEqual(cube.rebuild(), 0)
+        self.assertEqual(cube.group_by(['product']), [])
+        self.assertEqual(cube.top('product'), [])
+
+
+class RollupTests(SalesData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_catalog()
+        cls.create_orders()
+        # Orders placed at the same time, split across batches
+        cls.tied_at = cls.now - datetime.timedelta(days=2)
+        for index in range(5):
+            cls.create_order(cls.tied_at, [(index, 1)], customer=cls.customers[index % 4])
+
+    def assertMatchesOrders(self, since: datetime.date = None):
+        items = OrderItem.objects.annotate(day=TruncDate('order__placed_at'))
+        for model, dimension, lookup, fields in rollups.ROLLUPS:
+            with self.subTest(model=model.__name__):
+                expected = items.values('day', lookup).annotate(**rollups.measures(fields)).order_by()
+                actual = model.objects.values_list('day', dimension, *fields)
+                if since is not None:
+                    expected = expected.filter(day__gte=since)
+                    actual = actual.filter(day__gte=since)
+                self.assertEqual(
+                    sorted(actual),
+                    sorted((row['day'], row[lookup], *(row[field] for field in fields)) for row in expected)
+                )
+
+    def watermark(self) -> tuple:
+        watermark = SalesWatermark.objects.get(name=rollups.WATERMARK)
+        return watermark.placed_at, watermark.order_id
+
+    def test_update_in_batches(self):
+        self.assertEqual(rollups.update_rollups(batch_size=2), Order.objects.count())
+        self.assertMatchesOrders()
+        last = Order.objects.order_by('-placed_at', '-id').values_list('placed_at', 'id').first()
+        self.assertEqual(self.watermark(), last)
+        self.assertEqual(rollups.update_rollups(batch_size=2), 0)
+
+    def test_update_counts_new_orders_once(self):
+        rollups.update_rollups(batch_size=3)
+        # Ties with the watermark, with a higher id
+        placed_at, _ = self.watermark()
+        self.create_order(placed_at, [(0, 2)])
+        self.create_order(self.now - datetime.timedelta(hours=1), [(1, 1), (2, 3)])
+
+        self.assertEqual(rollups.update_rollups(batch_size=1), 2)
+        self.assertEqual(rollups.update_rollups(batch_size=1), 0)
+        self.assertMatchesOrders()
+
+    def test_update_waits_for_the_lag(self):
+        rollups.update_rollups()
+        order = self.create_order(self.now, [(0, 1)])
+        self.assertEqual(rollups.update_rollups(), 0)
+
+        Order.objects.filter(pk=order.pk).update(placed_at=self.now - datetime.timedelta(minutes=10))
+        self.assertEqual(rollups.update_rollups(), 1)
+        self.assertMatchesOrders()
+
+    def test_rebuild_since(self):
+        rollups.update_rollups()
+        since = self.tied_at.date()
+        old = OrderItem.objects.filter(order__placed_at__date__lt=since).first()
+        OrderItem.objects.filter(order__placed_at__date__gte=since).update(quantity=F('quantity') + 1)
+        OrderItem.objects.filter(pk=old.pk).update(quantity=F('quantity') + 1)
+        old_units = rollups.DailyProductSales.objects \
+            .filter(day=old.order.placed_at.date(), product_id=old.product_id) \
+            .values_list('units', flat=True) \
+            .get()
+
+        counted = rollups.rebuild_rollups(since, batch_size=2)
+        self.assertEqual(counted, Order.objects.filter(placed_at__date__gte=since).count())
+        self.assertMatchesOrders(since)
+        # Days before are left alone
+        self.assertEqual(
+            rollups.DailyProductSales.objects
+                   .filter(day=old.order.placed_at.date(), product_id=old.product_id)
+                   .values_list('units', flat=True)
+                   .get(),
+            old_units
+        )
+
+        self.assertEqual(rollups.rebuild_rollups(batch_size=2), Order.objects.count())
+        self.assertMatchesOrders()
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command('update_sales_rollups', batch_size=0)
+        with self.assertRaises(ValueError):
+            rollups.update_rollups(batch_size=0)
+
+        out = io.StringIO()
+        call_command('update_sales_rollups', batch_size=4, stdout=out)
+        self.assertIn(f"Counted {Order.objects.count()} orders.", out.getvalue())
+        call_command('update_sales_rollups', rebuild=True, since=str(self.tied_at.date()), stdout=out)
+        self.assertMatchesOrders()
+
+    def test_dashboard(self):
+        rollups.update_rollups()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:analytics_dashboard'), {'days': 30})
+        self.assertEqual(response.status_code, 200)
+
+        start = timezone.localdate() - datetime.timedelta(days=29)
+        items = OrderItem.objects.filter(order__placed_at__date__gte=start)
+        totals = response.context['totals']
+        self.assertEqual(totals['orders'], Order.objects.filter(placed_at__date__gte=start).count())
+        self.assertEqual(totals['units'], items.aggregate(units=Sum('quantity'))['units'])
+        self.assertEqual(totals['revenue'], items.aggregate(revenue=REVENUE)['revenue'])
+        self.assertEqual(
+            [row['product_id'] for row in response.context['products']],
+            list(items.values('product_id').annotate(revenue=REVENUE)
+                      .order_by('-revenue', 'product_id').values_list('product_id', flat=True))
+        )
+        self.assertContains(response, 'Product 0')
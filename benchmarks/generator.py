@@ -0,0 +1,196 @@
+import uuid
+import random
+import datetime
+import itertools
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from store import catalog
+from store.counters import repair_collection_product_count, repair_customer_orders_count
+from store.models import Collection, Customer, Order, OrderItem, Product
+from store.search import customer_index, product_index
+
+
+ADJECTIVES = ['Classic', 'Organic', 'Deluxe', 'Compact', 'Vintage', 'Smart', 'Handmade',
+              'Wireless', 'Premium', 'Everyday', 'Rustic', 'Portable', 'Fresh', 'Eco']
+NOUNS = ['Lamp', 'Chair', 'Kettle', 'Backpack', 'Notebook', 'Speaker', 'Candle', 'Blender',
+         'Jacket', 'Mug', 'Towel', 'Watch', 'Basket', 'Pillow', 'Sneakers', 'Tea', 'Honey']
+FIRST_NAMES = ['Aarav', 'Diya', 'Ishaan', 'Ananya', 'Kabir', 'Meera', 'Rohan', 'Saanvi',
+               'Vivaan', 'Zara', 'Arjun', 'Kiara', 'Neel', 'Tara', 'Dev', 'Riya']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Singh', 'Gupta', 'Nair', 'Das', 'Mehta',
+              'Kapoor', 'Joshi', 'Rao', 'Bose', 'Khan', 'Verma', 'Pillai']
+
+# Share of customers by membership
+MEMBERSHIP_WEIGHTS = [
+    (Customer.MEMBERSHIP_BRONZE, 70),
+    (Customer.MEMBERSHIP_SILVER, 22),
+    (Customer.MEMBERSHIP_GOLD, 8),
+]
+
+# Orders by day of the week, Monday first
+WEEKDAY_WEIGHTS = [12, 11, 11, 13, 16, 20, 17]
+
+
+def zipf_weights(count: int, exponent: float = 1.1) -> list:
+    """A few items get most of the weight, like best sellers and regulars."""
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def bulk_create(model, objects: list, batch_size: int) -> list:
+    """
+    bulk_create returning the objects with their ids, also on backends
+    that can't return ids from bulk inserts. Assumes no concurrent inserts.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objects, batch_size=batch_size)
+    last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    model.objects.bulk_create(objects, batch_size=batch_size)
+    ids = model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+    for obj, pk in zip(objects, ids):
+        obj.id = pk
+    return objects
+
+
+class DataGenerator:
+    """
+    Seeds the store with fake but realistically shaped data:
+    - product prices are log-normal around a few hundred rupees, and
+      product sales and customer orders follow Zipf distributions;
+    - collection sizes are uneven;
+    - orders are spread over ``days`` with busier weekends;
+    - orders have one to a few items, usually a single unit each.
+
+    Rows are inserted with bulk_create, which sends no signals. The
+    denormalized counters, search indexes and catalog cache are refreshed
+    at the end instead.
+    """
+
+    def __init__(self, seed: int = 0, batch_size: int = 5000, days: int = 365, stdout=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.stdout = stdout
+        # Keeps titles and emails unique when seeding again
+        self.run = uuid.uuid4().hex[:6]
+
+    def log(self, message: str):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def generate(self, collections: int, products: int, customers: int, orders: int,
+                 items_per_order: float = 2.5):
+        with transaction.atomic():
+            collection_ids = self.create_collections(collections)
+            self.create_products(products, collection_ids)
+            self.create_customers(customers)
+        self.create_orders(orders, items_per_order)
+
+        repair_collection_product_count()
+        repair_customer_orders_count()
+        product_index.record_rebuild()
+        customer_index.record_rebuild()
+        catalog.invalidate_catalog()
+
+    def create_collections(self, count: int) -> list:
+        collections = bulk_create(Collection, [
+            Collection(title=f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)}s {self.run}-{index}')
+            for index in range(count)
+        ], self.batch_size)
+        self.log(f"Created {count} collections")
+        return [collection.id for collection in collections]
+
+    def create_products(self, count: int, collection_ids: list):
+        # Uneven collection sizes
+        weights = list(itertools.accumulate(zipf_weights(len(collection_ids), 0.8)))
+        for start in range(0, count, self.batch_size):
+            products = []
+            for index in range(start, min(start + self.batch_size, count)):
+                title = f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)} {self.run}-{index}'
+                price = Decimal(min(round(self.random.lognormvariate(5.5, 0.8), 2), 9999.99)) \
+                    .quantize(Decimal('0.01'))
+                products.append(Product(
+                    title=title,
+                    slug=slugify(title),
+                    description=f'{title}. ' * self.random.randint(1, 5),
+                    unit_price=price,
+                    effective_price=price,
+                    inventory=int(self.random.expovariate(1 / 50)),
+                    collection_id=self.random.choices(collection_ids, cum_weights=weights)[0],
+                ))
+            bulk_create(Product, products, self.batch_size)
+        self.log(f"Created {count} products")
+
+    def create_customers(self, count: int):
+        memberships, weights = zip(*MEMBERSHIP_WEIGHTS)
+        for start in range(0, count, self.batch_size):
+            customers = []
+            for index in range(start, min(start + self.batch_size, count)):
+                first_name = self.random.choice(FIRST_NAMES)
+                last_name = self.random.choice(LAST_NAMES)
+                customers.append(Customer(
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=f'{first_name}.{last_name}.{self.run}-{index}@example.com'.lower(),
+                    phone=f'9{self.random.randrange(10 ** 9):09d}',
+                    birth_date=datetime.date(1950, 1, 1)
+                    + datetime.timedelta(days=self.random.randrange(55 * 365)),
+                    membership=self.random.choices(memberships, weights)[0],
+                ))
+            bulk_create(Customer, customers, self.batch_size)
+        self.log(f"Created {count} customers")
+
+    def create_orders(self, count: int, items_per_order: float):
+        """Orders of every customer and item of every product, popular ones more often."""
+        products = list(Product.objects.order_by('id').values_list('id', 'effective_price'))
+        customer_ids = list(Customer.objects.order_by('id').values_list('id', flat=True))
+        if not products or not customer_ids:
+            return
+        self.random.shuffle(products)
+        self.random.shuffle(customer_ids)
+        product_weights = list(itertools.accumulate(zipf_weights(len(products))))
+        customer_weights = list(itertools.accumulate(zipf_weights(len(customer_ids), 0.7)))
+        statuses = [Order.PAYMENT_STATUS_COMPLETE] * 90 + [Order.PAYMENT_STATUS_PENDING] * 7 \
+            + [Order.PAYMENT_STATUS_FAILED] * 3
+        now = timezone.now()
+        items_count = 0
+
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                size = min(self.batch_size, count - start)
+                orders = bulk_create(Order, [
+                    Order(customer_id=customer_id, payment_status=self.random.choice(statuses))
+                    for customer_id in self.random.choices(customer_ids, cum_weights=customer_weights, k=size)
+                ], self.batch_size)
+                # placed_at is set by auto_now_add, it is spread out afterwards
+                # with one UPDATE per day
+                by_day = {}
+                for order in orders:
+                    by_day.setdefault(self.placed_at(now), []).append(order.id)
+                for placed_at, ids in by_day.items():
+                    Order.objects.filter(id__in=ids).update(placed_at=placed_at)
+
+                items = []
+                for order in orders:
+                    lines = min(1 + round(self.random.expovariate(1 / max(items_per_order - 1, 0.01))), 20)
+                    chosen = set(self.random.choices(range(len(products)), cum_weights=product_weights, k=lines))
+                    for index in chosen:
+                        product_id, price = products[index]
+                        items.append(OrderItem(
+                            order_id=order.id,
+                            product_id=product_id,
+                            quantity=1 if self.random.random() < 0.7 else self.random.randint(2, 5),
+                            unit_price=price,
+                        ))
+                OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+                items_count += len(items)
+            self.log(f"Created {start + size} of {count} orders ({items_count} items)")
+
+    def placed_at(self, now) -> datetime.datetime:
+        """A random day, weighted by weekday, at noon; orders of a day share it."""
+        while True:
+            day = now - datetime.timedelta(days=self.random.randrange(self.days))
+            if self.random.random() * max(WEEKDAY_WEIGHTS) < WEEKDAY_WEIGHTS[day.weekday()]:
+                return day.replace(hour=12, minute=0, second=0, microsecond=0)
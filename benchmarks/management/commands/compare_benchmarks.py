@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+from .run_benchmarks import report_regressions
+
+
+class Command(BaseCommand):
+    help = 'Compares two run_benchmarks JSON files and fails on regressions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative slowdown tolerated before flagging a regression.')
+
+    def handle(self, *args, **options):
+        with open(options['baseline']) as file:
+            baseline = json.load(file)
+        with open(options['current']) as file:
+            current = json.load(file)
+        report_regressions(self, baseline, current, options['tolerance'])
@@ -0,0 +1,66 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from benchmarks.runner import ClientDriver, HttpDriver, build_scenarios, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Times the storefront and admin hot paths and saves p50/p95/p99 latency, throughput and query counts as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--http', metavar='URL',
+                            help='Benchmark a running server, e.g. http://127.0.0.1:8000, '
+                                 'instead of the in-process test client.')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Concurrent requests with --http.')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=1,
+                            help='Untimed requests per scenario first.')
+        parser.add_argument('--scenario', action='append', default=[],
+                            help='Only run scenarios whose name contains this, can be repeated.')
+        parser.add_argument('--output', help='Save the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare the results with this earlier JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative slowdown tolerated before flagging a regression.')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG and not options['http']:
+            self.stderr.write('DEBUG is on: the debug toolbar and query logging skew the results.')
+
+        scenarios = [
+            scenario for scenario in build_scenarios()
+            if not options['scenario'] or any(part in scenario.name for part in options['scenario'])
+        ]
+        if not scenarios:
+            raise CommandError('No scenario matches.')
+
+        if options['http']:
+            driver = HttpDriver(options['http'], options['threads'])
+        else:
+            driver = ClientDriver()
+        results = run_benchmarks(driver, scenarios, options['iterations'], options['warmup'],
+                                 stdout=self.stdout)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Saved the results to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            report_regressions(self, baseline, results, options['tolerance'])
+
+
+def report_regressions(command, baseline: dict, results: dict, tolerance: float):
+    try:
+        regressions = compare(baseline, results, tolerance)
+    except ValueError as error:
+        raise CommandError(str(error))
+    if regressions:
+        for regression in regressions:
+            command.stderr.write(regression)
+        raise CommandError(f"{len(regressions)} regressions against the baseline.")
+    command.stdout.write(command.style.SUCCESS('No regressions against the baseline.'))
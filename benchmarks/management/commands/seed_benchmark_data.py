@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from benchmarks.generator import DataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Adds generated collections, products, customers and orders to the database for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=50)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--items-per-order', type=float, default=2.5,
+                            help='Average number of items per order.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread orders over this many past days.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        DataGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            days=options['days'],
+            stdout=self.stdout
+        ).generate(
+            collections=options['collections'],
+            products=options['products'],
+            customers=options['customers'],
+            orders=options['orders'],
+            items_per_order=options['items_per_order']
+        )
+        self.stdout.write(self.style.SUCCESS('Seeded the benchmark data.'))
@@ -0,0 +1,276 @@
+import json
+import math
+import time
+import threading
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django import get_version
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from store.models import Collection, Customer, Order, OrderItem, Product
+from storefront.queries import record_queries
+
+
+Scenario = namedtuple('Scenario', ['name', 'method', 'path', 'data', 'content_type'])
+
+FORM = 'application/x-www-form-urlencoded'
+JSON = 'application/json'
+
+QUANTILES = [50, 95, 99]
+
+BENCHMARK_USERNAME = 'benchmark'
+
+# Latency changes smaller than this are noise, whatever the tolerance
+MIN_LATENCY_CHANGE_MS = 1.0
+
+
+def get(name: str, path: str) -> Scenario:
+    return Scenario(name, 'GET', path, None, None)
+
+
+def build_scenarios() -> list:
+    """
+    The hot paths of the storefront and the admin, with ids, slugs and
+    search terms picked from the current data.
+    """
+    product = Product.objects.order_by('id').values('id', 'slug', 'title').first()
+    collection_id = Collection.objects.order_by('-product_count').values_list('id', flat=True).first()
+    customer = Customer.objects.order_by('id').values('last_name').first()
+    order_ids = list(Order.objects.order_by('-id').values_list('id', flat=True)[:10])
+
+    scenarios = [
+        get('admin:order-changelist', '/admin/store/order/'),
+        get('admin:customer-changelist', '/admin/store/customer/'),
+        get('admin:product-changelist', '/admin/store/product/'),
+        get('admin:product-changelist-filtered', '/admin/store/product/?inventory=%3C5'),
+        get('admin:collection-changelist', '/admin/store/collection/'),
+        get('admin:sales-dashboard', '/admin/analytics/dailyproductsales/dashboard/'),
+        get('playground:hello', '/playground/hello/'),
+        get('playground:pdf', '/playground/hello/download_pdf'),
+        get('store:product-list', '/store/products/'),
+        get('store:collection-list', '/store/collections/'),
+        get('store:cart', '/store/cart/'),
+    ]
+    if product is not None:
+        term = product['title'].split()[-1]
+        scenarios += [
+            get('admin:product-search', f'/admin/store/product/?{urlencode({"q": term})}'),
+            get('admin:product-change', f'/admin/store/product/{product["id"]}/change/'),
+            get('store:product-detail', f'/store/products/{product["slug"]}/'),
+            Scenario('store:cart-add', 'POST', '/store/cart/items/',
+                     json.dumps({'product_id': product['id'], 'quantity': 1}), JSON),
+        ]
+    if collection_id is not None:
+        scenarios.append(get('store:collection-products', f'/store/collections/{collection_id}/products/'))
+    if customer is not None:
+        scenarios.append(get('admin:customer-search',
+                             f'/admin/store/customer/?{urlencode({"q": customer["last_name"]})}'))
+    if order_ids:
+        scenarios += [
+            get('admin:order-change', f'/admin/store/order/{order_ids[0]}/change/'),
+            Scenario('admin:download-invoices', 'POST', '/admin/store/order/',
+                     urlencode({'action': 'download_invoices', '_selected_action': order_ids}, doseq=True),
+                     FORM),
+        ]
+    return scenarios
+
+
+def get_benchmark_user() -> User:
+    user = User.objects.filter(username=BENCHMARK_USERNAME).first()
+    if user is None:
+        user = User.objects.create_superuser(BENCHMARK_USERNAME, None, None)
+    return user
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def summarize(latencies: list, errors: int, elapsed: float, queries: list = None) -> dict:
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        **{f'p{q}_ms': percentile(latencies, q) * 1000 for q in QUANTILES},
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'queries': None,
+    }
+    if queries:
+        summary['queries'] = sorted(queries)[len(queries) // 2]
+    return summary
+
+
+class ClientDriver:
+    """
+    Sends the requests in process through the Django test client, one at
+    a time, and counts the queries of each.
+    """
+
+    mode = 'client'
+    threads = 1
+
+    def __init__(self):
+        self.client = Client()
+        self.client.force_login(get_benchmark_user())
+
+    def request(self, scenario: Scenario):
+        if scenario.method == 'GET':
+            return self.client.get(scenario.path)
+        return self.client.generic(scenario.method, scenario.path, scenario.data, scenario.content_type)
+
+    def run(self, scenario: Scenario, iterations: int, warmup: int) -> dict:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for _ in range(warmup):
+                self.request(scenario)
+
+            latencies, queries, errors = [], [], 0
+            started = time.perf_counter()
+            for _ in range(iterations):
+                with record_queries() as recorder:
+                    start = time.perf_counter()
+                    response = self.request(scenario)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    latencies.append(time.perf_counter() - start)
+                queries.append(len(recorder.queries))
+                errors += response.status_code >= 400
+            return summarize(latencies, errors, time.perf_counter() - started, queries)
+
+
+class HttpDriver:
+    """
+    Sends the requests over HTTP to a running server from ``threads``
+    threads at once, logged in as the benchmark user.
+    """
+
+    mode = 'http'
+
+    def __init__(self, base_url: str, threads: int, timeout: float = 60):
+        self.base_url = base_url.rstrip('/')
+        self.threads = threads
+        self.timeout = timeout
+
+        # A session of the benchmark user, as django.contrib.auth.login saves it
+        user = get_benchmark_user()
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        self.csrf_token = get_random_string(32)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}; ' \
+                      f'{settings.CSRF_COOKIE_NAME}={self.csrf_token}'
+
+    def request(self, scenario: Scenario) -> bool:
+        """Send one request and read the whole response, return whether it failed."""
+        data = scenario.data
+        if scenario.content_type == FORM:
+            data = f'{data}&{urlencode({"csrfmiddlewaretoken": self.csrf_token})}'
+        request = urllib.request.Request(
+            self.base_url + scenario.path,
+            data=data.encode() if data is not None else None,
+            method=scenario.method,
+            headers={
+                'Cookie': self.cookie,
+                'X-CSRFToken': self.csrf_token,
+                'Referer': self.base_url + '/',
+                **({'Content-Type': scenario.content_type} if scenario.content_type else {}),
+            }
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return False
+        except (urllib.error.URLError, OSError):
+            return True
+
+    def run(self, scenario: Scenario, iterations: int, warmup: int) -> dict:
+        for _ in range(warmup):
+            self.request(scenario)
+
+        latencies, errors = [], 0
+        lock = threading.Lock()
+
+        def send(_):
+            nonlocal errors
+            start = time.perf_counter()
+            failed = self.request(scenario)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += failed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.threads) as executor:
+            list(executor.map(send, range(iterations)))
+        return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_benchmarks(driver, scenarios: list, iterations: int, warmup: int = 1, stdout=None) -> dict:
+    """Run every scenario and return the results, ready to be saved as JSON."""
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = driver.run(scenario, iterations, warmup)
+        if stdout is not None:
+            stdout.write(format_result(scenario.name, results[scenario.name]))
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'mode': driver.mode,
+        'threads': driver.threads,
+        'iterations': iterations,
+        'django': get_version(),
+        'database': connection.vendor,
+        'rows': {model.__name__: model.objects.count()
+                 for model in (Collection, Product, Customer, Order, OrderItem)},
+        'scenarios': results,
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    queries = f", {result['queries']} queries" if result['queries'] is not None else ''
+    errors = f", {result['errors']} errors" if result['errors'] else ''
+    return (
+        f"{name}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+        f"p99 {result['p99_ms']:.1f}ms, {result['throughput_rps']:.1f} req/s{queries}{errors}"
+    )
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    """
+    Return the regressions of ``current`` over ``baseline``: p95 latency
+    or throughput worse by more than ``tolerance``, more queries, or more
+    errors, for every scenario they share.
+    """
+    if baseline['mode'] != current['mode']:
+        raise ValueError(f"Can't compare {baseline['mode']} and {current['mode']} runs.")
+    regressions = []
+    for name, new in current['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance) \
+                and new['p95_ms'] - old['p95_ms'] > MIN_LATENCY_CHANGE_MS:
+            regressions.append(f"{name}: p95 {old['p95_ms']:.1f}ms -> {new['p95_ms']:.1f}ms")
+        if new['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {old['throughput_rps']:.1f} -> {new['throughput_rps']:.1f} req/s"
+            )
+        if old['queries'] is not None and new['queries'] is not None and new['queries'] > old['queries']:
+            regressions.append(f"{name}: queries {old['queries']} -> {new['queries']}")
+        if new['errors'] > old['errors']:
+            regressions.append(f"{name}: errors {old['errors']} -> {new['errors']}")
+    return regressions
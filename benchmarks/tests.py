@@ -0,0 +1,104 @@
+import datetime
+
+from django.db.models import Count, Sum
+from django.test import TestCase
+from django.utils import timezone
+from store.models import Collection, Customer, Order, OrderItem, Product
+from .generator import DataGenerator
+from .runner import ClientDriver, build_scenarios, compare, percentile, run_benchmarks, summarize
+
+
+def result(p95_ms: float = 100.0, throughput_rps: float = 50.0, queries: int = 5, errors: int = 0) -> dict:
+    return {'p95_ms': p95_ms, 'throughput_rps': throughput_rps, 'queries': queries, 'errors': errors}
+
+
+def run(mode: str = 'client', **scenarios) -> dict:
+    return {'mode': mode, 'scenarios': scenarios}
+
+
+class RunnerTests(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile(values, 10), 1)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_summarize(self):
+        summary = summarize([0.004, 0.001, 0.003, 0.002], 1, 0.5, queries=[3, 9, 3, 4])
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['errors'], 1)
+        self.assertAlmostEqual(summary['mean_ms'], 2.5)
+        self.assertAlmostEqual(summary['p50_ms'], 2.0)
+        self.assertAlmostEqual(summary['p99_ms'], 4.0)
+        self.assertEqual(summary['throughput_rps'], 8.0)
+        # The median, a slow first request doesn't count
+        self.assertEqual(summary['queries'], 4)
+        self.assertIsNone(summarize([0.001], 0, 0)['queries'])
+
+    def test_compare(self):
+        baseline = run(a=result(), b=result())
+        self.assertEqual(compare(baseline, run(a=result(p95_ms=109.0, throughput_rps=46.0), b=result())), [])
+        # New and removed scenarios are ignored
+        self.assertEqual(compare(baseline, run(a=result(), c=result(errors=5))), [])
+
+        regressions = compare(baseline, run(
+            a=result(p95_ms=120.0, throughput_rps=40.0),
+            b=result(queries=6, errors=1),
+        ))
+        self.assertEqual(regressions, [
+            'a: p95 100.0ms -> 120.0ms',
+            'a: throughput 50.0 -> 40.0 req/s',
+            'b: queries 5 -> 6',
+            'b: errors 0 -> 1',
+        ])
+        self.assertEqual(len(compare(baseline, run(a=result(p95_ms=120.0)), tolerance=0.25)), 0)
+
+    def test_compare_ignores_tiny_latency_changes(self):
+        baseline = run(a=result(p95_ms=2.0))
+        self.assertEqual(compare(baseline, run(a=result(p95_ms=2.9))), [])
+        self.assertEqual(len(compare(baseline, run(a=result(p95_ms=3.1)))), 1)
+
+    def test_compare_http_runs_without_query_counts(self):
+        baseline = run('http', a=result(queries=None))
+        self.assertEqual(compare(baseline, run('http', a=result(queries=None))), [])
+
+    def test_compare_refuses_other_modes(self):
+        with self.assertRaises(ValueError):
+            compare(run('client', a=result()), run('http', a=result()))
+
+
+class GeneratorTests(TestCase):
+    def test_generate(self):
+        generator = DataGenerator(seed=1, batch_size=7, days=30)
+        generator.generate(collections=3, products=20, customers=10, orders=40)
+
+        # Migrations may have created rows of their own
+        self.assertEqual(Collection.objects.filter(title__contains=generator.run).count(), 3)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Customer.objects.count(), 10)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertFalse(Order.objects.annotate(items=Count('orderitem')).filter(items=0).exists())
+        self.assertFalse(Order.objects.filter(
+            placed_at__lt=timezone.now() - datetime.timedelta(days=31)).exists())
+
+        # The counters skipped by bulk_create are repaired
+        self.assertEqual(Collection.objects.aggregate(total=Sum('product_count'))['total'], 20)
+        self.assertEqual(Customer.objects.aggregate(total=Sum('orders_count'))['total'], 40)
+        for item in OrderItem.objects.select_related('product')[:20]:
+            self.assertEqual(item.unit_price, item.product.effective_price)
+
+    def test_benchmarks_run_on_generated_data(self):
+        DataGenerator(seed=2).generate(collections=2, products=10, customers=5, orders=10)
+        scenarios = [scenario for scenario in build_scenarios()
+                     if scenario.name in ('admin:order-changelist', 'store:product-detail', 'store:cart-add')]
+        self.assertEqual(len(scenarios), 3)
+
+        results = run_benchmarks(ClientDriver(), scenarios, iterations=2)
+        self.assertEqual(results['mode'], 'client')
+        self.assertEqual(results['rows']['Order'], 10)
+        for name, summary in results['scenarios'].items():
+            with self.subTest(scenario=name):
+                self.assertEqual(summary['requests'], 2)
+                self.assertEqual(summary['errors'], 0)
+                self.assertIsNotNone(summary['queries'])
@@ -0,0 +1,140 @@
+import atexit
+import random
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, When
+
+
+_pending = {}
+_pending_lock = threading.Lock()
+_timer = None
+
+
+def increment(content_type_id: int, object_id: int, delta: int = 1):
+    """
+    Buffer a change to the like count of an object. Buffered changes are
+    written LIKE_COUNTER_FLUSH_INTERVAL seconds after the first one, or as
+    soon as LIKE_COUNTER_FLUSH_SIZE objects have pending changes.
+    """
+    global _timer
+    key = (content_type_id, object_id)
+    with _pending_lock:
+        _pending[key] = _pending.get(key, 0) + delta
+        full = len(_pending) >= settings.LIKE_COUNTER_FLUSH_SIZE
+        if not full and _timer is None:
+            _timer = threading.Timer(settings.LIKE_COUNTER_FLUSH_INTERVAL, _flush_from_timer)
+            _timer.daemon = True
+            _timer.start()
+    if full:
+        flush()
+
+
+def _flush_from_timer():
+    global _timer
+    with _pending_lock:
+        _timer = None
+    try:
+        flush()
+    finally:
+        # The timer thread has its own connection
+        connection.close()
+
+
+def flush() -> int:
+    """
+    Write the buffered changes with two statements, whatever their number:
+    one INSERT of the missing shard rows and one UPDATE adding each delta
+    to a random shard of its object. Returns the number of objects written.
+    """
+    global _pending
+    from .models import LikeCounter
+
+    with _pending_lock:
+        pending, _pending = {key: delta for key, delta in _pending.items() if delta}, {}
+    if not pending:
+        return 0
+
+    shards = {key: random.randrange(settings.LIKE_COUNTER_SHARDS) for key in pending}
+    conditions = {
+        key: Q(content_type_id=key[0], object_id=key[1], shard=shards[key])
+        for key in pending
+    }
+    try:
+        with transaction.atomic():
+            LikeCounter.objects.bulk_create([
+                LikeCounter(content_type_id=content_type_id, object_id=object_id,
+                            shard=shards[(content_type_id, object_id)])
+                for content_type_id, object_id in pending
+            ], ignore_conflicts=True)
+
+            where = Q()
+            for condition in conditions.values():
+                where |= condition
+            LikeCounter.objects.filter(where).update(count=F('count') + Case(
+                *[When(conditions[key], then=delta) for key, delta in pending.items()],
+                default=0,
+                output_field=IntegerField()
+            ))
+    except Exception:
+        # Put the changes back, the next flush will try again
+        with _pending_lock:
+            for key, delta in pending.items():
+                _pending[key] = _pending.get(key, 0) + delta
+        raise
+    return len(pending)
+
+
+atexit.register(flush)
+
+
+def get_counts(content_type_id: int, object_ids) -> dict:
+    """
+    Return the like counts of many objects as a dict of object id to count,
+    summing their shards in one query. This process's unflushed changes are
+    included, objects without likes are left out.
+    """
+    from .models import LikeCounter
+
+    object_ids = list(object_ids)
+    counts = dict(
+        LikeCounter.objects
+                   .filter(content_type_id=content_type_id, object_id__in=object_ids)
+                   .order_by()
+                   .values_list('object_id')
+                   .annotate(total=Sum('count'))
+    )
+    with _pending_lock:
+        for object_id in object_ids:
+            delta = _pending.get((content_type_id, object_id))
+            if delta:
+                counts[object_id] = counts.get(object_id, 0) + delta
+    return {object_id: count for object_id, count in counts.items() if count}
+
+
+def rebuild_counters(batch_size: int = 1000) -> int:
+    """
+    Replace every counter with a single shard counted from LikedItem.
+    Returns the number of objects with likes.
+
+    Changes still buffered in other processes are applied on top once they
+    flush, so run this while likes are quiet.
+    """
+    from .models import LikedItem, LikeCounter
+
+    flush()
+
+    counts = LikedItem.objects \
+        .order_by('content_type_id', 'object_id') \
+        .values_list('content_type_id', 'object_id') \
+        .annotate(count=Count('id'))
+
+    with transaction.atomic():
+        LikeCounter.objects.all().delete()
+        LikeCounter.objects.bulk_create(
+            (LikeCounter(content_type_id=content_type_id, object_id=object_id, shard=0, count=count)
+             for content_type_id, object_id, count in counts),
+            batch_size=batch_size
+        )
+    return LikeCounter.objects.count()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from likes.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the LikeCounter shards from LikedItem.'
+
+    def handle(self, *args, **options):
+        objects = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f"Recounted likes of {objects} objects."))
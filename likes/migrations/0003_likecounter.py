@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def populate_counters(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    counts = LikedItem.objects \
+        .order_by('content_type_id', 'object_id') \
+        .values_list('content_type_id', 'object_id') \
+        .annotate(count=Count('id'))
+    LikeCounter.objects.bulk_create(
+        (LikeCounter(content_type_id=content_type_id, object_id=object_id, shard=0, count=count)
+         for content_type_id, object_id, count in counts),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0002_add_content_object_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='likecounter',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'shard'), name='unique_like_counter_shard'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -2,10 +2,63 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from . import counters
+
+
+class LikedItemQuerySet(models.QuerySet):
+    def with_content_objects(self):
+        """
+        Load ``content_object`` for every row with one query per content
+        type. Content types themselves come from ContentType's cache.
+        """
+        return self.prefetch_related('content_object')
+
+
+class LikedItemManager(models.Manager.from_queryset(LikedItemQuerySet)):
+    def get_like_counts(self, obj_type, obj_ids) -> dict:
+        """
+        Return the number of likes of many objects of ``obj_type`` with one
+        query on their LikeCounter shards, as a dict of object id to count.
+        Objects without likes are left out.
+        """
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return counters.get_counts(content_type.id, obj_ids)
+
+    def get_liked_ids(self, user, obj_type, obj_ids) -> set:
+        """Return which of ``obj_ids`` ``user`` likes, with one query."""
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return set(
+            self.filter(user=user, content_type=content_type, object_id__in=list(obj_ids))
+                .values_list('object_id', flat=True)
+        )
 
 
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+
+
+class LikeCounter(models.Model):
+    """
+    Number of likes of an object, split over LIKE_COUNTER_SHARDS rows so
+    that concurrent likes of a popular object don't all wait on one row.
+    A shard can go negative, only the sum of the shards is meaningful.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'shard'],
+                                    name='unique_like_counter_shard'),
+        ]
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import counters
+from .models import LikedItem
+
+
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(
+            lambda: counters.increment(instance.content_type_id, instance.object_id, 1))
+
+
+@receiver(post_delete, sender=LikedItem)
+def count_unlike(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: counters.increment(instance.content_type_id, instance.object_id, -1))
@@ -1,3 +1,140 @@
-from django.test import TestCase
+import importlib
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from . import counters
+from .models import LikeCounter, LikedItem
+
+
+@override_settings(LIKE_COUNTER_FLUSH_SIZE=3, LIKE_COUNTER_SHARDS=4)
+class LikeCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{number}') for number in range(3)]
+        cls.content_type = ContentType.objects.get_for_model(User)
+
+    def setUp(self):
+        # Timers would flush from another thread, outside the test's transaction
+        timer = mock.patch.object(counters.threading, 'Timer')
+        self.timer = timer.start()
+        self.addCleanup(timer.stop)
+        counters._pending.clear()
+        counters._timer = None
+        self.addCleanup(counters._pending.clear)
+
+    def increment(self, object_id: int, delta: int = 1):
+        counters.increment(self.content_type.id, object_id, delta)
+
+    def stored_counts(self) -> dict:
+        return dict(LikeCounter.objects
+                               .order_by()
+                               .values_list('object_id')
+                               .annotate(total=Sum('count')))
+
+    def like(self, user, obj) -> LikedItem:
+        with self.captureOnCommitCallbacks(execute=True):
+            return LikedItem.objects.create(user=user, content_type=self.content_type, object_id=obj.id)
+
+    def test_changes_are_buffered_until_the_timer(self):
+        self.increment(1)
+        self.increment(1)
+        self.increment(2, -1)
+        self.assertEqual(self.timer.call_count, 1)
+        self.assertEqual(self.stored_counts(), {})
+        self.assertEqual(counters.get_counts(self.content_type.id, [1, 2, 3]), {1: 2, 2: -1})
+
+        with mock.patch.object(counters.connection, 'close'):
+            self.timer.call_args.args[1]()
+        self.assertIsNone(counters._timer)
+        self.assertEqual(self.stored_counts(), {1: 2, 2: -1})
+
+    def test_flush_by_size(self):
+        self.increment(1)
+        self.increment(2)
+        self.assertEqual(self.stored_counts(), {})
+        self.increment(3)
+        self.assertEqual(counters._pending, {})
+        self.assertEqual(self.stored_counts(), {1: 1, 2: 1, 3: 1})
+
+    def test_flush_writes_with_two_statements(self):
+        for object_id in range(50):
+            counters._pending[(self.content_type.id, object_id)] = 2
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(counters.flush(), 50)
+        writes = [query['sql'] for query in context.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(sum(self.stored_counts().values()), 100)
+        self.assertEqual(counters.flush(), 0)
+
+    def test_failed_flush_keeps_the_changes(self):
+        self.increment(1)
+        with mock.patch.object(LikeCounter.objects, 'bulk_create', side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            counters.flush()
+        self.increment(1)
+        self.assertEqual(counters._pending, {(self.content_type.id, 1): 2})
+
+    def test_buffered_changes_are_flushed_at_exit(self):
+        with mock.patch('atexit.register') as register:
+            importlib.reload(counters)
+        register.assert_called_once_with(counters.flush)
+
+    def test_likes_are_counted(self):
+        first, second, third = self.users
+        for user in self.users:
+            self.like(user, first)
+        self.like(first, second)
+        self.assertEqual(LikedItem.objects.get_like_counts(User, [first.id, second.id, third.id]),
+                         {first.id: 3, second.id: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LikedItem.objects.filter(object_id=second.id).get().delete()
+        counters.flush()
+        self.assertEqual(LikedItem.objects.get_like_counts(User, [first.id, second.id]), {first.id: 3})
+
+    def test_rebuild_counters(self):
+        first, second, _ = self.users
+        for user in self.users:
+            self.like(user, first)
+        self.like(first, second)
+        counters.flush()
+        # Drifted, and buffered changes that were never written
+        LikeCounter.objects.update(count=10)
+        self.increment(second.id, 5)
+
+        self.assertEqual(counters.rebuild_counters(), 2)
+        self.assertEqual(counters._pending, {})
+        self.assertEqual(list(LikeCounter.objects.order_by('object_id').values_list('object_id', 'shard', 'count')),
+                         [(first.id, 0, 3), (second.id, 0, 1)])
+
+    def test_reconcile_like_counts_command(self):
+        self.like(self.users[0], self.users[1])
+        LikeCounter.objects.all().delete()
+        call_command('reconcile_like_counts', stdout=mock.Mock())
+        self.assertEqual(self.stored_counts(), {self.users[1].id: 1})
+
+    def test_get_liked_ids(self):
+        first, second, third = self.users
+        self.like(first, second)
+        self.like(first, third)
+        self.like(second, first)
+        with self.assertNumQueries(1):
+            liked = LikedItem.objects.get_liked_ids(first, User, iter([first.id, second.id, 999]))
+        self.assertEqual(liked, {second.id})
+        with self.assertNumQueries(1):
+            self.assertEqual(LikedItem.objects.get_liked_ids(third, User, [first.id, second.id]), set())
+
+    def test_with_content_objects(self):
+        first, second, _ = self.users
+        self.like(first, second)
+        self.like(second, first)
+        with self.assertNumQueries(2):
+            objects = [item.content_object for item in LikedItem.objects.with_content_objects().order_by('id')]
+        self.assertEqual(objects, [second, first])
@@ -1,28 +1,50 @@
 import io
-import os
-import zipfile
 import tempfile
 import datetime
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-
-from django.http import FileResponse, HttpResponse
+from pathlib import Path
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
 from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.db.models.aggregates import Count
-from django.urls import reverse
+from django.urls import path, reverse
+from django.utils import timezone
 from django.utils.html import format_html, urlencode
 from django.db.models import Q, F, Value
 from django.db.models import QuerySet
-from . import models
+from tags.filters import TagFilter
+from . import catalog, exports, imports, invoices, models
+from .pagination import KeysetPaginationMixin
+from .search import IndexedSearchMixin, customer_index, product_index
+
+
+INVOICE_ARCHIVE_SPOOL_SIZE = 10 * 1024 * 1024
+
+
+@admin.action(description="Export as CSV")
+def export_csv(modeladmin, request, queryset: QuerySet):
+    return exports.export_response(queryset, 'csv')
+
+
+@admin.action(description="Export as JSONL")
+def export_jsonl(modeladmin, request, queryset: QuerySet):
+    return exports.export_response(queryset, 'jsonl')
 
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(IndexedSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
+    actions = [export_csv, export_jsonl]
     list_display = ['first_name', 'last_name', 'email', 'phone', 'membership', 'orders']
     list_editable = ['membership']
     list_per_page = 20
     ordering = ['first_name', 'last_name']
     search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    search_index = customer_index
 
     @admin.display(ordering='orders_count')
     def orders(self, customer):
@@ -34,11 +56,6 @@ class CustomerAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Orders</a>', url, customer.orders_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            orders_count=Count('order')
-        )
-
 
 class InventoryFilter(admin.SimpleListFilter):
     title = 'inventory'
@@ -63,20 +80,33 @@ class InventoryFilter(admin.SimpleListFilter):
             return queryset.filter(inventory__gt=40)
 
 
+class ProductImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or JSONL with a slug column, plus any of "
+                                     + ", ".join(imports.PRODUCT_COLUMNS) + ".")
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        extension = Path(file.name).suffix.lower().lstrip('.')
+        if extension not in ('csv', 'jsonl'):
+            raise forms.ValidationError("Upload a .csv or .jsonl file.")
+        return file
+
+
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
-    actions = ['clear_inventory']
+class ProductAdmin(IndexedSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
+    actions = ['clear_inventory', export_csv, export_jsonl]
     autocomplete_fields = ['collection']
     prepopulated_fields = {
         'slug': ['title', 'collection']
     }
-    list_display = ['title', 'unit_price', 'inventory_status' ,'collection_title']
+    list_display = ['title', 'unit_price', 'effective_price', 'inventory_status' ,'collection_title']
     list_editable = ['unit_price']
-    list_filter = ['collection', 'last_update', InventoryFilter]
+    list_filter = ['collection', 'last_update', InventoryFilter, TagFilter]
     list_select_related = ['collection']
     list_per_page = 20
     ordering = ['title', 'unit_price']
     search_fields = ['title__istartswith']
+    search_index = product_index
 
     @admin.display(ordering='title')
     def collection_title(self, product):
@@ -98,13 +128,54 @@ class ProductAdmin(admin.ModelAdmin):
     
     @admin.action(description="Clear Inventory")
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        # last_update too, it is part of the catalog API's ETags
+        updated_count = queryset.update(inventory=0, last_update=timezone.now())
+        # update() sends no signals, drop the cached products ourselves
+        catalog.invalidate_catalog()
         self.message_user(
             request,
             f"{updated_count} products was successfully updated.",
             messages.SUCCESS
         )
 
+    def get_urls(self):
+        return [
+            path(
+                'import/',
+                self.admin_site.admin_view(self.import_products),
+                name='store_product_import'
+            ),
+        ] + super().get_urls()
+
+    def import_products(self, request):
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+
+        result = None
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            file = form.cleaned_data['file']
+            result = imports.import_products(
+                io.TextIOWrapper(file, encoding='utf-8-sig', newline=''),
+                Path(file.name).suffix.lower().lstrip('.')
+            )
+            self.message_user(
+                request,
+                f"Imported {file.name}: {result}",
+                messages.WARNING if result.error_count else messages.SUCCESS
+            )
+            if not result.error_count:
+                return redirect('admin:store_product_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Import products",
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/store/product/import.html', context)
+
 @admin.register(models.Collection)
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ['title', 'product_count']
@@ -120,157 +191,159 @@ class CollectionAdmin(admin.ModelAdmin):
                 'collection__id': str(collection.id),
             }))
         return format_html('<a href="{}">{}</a>', url, collection.product_count)
-    
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            product_count=Count('product')
-        )
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """
+    Autocomplete widget that renders its selected option from an object
+    the form has already loaded, instead of querying for it on every row.
+    """
+    selected_object = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = self.selected_object
+        if selected is None or [str(v) for v in value if v] != [str(selected.pk)]:
+            return super().optgroups(name, value, attr)
+
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name,
+            selected.pk,
+            self.choices.field.label_from_instance(selected),
+            True,
+            len(options)
+        ))
+        return [(None, options, 0)]
+
+
+class OrderItemInlineForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.product_id:
+            widget = self.fields['product'].widget
+            widget = getattr(widget, 'widget', widget)
+            widget.selected_object = self.instance.product
 
 
 class OrderItemInline(admin.TabularInline):
     autocomplete_fields = ['product']
+    form = OrderItemInlineForm
     model = models.OrderItem
     min_num = 1
     max_num = 10
     extra = 0
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'product':
+            kwargs['widget'] = PreloadedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
-    actions = ['download_invoices']
-    list_display = ['id', 'placed_at', 'payment_status', 'customer']
+class OrderAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    actions = ['download_invoices', export_csv, export_jsonl]
+    list_display = ['id', 'placed_at', 'payment_status', 'customer', 'total']
     inlines = [OrderItemInline]
     list_editable = ['payment_status']
-    list_related = ['customer']
+    list_select_related = ['customer']
     autocomplete_fields = ['customer']
     list_per_page = 20
     ordering = ['placed_at', 'id']
-    
+
+    @admin.display(ordering='grand_total')
+    def total(self, order):
+        return f"{order.grand_total:.2f} INR"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
 
     @admin.action(description="Download Invoice")
     def download_invoices(self, request, queryset: QuerySet):
-        # order_details_queryset = queryset. \
-        #                          prefetch_related('customer')
-
-        self.message_user(
-            request,
-            f"Invoice downloaded successfully.",
-            messages.SUCCESS
+        payloads = invoices.get_invoice_payloads(queryset)
+
+        # A single order is served as a plain PDF, anything more as a ZIP
+        selected = queryset.count()
+        if selected == 1:
+            return self.download_invoice(request, **next(payloads))
+
+        # Large selections are handed over to the process_invoice_jobs worker
+        if selected > settings.INVOICE_EXPORT_SYNC_LIMIT:
+            job = invoices.enqueue_export_job(queryset, user=request.user)
+            self.message_user(
+                request,
+                f"Exporting {selected} invoices in the background.",
+                messages.SUCCESS
+            )
+            return redirect('admin:store_invoiceexportjob_change', job.id)
+
+        # Invoices are spooled to disk once the archive outgrows memory
+        tmp = tempfile.SpooledTemporaryFile(max_size=INVOICE_ARCHIVE_SPOOL_SIZE)
+        invoices.write_invoice_archive(payloads, tmp)
+        tmp.seek(0)
+
+        filename = f"invoices-{datetime.date.today().strftime('%Y%m%d')}.zip"
+        return FileResponse(tmp, as_attachment=True, filename=filename)
+
+    def download_invoice(self, request, **payload):
+        return FileResponse(invoices.open_invoice(payload), as_attachment=True,
+                            filename=invoices.invoice_filename(payload['order_id']))
+
+
+@admin.register(models.InvoiceExportJob)
+class InvoiceExportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'progress', 'requested_by', 'created_at', 'download']
+    list_filter = ['status']
+    list_select_related = ['requested_by']
+    list_per_page = 20
+    fields = ['status', 'progress', 'download', 'requested_by',
+              'created_at', 'started_at', 'finished_at', 'error']
+    readonly_fields = fields
+
+    @admin.display()
+    def progress(self, job):
+        if not job.total:
+            return '-'
+        percent = job.processed * 100 // job.total
+        return f"{job.processed} / {job.total} ({percent}%)"
+
+    @admin.display()
+    def download(self, job):
+        if job.status != models.InvoiceExportJob.STATUS_COMPLETE:
+            return '-'
+        url = reverse('admin:store_invoiceexportjob_download', args=[job.id])
+        return format_html('<a href="{}">Download ZIP</a>', url)
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:job_id>/download/',
+                self.admin_site.admin_view(self.download_archive),
+                name='store_invoiceexportjob_download'
+            ),
+        ] + super().get_urls()
+
+    def download_archive(self, request, job_id: int):
+        job = get_object_or_404(
+            models.InvoiceExportJob,
+            pk=job_id,
+            status=models.InvoiceExportJob.STATUS_COMPLETE
         )
+        if not self.has_view_permission(request, job):
+            raise Http404
 
-        # with tempfile.SpooledTemporaryFile() as tmp:
-        #     with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive:
-        for index, order in enumerate(queryset):
-
-            # Set annotated fields
-            full_name = order.customer.first_name \
-                        + ' ' \
-                        + order.customer.last_name
-            
-            order_date = order.placed_at
-            order_items = list(models.OrderItem.objects.filter(order__id=order.id).select_related('product'))
-            total_invoice_amount = 0.0
-            product_set = []
-
-            # Annotate Total and all products
-            for ii, order_item in enumerate(order_items, start=1):
-                
-                current_total = float(order_item.unit_price) * order_item.quantity
-                total_invoice_amount += current_total
-                current_product = {
-                    'title': order_item.product.title,
-                    'unit_price': order_item.unit_price,
-                    'quantity': order_item.quantity,
-                    'net_price': current_total,
-                }
-
-                product_set.append(current_product.copy())
-
-                # print(f"{ii} {order_item.product.title} {order_item.unit_price} {order_item.quantity} {current_total}")
-
-
-            return self.download_invoice(
-                request=request,
-                order_id=order.id,
-                customer_name=full_name,
-                placed_at=order_date.strftime("%d-%m-%Y"),
-                invoice_date=datetime.datetime.today().strftime("%d/%m/%Y"),
-                product_set=product_set,
-                grand_total=total_invoice_amount
-                )
-
-
-    def download_invoice(self, request, order_id: int, customer_name: str, 
-        placed_at: str, invoice_date: str, grand_total: float,
-        product_set):
-        
-        # Create a file-like buffer to receive PDF data.
-        buffer = io.BytesIO()
-
-        # Create the PDF object, using the buffer as its "file."
-        p = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        print(width, height)
-        p.setFont("Helvetica", 14)
+        try:
+            archive = open(Path(settings.INVOICE_EXPORT_DIR) / job.archive, 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(archive, as_attachment=True, filename=job.archive)
 
-        # Draw things on the PDF. Here's where the PDF generation happens.
-        # See the ReportLab documentation for the full list of functionality.
+    def has_add_permission(self, request):
+        return False
 
-        x1 = 20  # Padding from left
-        y1 = height - 20  # Padding from bottom
-        p.drawString(x1, y1, 'Sales Invoice')
-        
-
-        # Customer Info
-        y1 -= 40
-        p.drawString(x1, y1, f'Order ID: {order_id}')
-        p.drawString(410, y1, f"Order Date: {placed_at}")
-
-        y1 -= 20
-        p.drawString(x1, y1, f'Customer Name: {customer_name}')
-        
-        y1 -= 20
-        p.drawString(x1, y1, 'Contact Number: +91******6789')
-
-        y1 -= 20
-        p.drawString(x1, y1, f'Customer Email: ********{customer_name[-3:]}123@gmail.com')
-
-
-        # Adress Section
-        y1 -= 36
-        address_padding_x = 80
-        p.drawString(x1, y1, f'Address:')
-        p.drawString(address_padding_x, y1, f'69, 420th floor, Green City Appartments')
-        y1 -= 20
-        p.drawString(address_padding_x, y1, f'Vakola, Santacruz East, Mumbai, Maharashtra')
-        y1 -= 20
-        p.drawString(address_padding_x, y1, f'Mumbai - 400055')
-
-        # Add QR CODE
-        QR_PATH: str = r'C:\Users\tejas\Projects\Web Development\storefront\store\e-store-text-400px.png'
-        p.drawImage(QR_PATH, 410, y1, width=120, height=120)
-
-        # Product Chart
-        y1 -= 60
-
-        tbale_start_y = y1
-        p.line(x1 - 5, y1 + 15, width - 15, y1 + 15)
-        p.drawString(x1, y1, f"{'No.':<5} {'Title':<80} {'Unit Price':<16} {'Quantity':<12} {'Net Price':<16}")
-        p.line(x1 - 5, y1 - 5, width - 15, y1 - 5)
-
-        for ii, product in enumerate(product_set, start=1):
-            y1 -= 20
-            p.drawString(x1, y1, f"{ii:<5} {product.get('title'):<80}")
-            p.drawString(380, y1, str(product.get('unit_price')))
-            p.drawString(480, y1, str(product.get('quantity')))
-            p.drawString(540, y1, str(product.get('net_price')))
-            p.line(x1 - 5, y1 - 5, width - 15, y1 - 5)
-
-        y1 -= 28
-        p.drawString(410, y1, f"Grand Total:       {grand_total} INR")
-
-        # Close the PDF object cleanly, and we're done.
-        p.showPage()
-        p.save()
-        buffer.seek(0)
-
-        return FileResponse(buffer, as_attachment=True, filename='hello.pdf')
+    def has_change_permission(self, request, obj=None):
+        return False
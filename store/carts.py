@@ -0,0 +1,234 @@
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from . import checkout as checkout_service
+from .models import Cart, CartItem
+
+
+CART_PREFIX = 'cart:'
+LOCK_SUFFIX = ':lock'
+
+
+class CartLocked(Exception):
+    pass
+
+
+def cart_key(cart_id) -> str:
+    return f'{CART_PREFIX}{cart_id}'
+
+
+def writes_through() -> bool:
+    """
+    Whether cart changes are saved right away. They can only be left to
+    flush_carts when every process shares the cache, which process-local
+    backends don't.
+    """
+    if settings.CART_WRITE_THROUGH is not None:
+        return settings.CART_WRITE_THROUGH
+    return isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+@contextmanager
+def locked(key: str):
+    """
+    Hold a lock on ``key`` shared by every process using the cache, or
+    raise CartLocked after waiting CART_LOCK_TIMEOUT seconds. The lock
+    expires after as long, in case its holder crashed, and is only
+    released by the holder that took it.
+    """
+    lock_key = key + LOCK_SUFFIX
+    token = uuid.uuid4().hex
+    timeout = settings.CART_LOCK_TIMEOUT
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, token, timeout):
+        if time.monotonic() >= deadline:
+            raise CartLocked(f"{key} is locked.")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def load(cart_id) -> dict:
+    """
+    Return the hot state of a cart: its ``items`` (product id -> quantity),
+    the ``saved`` items as of the last flush, and when it was ``touched``.
+    Falls back to the CartItem rows when the cache lost the cart.
+    """
+    state = cache.get(cart_key(cart_id))
+    if state is None:
+        items = dict(
+            CartItem.objects
+                    .filter(cart_id=cart_id)
+                    .order_by('product_id')
+                    .values_list('product_id')
+                    .annotate(quantity=Sum('quantity'))
+        )
+        state = {'items': items, 'saved': dict(items), 'touched': time.time()}
+    return state
+
+
+def store(cart_id, state: dict):
+    cache.set(cart_key(cart_id), state, settings.CART_CACHE_TIMEOUT)
+
+
+def is_dirty(state: dict) -> bool:
+    return state['items'] != state['saved']
+
+
+def create_cart() -> int:
+    cart = Cart.objects.create()
+    store(cart.id, {'items': {}, 'saved': {}, 'touched': time.time()})
+    return cart.id
+
+
+def exists(cart_id) -> bool:
+    """Whether a cart is still there, ``purge_carts`` deletes old ones."""
+    return cache.get(cart_key(cart_id)) is not None or Cart.objects.filter(id=cart_id).exists()
+
+
+def get_items(cart_id) -> dict:
+    return load(cart_id)['items']
+
+
+def update_items(cart_id, change) -> dict:
+    """
+    Apply ``change`` to the items of a cart in the cache. The cart is
+    written to the database later by ``flush``, or right away when the
+    cache isn't shared.
+    """
+    with locked(cart_key(cart_id)):
+        state = load(cart_id)
+        was_dirty = is_dirty(state)
+        change(state['items'])
+        state['touched'] = time.time()
+        if writes_through():
+            save(cart_id, state)
+        else:
+            # Marks the cart for flush_carts, once per flush rather than
+            # on every change
+            if not was_dirty and is_dirty(state):
+                Cart.objects.filter(id=cart_id, dirty_since=None).update(dirty_since=timezone.now())
+            store(cart_id, state)
+    return state['items']
+
+
+def add_item(cart_id, product_id: int, quantity: int = 1) -> dict:
+    def change(items):
+        items[product_id] = min(items.get(product_id, 0) + quantity, settings.CART_MAX_QUANTITY)
+    return update_items(cart_id, change)
+
+
+def set_quantity(cart_id, product_id: int, quantity: int) -> dict:
+    def change(items):
+        if quantity > 0:
+            items[product_id] = min(quantity, settings.CART_MAX_QUANTITY)
+        else:
+            items.pop(product_id, None)
+    return update_items(cart_id, change)
+
+
+def save(cart_id, state: dict) -> bool:
+    """
+    Write the changes to a cart since the last flush as CartItem rows,
+    with one DELETE and one bulk INSERT, and store the flushed state.
+    Returns False if there were none. The caller holds the cart's lock.
+    """
+    flushed = is_dirty(state)
+    if flushed:
+        items, saved = state['items'], state['saved']
+        changed = {
+            product_id for product_id in items.keys() | saved.keys()
+            if items.get(product_id) != saved.get(product_id)
+        }
+        with transaction.atomic():
+            CartItem.objects.filter(cart_id=cart_id, product_id__in=changed).delete()
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=cart_id, product_id=product_id, quantity=items[product_id])
+                for product_id in changed if product_id in items
+            ])
+            Cart.objects.filter(id=cart_id).exclude(dirty_since=None).update(dirty_since=None)
+        state['saved'] = dict(items)
+    store(cart_id, state)
+    return flushed
+
+
+def flush(cart_id) -> bool:
+    """Save the changes to a cart since the last flush, see ``save``."""
+    with locked(cart_key(cart_id)):
+        state = cache.get(cart_key(cart_id))
+        if state is None:
+            # Evicted, the changes since the last flush are lost
+            Cart.objects.filter(id=cart_id).update(dirty_since=None)
+            return False
+        return save(cart_id, state)
+
+
+def flush_idle_carts(idle_seconds: int = None, batch_size: int = 1000) -> int:
+    """Flush the dirty carts untouched for ``idle_seconds``, return how many."""
+    if idle_seconds is None:
+        idle_seconds = settings.CART_IDLE_TIMEOUT
+    cutoff = time.time() - idle_seconds
+
+    flushed = 0
+    dirty = Cart.objects \
+        .exclude(dirty_since=None) \
+        .order_by('id') \
+        .values_list('id', flat=True)
+    last_id = 0
+    while True:
+        cart_ids = list(dirty.filter(id__gt=last_id)[:batch_size])
+        if not cart_ids:
+            return flushed
+        last_id = cart_ids[-1]
+
+        states = cache.get_many([cart_key(cart_id) for cart_id in cart_ids])
+        for cart_id in cart_ids:
+            state = states.get(cart_key(cart_id))
+            if state is not None and state['touched'] > cutoff:
+                continue
+            try:
+                flushed += flush(cart_id)
+            except CartLocked:
+                # Being changed, it isn't idle
+                pass
+
+
+def checkout(cart_id, customer):
+    """Flush the cart and turn it into an order, see ``checkout.checkout``."""
+    flush(cart_id)
+    order = checkout_service.checkout(cart_id, customer)
+    cache.delete(cart_key(cart_id))
+    return order
+
+
+def purge_carts(created_before, batch_size: int = 1000) -> int:
+    """
+    Delete carts created before ``created_before`` with their items,
+    ``batch_size`` carts at a time. Returns how many were deleted.
+    """
+    deleted = 0
+    while True:
+        cart_ids = list(
+            Cart.objects
+                .filter(created_at__lt=created_before)
+                .order_by('created_at')
+                .values_list('id', flat=True)[:batch_size]
+        )
+        if not cart_ids:
+            return deleted
+
+        # Cascades to the items with one DELETE per batch
+        Cart.objects.filter(id__in=cart_ids).delete()
+        cache.delete_many([cart_key(cart_id) for cart_id in cart_ids])
+        deleted += len(cart_ids)
@@ -0,0 +1,157 @@
+import time
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from .models import Collection, Product
+
+
+CATALOG = 'catalog'
+COLLECTIONS = 'collections'
+# Bumped by any product change, for listings spanning many products
+PRODUCTS = 'products'
+PRODUCT_SLUGS = 'product-slugs'
+
+VERSION_PREFIX = 'catalog:version:'
+LOCK_PREFIX = 'catalog:lock:'
+
+# Placeholder cached for lookups that found nothing
+MISSING = 'catalog:missing'
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def product_scope(pk) -> str:
+    return f'product:{pk}'
+
+
+def collection_scope(pk) -> str:
+    return f'collection:{pk}'
+
+
+def get_versions(scopes: list) -> str:
+    keys = [VERSION_PREFIX + scope for scope in scopes]
+    versions = cache.get_many(keys)
+    return '.'.join(str(versions.get(key, 0)) for key in keys)
+
+
+def bump(*scopes):
+    """Invalidate every entry built from one of ``scopes``."""
+    for scope in scopes:
+        key = VERSION_PREFIX + scope
+        # Versions never expire, a reset to 0 could bring stale entries back
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+
+def products_version() -> str:
+    """Changes whenever a product is saved, deleted or bulk written."""
+    return get_versions([CATALOG, PRODUCTS])
+
+
+def invalidate_catalog():
+    """Invalidate everything, for bulk writes that don't send signals."""
+    bump(CATALOG)
+
+
+def is_missing(value) -> bool:
+    return isinstance(value, str) and value == MISSING
+
+
+def _local_lock(key: str) -> threading.Lock:
+    with _local_locks_guard:
+        return _local_locks.setdefault(key, threading.Lock())
+
+
+def read_through(name: str, scopes: list, compute):
+    """
+    Return the cached value of ``compute()`` for ``name``, computing it
+    at most once at a time.
+
+    The cache key embeds the current versions of the catalog and of
+    ``scopes``, and signal handlers bump those versions on save and
+    delete. A stale entry is then never read again, even if a slow reader
+    writes it back after the change.
+    """
+    scopes = [CATALOG, *scopes]
+    key = f'catalog:{name}:{get_versions(scopes)}'
+
+    value = cache.get(key)
+    if value is not None:
+        return None if is_missing(value) else value
+
+    # Threads of this process queue up here, other processes on the
+    # shared lock below. Whoever gets through first fills the entry.
+    with _local_lock(key):
+        value = cache.get(key)
+        if value is None:
+            lock_key = LOCK_PREFIX + key
+            lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+            deadline = time.monotonic() + lock_timeout
+
+            while not cache.add(lock_key, 1, lock_timeout):
+                time.sleep(0.05)
+                value = cache.get(key)
+                if value is not None or time.monotonic() > deadline:
+                    break
+
+            if value is None:
+                try:
+                    value = compute()
+                    if value is None:
+                        value = MISSING
+                    cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+                finally:
+                    cache.delete(lock_key)
+
+    with _local_locks_guard:
+        _local_locks.pop(key, None)
+
+    return None if is_missing(value) else value
+
+
+def get_product(pk):
+    """Return the product with its promotions, or None."""
+    def compute():
+        return Product.objects \
+            .prefetch_related('promotions') \
+            .filter(pk=pk) \
+            .first()
+
+    return read_through(f'product:{pk}', [product_scope(pk)], compute)
+
+
+def get_product_by_slug(slug: str):
+    pk = read_through(
+        f'product-slug:{slug}',
+        [PRODUCT_SLUGS],
+        lambda: Product.objects.filter(slug=slug).order_by('id').values_list('id', flat=True).first()
+    )
+    return None if pk is None else get_product(pk)
+
+
+def get_collection(pk):
+    """Return the collection with its featured product, or None."""
+    collection = read_through(
+        f'collection:{pk}',
+        [collection_scope(pk)],
+        lambda: Collection.objects.filter(pk=pk).first()
+    )
+    # Cached under its own scope, so that saving a product doesn't have to
+    # look up the collections featuring it
+    if collection is not None and collection.featured_product_id is not None:
+        collection.featured_product = get_product(collection.featured_product_id)
+    return collection
+
+
+def get_collections() -> list:
+    return read_through(
+        'collections',
+        [COLLECTIONS],
+        lambda: list(Collection.objects.select_related('featured_product'))
+    )
+
@@ -0,0 +1,110 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+from django.utils import timezone
+from . import catalog
+from .models import CartItem, Order, OrderItem, Product
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class InsufficientInventory(CheckoutError):
+    def __init__(self, product_ids: list):
+        self.product_ids = product_ids
+        super().__init__(f"Not enough inventory for products {product_ids}.")
+
+
+def reserve_inventory(quantities: dict) -> bool:
+    """
+    Take ``quantities`` (product id -> quantity) out of inventory with a
+    single UPDATE, only if every product has enough left.
+
+    Each row is decremented by its own quantity and only matches while
+    ``inventory >= quantity``, so concurrent checkouts can't oversell and
+    rows are locked just for the duration of the statement. Returns False
+    when a product is short, the caller's transaction must then be rolled
+    back to restore the other products.
+    """
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(pk=product_id, inventory__gte=quantity)
+
+    reserved = Product.objects.filter(enough).update(
+        inventory=Case(
+            *[When(pk=product_id, then=F('inventory') - quantity)
+              for product_id, quantity in quantities.items()],
+            output_field=IntegerField()
+        ),
+        last_update=timezone.now()
+    )
+    return reserved == len(quantities)
+
+
+def checkout(cart_id, customer) -> Order:
+    """
+    Turn a cart into a pending order for ``customer`` in one transaction.
+
+    Inventory is reserved and every line item's ``unit_price`` snapshots
+    the product's current price after promotions. The number of statements doesn't depend
+    on the number of line items. Raises EmptyCart, or
+    InsufficientInventory with nothing changed.
+    """
+    try:
+        with transaction.atomic():
+            quantities = dict(
+                CartItem.objects
+                        .filter(cart_id=cart_id)
+                        .order_by('product_id')
+                        .values_list('product_id')
+                        .annotate(quantity=Sum('quantity'))
+            )
+            if not quantities:
+                raise EmptyCart(f"Cart {cart_id} is empty.")
+
+            if not reserve_inventory(quantities):
+                raise InsufficientInventory([])
+
+            # Read after the UPDATE, which holds the rows until commit
+            products = Product.objects \
+                .filter(pk__in=quantities) \
+                .values_list('pk', 'effective_price', 'collection_id')
+            prices = {product_id: price for product_id, price, _ in products}
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=prices[product_id]
+                )
+                for product_id, quantity in quantities.items()
+            ])
+
+            # A concurrent checkout of the same cart already emptied it
+            deleted, _ = CartItem.objects.filter(cart_id=cart_id).delete()
+            if not deleted:
+                raise EmptyCart(f"Cart {cart_id} is empty.")
+
+            # update() sends no signals, refresh the cached inventory ourselves
+            scopes = {catalog.PRODUCTS} \
+                | {catalog.product_scope(product_id) for product_id in prices} \
+                | {catalog.collection_scope(collection_id) for _, _, collection_id in products}
+            transaction.on_commit(lambda: catalog.bump(*scopes))
+    except InsufficientInventory:
+        # Rolled back by now, tell the caller which products ran out
+        available = dict(
+            Product.objects
+                   .filter(pk__in=quantities)
+                   .values_list('pk', 'inventory')
+        )
+        raise InsufficientInventory(sorted(
+            product_id for product_id, quantity in quantities.items()
+            if available.get(product_id, 0) < quantity
+        )) from None
+
+    return order
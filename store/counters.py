@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def adjust_count(model, field: str, pk, delta: int):
+    """Atomically add ``delta`` to a stored counter, never going below zero."""
+    if pk is None or not delta:
+        return
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def move_count(model, field: str, old_pk, new_pk):
+    """Move one unit of a counter from one row to another."""
+    if old_pk == new_pk:
+        return
+    with transaction.atomic():
+        adjust_count(model, field, old_pk, -1)
+        adjust_count(model, field, new_pk, 1)
+
+
+def repair_counts(model, field: str, related_model, related_field: str, pks=None) -> int:
+    """
+    Recompute ``model.field`` as the number of ``related_model`` rows
+    pointing at each row through ``related_field``, or at the rows in
+    ``pks`` only.
+
+    Only rows whose stored value has drifted are written, with a single
+    UPDATE. Returns the number of rows repaired.
+    """
+    actual = Coalesce(
+        Subquery(
+            related_model.objects
+                .filter(**{related_field: OuterRef('pk')})
+                .order_by()
+                .values(related_field)
+                .annotate(count=Count('pk'))
+                .values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+    queryset = model.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return queryset \
+        .annotate(actual=actual) \
+        .exclude(**{field: F('actual')}) \
+        .update(**{field: actual})
+
+
+def repair_customer_orders_count() -> int:
+    from .models import Customer, Order
+    return repair_counts(Customer, 'orders_count', Order, 'customer')
+
+
+def repair_collection_product_count(pks=None) -> int:
+    from .models import Collection, Product
+    return repair_counts(Collection, 'product_count', Product, 'collection', pks)
@@ -0,0 +1,151 @@
+import csv
+import json
+import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from . import models
+
+
+class Echo:
+    """File-like object that hands back what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def iterate_in_chunks(queryset, fields: list, chunk_size: int):
+    """
+    Yield ``values_list(*fields)`` rows of ``queryset`` in primary key order,
+    fetching ``chunk_size`` rows per query.
+
+    Each chunk seeks past the last primary key seen, so memory stays flat
+    whatever the size of the table. ``QuerySet.iterator()`` can't promise
+    that on MySQL, where the driver buffers the whole result set.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+class Exporter:
+    fields = []
+
+    def __init__(self, queryset, chunk_size: int = None):
+        self.queryset = queryset
+        self.chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    def rows(self):
+        """Flat rows matching ``fields``, for CSV."""
+        return iterate_in_chunks(self.queryset, self.fields, self.chunk_size)
+
+    def records(self):
+        """One dict per object, for JSONL."""
+        for row in self.rows():
+            yield dict(zip(self.fields, row))
+
+
+class CustomerExporter(Exporter):
+    fields = ['id', 'first_name', 'last_name', 'email', 'phone',
+              'birth_date', 'membership', 'orders_count']
+
+
+class ProductExporter(Exporter):
+    fields = ['id', 'title', 'slug', 'unit_price', 'effective_price', 'inventory',
+              'last_update', 'collection_id', 'collection__title']
+
+
+class OrderExporter(Exporter):
+    order_fields = ['id', 'placed_at', 'payment_status', 'customer_id',
+                    'customer__first_name', 'customer__last_name',
+                    'item_count', 'grand_total']
+    item_fields = ['orderitem__id', 'orderitem__product_id',
+                   'orderitem__product__title', 'orderitem__quantity',
+                   'orderitem__unit_price']
+    fields = order_fields + item_fields
+
+    def order_chunks(self):
+        """
+        Yield the line item rows of ``chunk_size`` orders at a time, in
+        order and item id order. Orders without items yield a single row
+        with empty item columns.
+        """
+        order_ids = iterate_in_chunks(self.queryset, ['id'], self.chunk_size)
+        while True:
+            chunk = [order_id for order_id, in islice(order_ids, self.chunk_size)]
+            if not chunk:
+                return
+            yield models.Order.objects \
+                        .filter(id__in=chunk) \
+                        .with_totals() \
+                        .order_by('id', 'orderitem__id') \
+                        .values_list(*self.fields)
+
+    def rows(self):
+        for chunk in self.order_chunks():
+            yield from chunk
+
+    def records(self):
+        width = len(self.order_fields)
+        for chunk in self.order_chunks():
+            record = None
+            for row in chunk:
+                if record is None or record['id'] != row[0]:
+                    if record is not None:
+                        yield record
+                    record = dict(zip(self.order_fields, row[:width]))
+                    record['items'] = []
+                if row[width] is not None:
+                    record['items'].append({
+                        field.split('__', 1)[1]: value
+                        for field, value in zip(self.item_fields, row[width:])
+                    })
+            if record is not None:
+                yield record
+
+
+EXPORTERS = {
+    'customers': (models.Customer, CustomerExporter),
+    'products': (models.Product, ProductExporter),
+    'orders': (models.Order, OrderExporter),
+}
+
+EXPORTER_FOR_MODEL = {model: exporter for model, exporter in EXPORTERS.values()}
+
+
+def stream_csv(exporter):
+    writer = csv.writer(Echo())
+    yield writer.writerow(exporter.fields)
+    for row in exporter.rows():
+        yield writer.writerow(row)
+
+
+def stream_jsonl(exporter):
+    for record in exporter.records():
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_response(queryset, format: str) -> StreamingHttpResponse:
+    stream, content_type = FORMATS[format]
+    exporter = EXPORTER_FOR_MODEL[queryset.model](queryset)
+    filename = f"{queryset.model._meta.model_name}s-" \
+               f"{datetime.date.today().strftime('%Y%m%d')}.{format}"
+
+    response = StreamingHttpResponse(stream(exporter), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
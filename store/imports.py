@@ -0,0 +1,231 @@
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from . import catalog, search
+from .counters import repair_collection_product_count
+from .models import Collection, Product
+from .pricing import refresh_effective_prices
+
+
+# Columns an import file may have, besides the mandatory slug
+PRODUCT_COLUMNS = ['title', 'description', 'unit_price', 'inventory', 'collection']
+
+# Columns a row needs when its slug doesn't exist yet
+REQUIRED_FOR_CREATE = ['title', 'unit_price', 'inventory', 'collection']
+
+# Only the first errors are kept, a broken feed could have thousands
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.collections_created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self) -> str:
+        return f"{self.created} created, {self.updated} updated, " \
+               f"{self.unchanged} unchanged, {self.error_count} errors."
+
+
+def read_rows(fileobj, format: str):
+    """
+    Yield ``(line number, dict)`` for each row of a CSV or JSONL text file,
+    or ``(line number, None)`` for JSONL lines that aren't an object.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(fileobj)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(fileobj, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def clean_row(row: dict) -> tuple:
+    """
+    Validate one row and return its slug and the product values it sets.
+    ``collection`` stays a title, collections are resolved per batch.
+    """
+    values = {}
+    slug = Product._meta.get_field('slug').clean(row.get('slug'), None)
+
+    for column in PRODUCT_COLUMNS:
+        value = row.get(column)
+        # Empty CSV cells leave the current value alone
+        if value is None or value == '':
+            continue
+        if column == 'collection':
+            value = Collection._meta.get_field('title').clean(str(value).strip(), None)
+        else:
+            try:
+                value = Product._meta.get_field(column).clean(value, None)
+            except ValidationError as error:
+                raise ValidationError(f"{column}: {' '.join(error.messages)}")
+        values[column] = value
+
+    return slug, values
+
+
+class ProductImporter:
+    """
+    Upsert products keyed by slug, ``batch_size`` rows per transaction.
+
+    Each batch costs a handful of queries whatever its size: one to read
+    the matching products, one per group of columns to update, one to
+    insert new products, and up to two to create missing collections.
+    Rows whose values don't change are not written at all.
+
+    Bulk writes send no signals: each batch repairs the product counts of
+    the collections it touched and invalidates the catalog as it commits,
+    so an import that fails halfway leaves nothing stale behind.
+    """
+
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.result = ImportResult()
+        self.collections = {}
+
+    def run(self, rows) -> ImportResult:
+        rows = iter(rows)
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch)
+        finally:
+            # Once for the whole import, rebuilding the index is expensive
+            if self.result.created or self.result.updated:
+                search.product_index.record_rebuild()
+        self.result.errors.sort()
+        return self.result
+
+    def import_batch(self, batch: list):
+        cleaned = {}
+        for line, row in batch:
+            if row is None:
+                self.result.add_error(line, 'Not a JSON object.')
+                continue
+            try:
+                slug, values = clean_row(row)
+            except ValidationError as error:
+                self.result.add_error(line, ' '.join(error.messages))
+                continue
+            if slug in cleaned:
+                # The last row for a slug wins
+                values = {**cleaned[slug][1], **values}
+            cleaned[slug] = (line, values)
+
+        if not cleaned:
+            return
+
+        with transaction.atomic():
+            self.resolve_collections(
+                {values['collection'] for _, values in cleaned.values() if 'collection' in values}
+            )
+            existing = {}
+            for product in Product.objects \
+                    .filter(slug__in=cleaned) \
+                    .order_by('-id') \
+                    .values('id', 'slug', *PRODUCT_COLUMNS[:-1], 'collection_id'):
+                # Duplicate slugs resolve to the oldest product, like the catalog
+                existing[product['slug']] = product
+
+            now = timezone.now()
+            collection_ids = set()
+            to_create = []
+            to_update = {}
+            for slug, (line, values) in cleaned.items():
+                if 'collection' in values:
+                    values['collection_id'] = self.collections[values.pop('collection')]
+
+                current = existing.get(slug)
+                if 'collection_id' in values:
+                    collection_ids.add(values['collection_id'])
+                    if current is not None:
+                        collection_ids.add(current['collection_id'])
+                if current is None:
+                    missing = [column for column in REQUIRED_FOR_CREATE
+                               if column not in values and f'{column}_id' not in values]
+                    if missing:
+                        self.result.add_error(line, f"New product needs {', '.join(missing)}.")
+                        continue
+                    values.setdefault('description', '')
+                    # New products have no promotions yet
+                    to_create.append(Product(slug=slug, last_update=now,
+                                             effective_price=values['unit_price'], **values))
+                    continue
+
+                changed = {
+                    field: value for field, value in values.items()
+                    if current[field] != value
+                }
+                if not changed:
+                    self.result.unchanged += 1
+                    continue
+                # bulk_update() needs the same fields for every object
+                fields = tuple(sorted(changed))
+                to_update.setdefault(fields, []).append(
+                    Product(id=current['id'], last_update=now, **changed)
+                )
+
+            Product.objects.bulk_create(to_create)
+            for fields, products in to_update.items():
+                Product.objects.bulk_update(products, [*fields, 'last_update'])
+            refresh_effective_prices([
+                product.id
+                for fields, products in to_update.items() if 'unit_price' in fields
+                for product in products
+            ])
+            if to_create or to_update:
+                repair_collection_product_count(pks=collection_ids)
+                transaction.on_commit(catalog.invalidate_catalog)
+
+        self.result.created += len(to_create)
+        self.result.updated += sum(len(products) for products in to_update.values())
+
+    def resolve_collections(self, titles: set):
+        """Map collection titles to ids, creating the missing collections."""
+        titles -= self.collections.keys()
+        if not titles:
+            return
+
+        def fetch():
+            for pk, title in Collection.objects \
+                    .filter(title__in=titles) \
+                    .order_by('-id') \
+                    .values_list('id', 'title'):
+                self.collections[title] = pk
+
+        fetch()
+        missing = titles - self.collections.keys()
+        if missing:
+            # Not every backend returns primary keys from bulk inserts
+            Collection.objects.bulk_create([Collection(title=title) for title in missing])
+            self.result.collections_created += len(missing)
+            fetch()
+
+
+def import_products(fileobj, format: str, batch_size: int = None) -> ImportResult:
+    return ProductImporter(batch_size).run(read_rows(fileobj, format))
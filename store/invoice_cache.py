@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+
+class InvoiceCache:
+    """
+    Disk-backed cache of rendered invoice PDFs.
+
+    Files live at ``<directory>/<order id>/<fingerprint>.pdf``, where the
+    fingerprint covers everything printed on the invoice. A changed order
+    therefore never matches a stale file. The per-order directory lets the
+    signal handlers drop every cached copy of an order at once. Once the
+    cache grows past ``max_bytes`` the least recently used files are evicted.
+    """
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(payload: dict) -> str:
+        # Not invoice_date, the render date changes daily and isn't printed
+        state = {
+            key: payload.get(key)
+            for key in ('payment_status', 'customer_name', 'placed_at',
+                        'product_set', 'grand_total')
+        }
+        encoded = json.dumps(state, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def path(self, payload: dict) -> Path:
+        return self.directory \
+            / str(payload['order_id']) \
+            / f"{self.fingerprint(payload)}.pdf"
+
+    def open(self, payload: dict):
+        """Return the cached PDF opened for reading, or None on a miss."""
+        path = self.path(payload)
+        try:
+            fileobj = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        # Bump the modification time, eviction goes by least recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return fileobj
+
+    def get(self, payload: dict):
+        fileobj = self.open(payload)
+        if fileobj is None:
+            return None
+        with fileobj:
+            return fileobj.read()
+
+    def set(self, payload: dict, pdf: bytes):
+        path = self.path(payload)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(pdf)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(pdf)
+
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def invalidate(self, order_ids):
+        for order_id in order_ids:
+            shutil.rmtree(self.directory / str(order_id), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self._size = 0
+
+    def _files(self):
+        for path in self.directory.glob('*/*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, stat
+
+    def _disk_usage(self) -> int:
+        return sum(stat.st_size for _, stat in self._files())
+
+    def _evict(self):
+        # Files may have been added or removed by other processes,
+        # so start from what is actually on disk.
+        files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+        size = sum(stat.st_size for _, stat in files)
+
+        # Leave some headroom so that the next few writes don't evict again
+        target = self.max_bytes * 0.9
+        for path, stat in files:
+            if size <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+
+        self._size = size
+
+
+invoice_cache = InvoiceCache(
+    settings.INVOICE_CACHE_DIR,
+    settings.INVOICE_CACHE_MAX_BYTES,
+)
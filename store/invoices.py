@@ -0,0 +1,324 @@
+import io
+import os
+import zipfile
+import datetime
+import tempfile
+import itertools
+import traceback
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+
+import django
+from django.conf import settings
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch, Q
+from django.utils import timezone
+from . import models
+from .invoice_cache import invoice_cache
+
+
+QR_PATH: str = os.path.join(os.path.dirname(__file__), 'e-store-text-400px.png')
+
+
+def invoice_filename(order_id: int) -> str:
+    return f'invoice-{order_id}.pdf'
+
+
+def get_invoice_payloads(queryset):
+    """
+    Yield one plain dict per order in ``queryset`` with everything needed
+    to render its invoice.
+
+    Orders, customers and order items are fetched with a fixed number of
+    queries no matter how many orders are selected, and all totals are
+    computed by the database.
+    """
+    order_items = models.OrderItem.objects \
+                        .select_related('product') \
+                        .annotate(net_price=ExpressionWrapper(
+                            F('unit_price') * F('quantity'),
+                            output_field=DecimalField(max_digits=12, decimal_places=2))) \
+                        .order_by('id')
+
+    queryset = queryset \
+        .with_totals() \
+        .select_related('customer') \
+        .prefetch_related(Prefetch('orderitem_set', queryset=order_items)) \
+        .order_by('id')
+
+    invoice_date = datetime.date.today().strftime("%d/%m/%Y")
+
+    for order in queryset:
+        product_set = [
+            {
+                'title': order_item.product.title,
+                'unit_price': order_item.unit_price,
+                'quantity': order_item.quantity,
+                'net_price': order_item.net_price,
+            }
+            for order_item in order.orderitem_set.all()
+        ]
+
+        yield {
+            'order_id': order.id,
+            'payment_status': order.payment_status,
+            'customer_name': str(order.customer),
+            'placed_at': order.placed_at.strftime("%d-%m-%Y"),
+            'invoice_date': invoice_date,
+            'product_set': product_set,
+            'grand_total': order.grand_total,
+        }
+
+
+def render_invoice(order_id: int, customer_name: str, placed_at: str,
+    invoice_date: str, grand_total, product_set, **kwargs) -> bytes:
+    """Render a single invoice and return the PDF bytes."""
+
+    # Create a file-like buffer to receive PDF data.
+    buffer = io.BytesIO()
+
+    # Create the PDF object, using the buffer as its "file."
+    p = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    p.setFont("Helvetica", 14)
+
+    # Draw things on the PDF. Here's where the PDF generation happens.
+    # See the ReportLab documentation for the full list of functionality.
+
+    x1 = 20  # Padding from left
+    y1 = height - 20  # Padding from bottom
+    p.drawString(x1, y1, 'Sales Invoice')
+
+
+    # Customer Info
+    y1 -= 40
+    p.drawString(x1, y1, f'Order ID: {order_id}')
+    p.drawString(410, y1, f"Order Date: {placed_at}")
+
+    y1 -= 20
+    p.drawString(x1, y1, f'Customer Name: {customer_name}')
+
+    y1 -= 20
+    p.drawString(x1, y1, 'Contact Number: +91******6789')
+
+    y1 -= 20
+    p.drawString(x1, y1, f'Customer Email: ********{customer_name[-3:]}123@gmail.com')
+
+
+    # Adress Section
+    y1 -= 36
+    address_padding_x = 80
+    p.drawString(x1, y1, f'Address:')
+    p.drawString(address_padding_x, y1, f'69, 420th floor, Green City Appartments')
+    y1 -= 20
+    p.drawString(address_padding_x, y1, f'Vakola, Santacruz East, Mumbai, Maharashtra')
+    y1 -= 20
+    p.drawString(address_padding_x, y1, f'Mumbai - 400055')
+
+    # Add QR CODE
+    p.drawImage(QR_PATH, 410, y1, width=120, height=120)
+
+    # Product Chart
+    y1 -= 60
+
+    p.line(x1 - 5, y1 + 15, width - 15, y1 + 15)
+    p.drawString(x1, y1, f"{'No.':<5} {'Title':<80} {'Unit Price':<16} {'Quantity':<12} {'Net Price':<16}")
+    p.line(x1 - 5, y1 - 5, width - 15, y1 - 5)
+
+    for ii, product in enumerate(product_set, start=1):
+        y1 -= 20
+        p.drawString(x1, y1, f"{ii:<5} {product.get('title'):<80}")
+        p.drawString(380, y1, str(product.get('unit_price')))
+        p.drawString(480, y1, str(product.get('quantity')))
+        p.drawString(540, y1, str(product.get('net_price')))
+        p.line(x1 - 5, y1 - 5, width - 15, y1 - 5)
+
+    y1 -= 28
+    p.drawString(410, y1, f"Grand Total:       {grand_total} INR")
+
+    # Close the PDF object cleanly, and we're done.
+    p.showPage()
+    p.save()
+
+    return buffer.getvalue()
+
+
+def render_invoice_batch(payloads) -> list:
+    return [render_invoice(**payload) for payload in payloads]
+
+
+def render_invoices(payloads, max_workers: int = None, batch_size: int = None):
+    """
+    Render invoice payloads and yield the PDF bytes in the same order.
+
+    Batches of payloads are rendered on a process pool of ``max_workers``
+    processes (``INVOICE_RENDER_WORKERS`` by default). Only a few batches per
+    worker are in flight at once, so memory stays bounded for long inputs.
+    Inputs that fit in a single batch are rendered in-process.
+    """
+    if max_workers is None:
+        max_workers = settings.INVOICE_RENDER_WORKERS or os.cpu_count() or 1
+    if batch_size is None:
+        batch_size = settings.INVOICE_RENDER_BATCH_SIZE
+
+    payloads = iter(payloads)
+    batches = iter(lambda: list(itertools.islice(payloads, batch_size)), [])
+
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return
+    if max_workers <= 1 or len(first_batch) < batch_size:
+        yield from render_invoice_batch(first_batch)
+        for batch in batches:
+            yield from render_invoice_batch(batch)
+        return
+
+    # Workers started with the spawn method need the app registry loaded
+    # before they can unpickle anything from this module.
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=django.setup) as executor:
+        pending = deque([executor.submit(render_invoice_batch, first_batch)])
+        for batch in batches:
+            pending.append(executor.submit(render_invoice_batch, batch))
+            if len(pending) >= max_workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def open_invoice(payload: dict):
+    """
+    Return the invoice PDF for ``payload`` opened for reading.
+
+    The PDF is served from the invoice cache when the order hasn't changed
+    since it was last rendered, otherwise it is rendered and cached.
+    """
+    fileobj = invoice_cache.open(payload)
+    if fileobj is not None:
+        return fileobj
+
+    pdf = render_invoice(**payload)
+    invoice_cache.set(payload, pdf)
+    return io.BytesIO(pdf)
+
+
+def write_invoice_archive(payloads, fileobj, max_workers: int = None,
+    on_progress=None) -> int:
+    """
+    Render every payload and add it to a ZIP archive written to ``fileobj``.
+
+    Cached invoices are copied straight into the archive while the others
+    are rendered and cached. Each PDF is written to the archive as soon as
+    it is available, so only a handful of invoices are held in memory at a
+    time. ``on_progress`` is called with the running count after every
+    invoice. Returns the number of invoices written.
+    """
+    count = 0
+    missed = deque()
+
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+
+        def uncached(payloads):
+            nonlocal count
+            for payload in payloads:
+                pdf = invoice_cache.get(payload)
+                if pdf is None:
+                    missed.append(payload)
+                    yield payload
+                else:
+                    archive.writestr(invoice_filename(payload['order_id']), pdf)
+                    count += 1
+                    if on_progress:
+                        on_progress(count)
+
+        for pdf in render_invoices(uncached(payloads), max_workers):
+            payload = missed.popleft()
+            invoice_cache.set(payload, pdf)
+            archive.writestr(invoice_filename(payload['order_id']), pdf)
+            count += 1
+            if on_progress:
+                on_progress(count)
+
+    return count
+
+
+def enqueue_export_job(queryset, user=None) -> models.InvoiceExportJob:
+    order_ids = list(queryset.order_by('id').values_list('id', flat=True))
+    return models.InvoiceExportJob.objects.create(
+        order_ids=order_ids,
+        total=len(order_ids),
+        requested_by=user,
+    )
+
+
+def claim_export_job():
+    """
+    Mark the oldest pending export job as running and return it.
+
+    Jobs left running for longer than ``INVOICE_EXPORT_JOB_TIMEOUT``, whose
+    worker most likely died, are claimed again. The status is flipped with
+    a conditional UPDATE, so when several workers race for the same job
+    only one of them gets it.
+    """
+    Job = models.InvoiceExportJob
+    stale = timezone.now() - datetime.timedelta(seconds=settings.INVOICE_EXPORT_JOB_TIMEOUT)
+    claimable = Q(status=Job.STATUS_PENDING) | Q(status=Job.STATUS_RUNNING, started_at__lt=stale)
+
+    for job_id in Job.objects.filter(claimable).order_by('id').values_list('id', flat=True)[:10]:
+        claimed = Job.objects \
+            .filter(claimable, pk=job_id) \
+            .update(status=Job.STATUS_RUNNING, started_at=timezone.now(), processed=0)
+        if claimed:
+            return Job.objects.get(pk=job_id)
+
+    return None
+
+
+def run_export_job(job: models.InvoiceExportJob, max_workers: int = None):
+    Job = models.InvoiceExportJob
+    export_dir = Path(settings.INVOICE_EXPORT_DIR)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    archive = f'invoices-{job.id}.zip'
+    last_reported = 0
+    # Once the job is claimed again by another worker, this one's updates
+    # are dropped
+    claimed = Job.objects.filter(pk=job.id, started_at=job.started_at)
+
+    def report_progress(count):
+        nonlocal last_reported
+        if count - last_reported >= settings.INVOICE_EXPORT_PROGRESS_STEP:
+            claimed.update(processed=count)
+            last_reported = count
+
+    # Written aside and moved in place, a worker never serves another's
+    # half written archive
+    fd, partial = tempfile.mkstemp(dir=export_dir, prefix=f'{archive}.', suffix='.part')
+    try:
+        queryset = models.Order.objects.filter(id__in=job.order_ids)
+        with os.fdopen(fd, 'wb') as fileobj:
+            processed = write_invoice_archive(
+                get_invoice_payloads(queryset),
+                fileobj,
+                max_workers=max_workers,
+                on_progress=report_progress,
+            )
+        os.replace(partial, export_dir / archive)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        claimed.update(
+            status=Job.STATUS_FAILED,
+            error=traceback.format_exc(),
+            finished_at=timezone.now(),
+        )
+        raise
+
+    claimed.update(
+        status=Job.STATUS_COMPLETE,
+        processed=processed,
+        archive=archive,
+        finished_at=timezone.now(),
+    )
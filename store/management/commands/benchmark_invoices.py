@@ -0,0 +1,58 @@
+import os
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from store.invoices import render_invoices
+
+
+class Command(BaseCommand):
+    help = 'Compares serial and parallel invoice rendering throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000],
+                            help='Number of invoices to render in each run.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Size of the process pool for the parallel run.')
+        parser.add_argument('--items', type=int, default=5,
+                            help='Number of product rows on each invoice.')
+
+    def handle(self, *args, **options):
+        for count in options['counts']:
+            payloads = [self.make_payload(order_id, options['items'])
+                        for order_id in range(1, count + 1)]
+
+            serial = self.run(payloads, max_workers=1)
+            parallel = self.run(payloads, max_workers=options['workers'])
+
+            self.stdout.write(
+                f"{count} invoices: "
+                f"serial {serial:.2f}s ({count / serial:.0f}/s), "
+                f"{options['workers']} workers {parallel:.2f}s ({count / parallel:.0f}/s), "
+                f"speedup x{serial / parallel:.2f}"
+            )
+
+    def run(self, payloads, max_workers: int) -> float:
+        start = time.perf_counter()
+        for _ in render_invoices(payloads, max_workers=max_workers):
+            pass
+        return time.perf_counter() - start
+
+    def make_payload(self, order_id: int, items: int) -> dict:
+        product_set = [
+            {
+                'title': f'Product {index}',
+                'unit_price': Decimal('19.99'),
+                'quantity': index,
+                'net_price': Decimal('19.99') * index,
+            }
+            for index in range(1, items + 1)
+        ]
+        return {
+            'order_id': order_id,
+            'customer_name': 'Benchmark Customer',
+            'placed_at': '01-01-2022',
+            'invoice_date': '01/01/2022',
+            'product_set': product_set,
+            'grand_total': sum(product['net_price'] for product in product_set),
+        }
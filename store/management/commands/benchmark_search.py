@@ -0,0 +1,76 @@
+import time
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from store.search import INDEXES, normalize
+
+
+class Command(BaseCommand):
+    help = 'Compares the trigram search index with LIKE queries on the current data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', choices=sorted(INDEXES), default='products')
+        parser.add_argument('--terms', nargs='*',
+                            help='Search terms, defaults to words sampled from the indexed rows.')
+        parser.add_argument('--samples', type=int, default=20,
+                            help='Number of terms to sample when --terms is not given.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        index = INDEXES[options['index']]
+
+        start = time.perf_counter()
+        index.build()
+        self.stdout.write(
+            f"Built {index.name} index of {len(index.documents)} rows "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+        terms = options['terms'] or self.sample_terms(index, options['samples'])
+        like_total = index_total = 0
+        for term in terms:
+            # The LIKE path the admin used, extended to mid-word matches
+            condition = Q()
+            for field in index.fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = index.model.objects.filter(condition).values_list('pk', flat=True)
+
+            like = self.time(lambda: list(queryset[:settings.SEARCH_MAX_RESULTS]), options['repeat'])
+            indexed = self.time(lambda: index.search(term), options['repeat'])
+            like_total += like
+            index_total += indexed
+            self.stdout.write(
+                f"{term!r}: LIKE {like * 1000:.2f}ms ({queryset.count()} rows), "
+                f"index {indexed * 1000:.2f}ms ({len(index.search(term))} rows)"
+            )
+
+        if terms:
+            self.stdout.write(self.style.SUCCESS(
+                f"Average over {len(terms)} terms: LIKE {like_total / len(terms) * 1000:.2f}ms, "
+                f"index {index_total / len(terms) * 1000:.2f}ms, "
+                f"speedup x{like_total / max(index_total, 1e-9):.1f}"
+            ))
+
+    def time(self, run, repeat: int) -> float:
+        """Best of ``repeat`` runs, in seconds."""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def sample_terms(self, index, count: int) -> list:
+        rows = index.model.objects.order_by('?').values_list(*index.fields)[:count]
+        terms = []
+        for row in rows:
+            words = [word for value in row for word in normalize(value) if len(word) >= 3]
+            if words:
+                word = random.choice(words)
+                # Mid-word fragments are what LIKE 'x%' can't find
+                start = random.randrange(max(len(word) - 3, 0) + 1)
+                terms.append(word[start:start + 4])
+        return terms
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from store.search import INDEXES
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product and customer search indexes and saves them to SEARCH_INDEX_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('indexes', nargs='*', choices=sorted(INDEXES), default=sorted(INDEXES))
+
+    def handle(self, *args, **options):
+        for name in options['indexes']:
+            index = INDEXES[name]
+            index.build()
+            self.stdout.write(self.style.SUCCESS(
+                f"Indexed {len(index.documents)} {name} ({len(index.postings)} trigrams)."
+            ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.query_plans import check_admin_query_plans
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs EXPLAIN for every store admin filter, search and sort and fails '
+        'if any of them needs a full table scan, or a full index scan other '
+        'than the index its page is sorted by. Run it against a database '
+        'with realistic data, planners happily scan tables of a few rows.'
+    )
+
+    def handle(self, *args, **options):
+        problems = check_admin_query_plans()
+        for description, tables in problems:
+            self.stderr.write(f"{description}: full scan of {', '.join(tables)}")
+
+        if problems:
+            raise CommandError(f"{len(problems)} admin queries fall back to a full table scan.")
+
+        self.stdout.write(self.style.SUCCESS('Every admin query uses an index.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from store import exports
+
+
+class Command(BaseCommand):
+    help = 'Streams orders, customers or products as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTERS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write to, defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows fetched per query, defaults to EXPORT_CHUNK_SIZE.')
+
+    def handle(self, *args, **options):
+        model, exporter_class = exports.EXPORTERS[options['kind']]
+        exporter = exporter_class(model.objects.all(), chunk_size=options['chunk_size'])
+        stream, _ = exports.FORMATS[options['format']]
+
+        if options['output'] is None:
+            for line in stream(exporter):
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as fileobj:
+            fileobj.writelines(stream(exporter))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from store.carts import flush_idle_carts
+
+
+class Command(BaseCommand):
+    help = 'Saves the carts that have been idle for CART_IDLE_TIMEOUT seconds to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle', type=int, default=None,
+                            help='Seconds without changes, defaults to CART_IDLE_TIMEOUT.')
+
+    def handle(self, *args, **options):
+        flushed = flush_idle_carts(options['idle'])
+        self.stdout.write(self.style.SUCCESS(f"Flushed {flushed} carts."))
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from store.imports import import_products
+
+
+class Command(BaseCommand):
+    help = 'Creates and updates products, keyed by slug, from a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows per transaction, defaults to IMPORT_BATCH_SIZE.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        format = options['format'] or path.suffix.lower().lstrip('.')
+        if format not in ('csv', 'jsonl'):
+            raise CommandError("Pass --format for files without a .csv or .jsonl extension.")
+
+        with open(path, newline='', encoding='utf-8-sig') as fileobj:
+            result = import_products(fileobj, format, options['batch_size'])
+
+        for line, message in result.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        style = self.style.WARNING if result.error_count else self.style.SUCCESS
+        self.stdout.write(style(f"{result} {result.collections_created} collections created."))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from store.invoices import claim_export_job, run_export_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued invoice export jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no pending jobs left.')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds to wait between checks for new jobs.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Size of the rendering process pool.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_export_job()
+
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Exporting {job.total} invoices for job #{job.id}")
+            try:
+                run_export_job(job, max_workers=options['workers'])
+            except Exception as error:
+                self.stderr.write(f"Job #{job.id} failed: {error}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Job #{job.id} complete"))
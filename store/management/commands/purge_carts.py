@@ -0,0 +1,19 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.carts import purge_carts
+
+
+class Command(BaseCommand):
+    help = 'Deletes carts created more than CART_ABANDONED_DAYS days ago.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CART_ABANDONED_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created_before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = purge_carts(created_before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} carts."))
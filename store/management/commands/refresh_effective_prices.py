@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store import catalog
+from store.pricing import refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Product.effective_price, e.g. after changing PRICING_STACK_PROMOTIONS.'
+
+    def handle(self, *args, **options):
+        changed = refresh_effective_prices()
+        if changed:
+            catalog.invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"Repriced {len(changed)} products."))
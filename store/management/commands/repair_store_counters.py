@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.counters import repair_collection_product_count, repair_customer_orders_count
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Customer.orders_count and Collection.product_count.'
+
+    def handle(self, *args, **options):
+        customers = repair_customer_orders_count()
+        collections = repair_collection_product_count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Repaired {customers} customers and {collections} collections."
+        ))
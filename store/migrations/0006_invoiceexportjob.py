@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('store', '0005_alter_collection_options_alter_customer_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Running'), ('C', 'Complete'), ('F', 'Failed')], default='P', max_length=1)),
+                ('order_ids', models.JSONField()),
+                ('total', models.PositiveIntegerField()),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('archive', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:23
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field: str, related_model, related_field: str):
+    model.objects.update(**{field: Coalesce(
+        Subquery(
+            related_model.objects
+                .filter(**{related_field: OuterRef('pk')})
+                .order_by()
+                .values(related_field)
+                .annotate(count=Count('pk'))
+                .values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )})
+
+
+def populate_counters(apps, schema_editor):
+    count_related(apps.get_model('store', 'Customer'), 'orders_count',
+                  apps.get_model('store', 'Order'), 'customer')
+    count_related(apps.get_model('store', 'Collection'), 'product_count',
+                  apps.get_model('store', 'Product'), 'collection')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_invoiceexportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_add_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['title'], name='store_colle_title_ddb562_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['product_count'], name='store_colle_product_db8309_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['first_name', 'last_name'], name='store_custo_first_n_8f83e0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['last_name'], name='store_custo_last_na_5a62f0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['orders_count'], name='store_custo_orders__7dc960_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['placed_at', 'id'], name='store_order_placed__61eeee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'placed_at'], name='store_order_payment_11d454_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['title', 'unit_price'], name='store_produ_title_bdb343_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['collection', 'title'], name='store_produ_collect_153bce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['inventory'], name='store_produ_invento_b4e03e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['last_update'], name='store_produ_last_up_e9e6df_idx'),
+        ),
+    ]
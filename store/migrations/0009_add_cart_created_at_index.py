@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_add_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['created_at'], name='store_cart_created_bb94c8_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.10 on 2026-10-17 00:40
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def price(unit_price, discounts, stack: bool) -> Decimal:
+    discounts = [min(max(Decimal(str(discount)), Decimal(0)), Decimal(1)) for discount in discounts]
+    if stack:
+        factor = Decimal(1)
+        for discount in discounts:
+            factor *= 1 - discount
+    else:
+        factor = 1 - max(discounts, default=Decimal(0))
+    return (unit_price * factor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def populate_effective_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    stack = getattr(settings, 'PRICING_STACK_PROMOTIONS', False)
+    discounts = {}
+    for product_id, discount in Product.promotions.through.objects \
+            .values_list('product_id', 'promotion__discount'):
+        discounts.setdefault(product_id, []).append(discount)
+
+    products = Product.objects.only('pk', 'unit_price').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(products.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            return
+        for product in batch:
+            product.effective_price = price(product.unit_price, discounts.get(product.pk, []), stack)
+        Product.objects.bulk_update(batch, ['effective_price'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_add_cart_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=6),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_effective_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='store_produ_effecti_707a96_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.10 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='dirty_since',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['dirty_since'], name='store_cart_dirty_s_a4653c_idx'),
+        ),
+    ]
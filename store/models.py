@@ -1,4 +1,79 @@
-from django.db import models
+from decimal import Decimal
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, FloatField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Exp, Greatest, Least, Ln, Round
+
+
+class StoredValuesMixin:
+    """
+    Remembers the stored values of ``stored_fields``, attnames, as loaded
+    or last saved, so signal handlers can tell what a save changes without
+    querying the row.
+
+    Saves leave the stored fields they didn't change out of the UPDATE, so
+    a stale instance never writes back a value changed by someone else.
+    Saves writing one of ``locked_fields`` run in a transaction, for signal
+    handlers to lock the row and update others along with it.
+    """
+    stored_fields = []
+    locked_fields = []
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_stored_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.remember_stored_values(fields)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self._unwritten_fields = set()
+        if update_fields is None and self.pk is not None and not (force_insert or force_update):
+            self._unwritten_fields = {
+                attname for attname in self.stored_fields if not self.has_changed(attname)}
+        try:
+            if any(self.writes(attname, update_fields) for attname in self.locked_fields):
+                with transaction.atomic(using=using):
+                    super().save(force_insert, force_update, using, update_fields)
+            else:
+                super().save(force_insert, force_update, using, update_fields)
+        finally:
+            self._unwritten_fields = set()
+        self.remember_stored_values(update_fields)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Only the UPDATE skips them, an INSERT of a deleted row writes them all
+        values = [value for value in values if value[0].attname not in self._unwritten_fields]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+    def writes(self, attname: str, update_fields) -> bool:
+        """Whether the save in progress writes ``attname`` to an existing row."""
+        if update_fields is not None:
+            return attname in {self._meta.get_field(name).attname for name in update_fields}
+        return attname not in getattr(self, '_unwritten_fields', ())
+
+    def remember_stored_values(self, fields=None):
+        attnames = set(self.stored_fields) - self.get_deferred_fields()
+        if fields is not None:
+            attnames &= {self._meta.get_field(name).attname for name in fields}
+        if not hasattr(self, '_stored_values'):
+            self._stored_values = {}
+        for attname in attnames:
+            self._stored_values[attname] = getattr(self, attname)
+
+    def has_stored_value(self, attname: str) -> bool:
+        return attname in getattr(self, '_stored_values', {})
+
+    def stored_value(self, attname: str):
+        return self._stored_values[attname]
+
+    def has_changed(self, attname: str) -> bool:
+        """Whether ``attname`` differs from the stored value, True if unknown."""
+        return not self.has_stored_value(attname) \
+            or self.stored_value(attname) != getattr(self, attname)
 
 
 class Promotion(models.Model):
@@ -10,29 +85,92 @@ class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+')
+    product_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
     
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title']),
+            models.Index(fields=['product_count']),
+        ]
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_effective_price(self, stack: bool = None):
+        """
+        Annotate every product with ``current_price``, its unit price after
+        promotions, computed by the database with the rules of
+        ``pricing.effective_price``.
+
+        Stacked discounts are multiplied as EXP(SUM(LN(1 - discount))), so
+        the result may differ from the stored ``effective_price`` by a cent
+        in rare cases. Sort and filter on ``effective_price`` instead when
+        it is up to date, it is indexed.
+        """
+        if stack is None:
+            stack = settings.PRICING_STACK_PROMOTIONS
+        discount = Least(Greatest(F('promotion__discount'), Value(0.0)), Value(1.0))
+        promotions = Product.promotions.through.objects \
+            .filter(product=OuterRef('pk')) \
+            .order_by() \
+            .values('product')
 
+        if not stack:
+            factor = Value(1.0) - Coalesce(
+                Subquery(promotions.annotate(best=Max(discount)).values('best'),
+                         output_field=FloatField()),
+                Value(0.0)
+            )
+        else:
+            # LN(0) is undefined, a 100% discount rounds the price to 0 instead
+            remaining = Greatest(Value(1.0) - discount, Value(1e-12))
+            factor = Coalesce(
+                Subquery(promotions.annotate(factor=Exp(Sum(Ln(remaining)))).values('factor'),
+                         output_field=FloatField()),
+                Value(1.0)
+            )
 
-class Product(models.Model):
+        price_field = DecimalField(max_digits=6, decimal_places=2)
+        return self.annotate(current_price=Round(
+            ExpressionWrapper(F('unit_price') * factor, output_field=price_field),
+            2,
+            output_field=price_field
+        ))
+
+
+class Product(StoredValuesMixin, models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
     description = models.TextField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    # unit_price after promotions, kept up to date by store.signals
+    effective_price = models.DecimalField(max_digits=6, decimal_places=2, editable=False)
     inventory = models.IntegerField()
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT)
     promotions = models.ManyToManyField(Promotion)
 
+    objects = ProductQuerySet.as_manager()
+
+    # Repriced and recounted by store.signals when they change
+    stored_fields = ['unit_price', 'collection_id']
+    locked_fields = ['collection_id']
+
     def __str__(self) -> str:
         return self.title
     
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'unit_price']),
+            models.Index(fields=['collection', 'title']),
+            models.Index(fields=['inventory']),
+            models.Index(fields=['last_update']),
+            models.Index(fields=['effective_price', 'id']),
+        ]
 
 
 class Customer(models.Model):
@@ -52,15 +190,53 @@ class Customer(models.Model):
     birth_date = models.DateField(null=True)
     membership = models.CharField(
         max_length=1, choices=MEMBERSHIP_CHOICES, default=MEMBERSHIP_BRONZE)
+    orders_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.first_name + ' ' + self.last_name
 
     class Meta:
         ordering = ['first_name', 'last_name']
+        indexes = [
+            models.Index(fields=['first_name', 'last_name']),
+            models.Index(fields=['last_name']),
+            models.Index(fields=['orders_count']),
+        ]
 
 
-class Order(models.Model):
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate every order with ``item_count`` and a Decimal
+        ``grand_total``, both aggregated by the database.
+
+        The aggregates are correlated subqueries rather than a JOIN with
+        GROUP BY, so a paginated changelist only totals the orders on the
+        page and can still walk the ``placed_at`` index.
+        """
+        total_field = DecimalField(max_digits=12, decimal_places=2)
+        items = OrderItem.objects \
+            .filter(order=OuterRef('pk')) \
+            .order_by() \
+            .values('order')
+
+        return self.annotate(
+            item_count=Coalesce(
+                Subquery(items.annotate(count=Count('pk')).values('count'),
+                         output_field=IntegerField()),
+                Value(0)
+            ),
+            grand_total=Coalesce(
+                Subquery(items.annotate(total=Sum(F('unit_price') * F('quantity'),
+                                                  output_field=total_field))
+                              .values('total')),
+                Value(Decimal('0.00')),
+                output_field=total_field
+            )
+        )
+
+
+class Order(StoredValuesMixin, models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
     PAYMENT_STATUS_FAILED = 'F'
@@ -75,6 +251,18 @@ class Order(models.Model):
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    objects = OrderQuerySet.as_manager()
+
+    # Recounted by store.signals when it changes
+    stored_fields = ['customer_id']
+    locked_fields = ['customer_id']
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['placed_at', 'id']),
+            models.Index(fields=['payment_status', 'placed_at']),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
@@ -94,9 +282,49 @@ class Address(models.Model):
 
 class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set while the cached cart has changes not saved as CartItem rows
+    dirty_since = models.DateTimeField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['dirty_since']),
+        ]
 
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
+
+
+class InvoiceExportJob(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_RUNNING = 'R'
+    STATUS_COMPLETE = 'C'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    order_ids = models.JSONField()
+    total = models.PositiveIntegerField()
+    processed = models.PositiveIntegerField(default=0)
+    archive = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"Invoice export #{self.id}"
+
+    class Meta:
+        ordering = ['-created_at']
@@ -0,0 +1,256 @@
+import json
+import base64
+import hashlib
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from django.utils.functional import cached_property
+
+
+CURSOR_VAR = 'cursor'
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+CURSOR_LAST = 'l'
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator whose COUNT(*) is cached for ADMIN_COUNT_CACHE_TIMEOUT seconds.
+
+    Unfiltered changelists on large tables use the planner's row estimate
+    instead of counting, see ``is_estimate``.
+    """
+
+    is_estimate = False
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        sql, params = query.get_compiler(self.object_list.db).as_sql()
+        digest = hashlib.md5(f"{sql} {params!r}".encode()).hexdigest()
+        key = f'admin:count:{self.object_list.model._meta.label_lower}:{digest}'
+
+        cached = cache.get(key)
+        if cached is not None:
+            self.is_estimate, count = cached
+            return count
+
+        count = None
+        if not query.where:
+            count = self.estimated_count()
+            self.is_estimate = count is not None
+        if count is None:
+            count = super().count
+
+        cache.set(key, (self.is_estimate, count), settings.ADMIN_COUNT_CACHE_TIMEOUT)
+        return count
+
+    def estimated_count(self):
+        """
+        Return the planner's row estimate for the whole table, or None when
+        the backend has none or the table is small enough to count exactly.
+        """
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                    'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [table]
+                )
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                    [table]
+                )
+            else:
+                return None
+            row = cursor.fetchone()
+
+        if row is None or row[0] is None or row[0] < settings.ADMIN_APPROXIMATE_COUNT_THRESHOLD:
+            return None
+        return int(row[0])
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist that pages by seeking past the last row shown instead of
+    using OFFSET, so every page costs the same as the first one.
+
+    Keyset paging is used whenever the changelist is sorted by plain,
+    non-null model fields, which includes the admin's default ordering.
+    Any other ordering falls back to regular page numbers.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        self.keyset = self.get_keyset(queryset.query.order_by)
+        return queryset
+
+    def get_keyset(self, ordering):
+        """
+        Return the ordering as a list of ``(field, descending)`` pairs,
+        or None if it can't be used as a seek key.
+        """
+        opts = self.lookup_opts
+        keyset = []
+        for part in ordering:
+            if isinstance(part, OrderBy) and isinstance(part.expression, F):
+                name, descending = part.expression.name, part.descending
+            elif isinstance(part, str):
+                name, descending = part.lstrip('-'), part.startswith('-')
+            else:
+                return None
+
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+            # Related fields sort by the related model's ordering
+            if not field.concrete or field.null or (field.is_relation and name == field.name):
+                return None
+            # ChangeList appends the queryset's ordering, repeats don't reorder
+            if field not in (previous for previous, _ in keyset):
+                keyset.append((field, descending))
+
+        # Without a unique column rows could be skipped or repeated
+        if not any(field.primary_key or field.unique for field, _ in keyset):
+            return None
+        return keyset
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.count_is_estimate = getattr(self.paginator, 'is_estimate', False)
+        self.keyset_enabled = (
+            self.keyset is not None
+            and self.multi_page
+            and not self.show_all
+            and (CURSOR_VAR in request.GET or PAGE_VAR not in request.GET)
+        )
+        if self.keyset_enabled:
+            self.seek(request.GET.get(CURSOR_VAR))
+
+    def seek(self, cursor):
+        """Replace the OFFSET page with the page the cursor points at."""
+        direction, values = self.decode_cursor(cursor)
+        names = [field.attname for field, _ in self.keyset]
+        queryset = self.queryset
+
+        if direction in (CURSOR_PREVIOUS, CURSOR_LAST):
+            # Walk backwards from the cursor, or from the end of the list
+            reverse = self.queryset.reverse()
+            if values is not None:
+                reverse = reverse.filter(self.seek_filter(values, backwards=True))
+            keys = list(reverse.values_list(*names)[:self.list_per_page + 1])
+            keys.reverse()
+            has_previous = len(keys) > self.list_per_page
+            keys = keys[-self.list_per_page:]
+            has_next = values is not None
+        else:
+            if values is not None:
+                queryset = queryset.filter(self.seek_filter(values))
+            keys = list(queryset.values_list(*names)[:self.list_per_page + 1])
+            has_next = len(keys) > self.list_per_page
+            keys = keys[:self.list_per_page]
+            has_previous = values is not None
+
+        if keys:
+            # The page is fetched as a bounded queryset rather than a list,
+            # list_editable needs a queryset to build its formset from.
+            self.result_list = self.queryset \
+                .filter(self.seek_filter(keys[0], inclusive=True)) \
+                .filter(self.seek_filter(keys[-1], inclusive=True, backwards=True))
+        else:
+            self.result_list = self.queryset.none()
+
+        self.first_page_url = self.cursor_url(None) if has_previous else None
+        self.previous_page_url = \
+            self.cursor_url(self.encode_cursor(CURSOR_PREVIOUS, keys[0])) if has_previous else None
+        self.next_page_url = \
+            self.cursor_url(self.encode_cursor(CURSOR_NEXT, keys[-1])) if has_next else None
+        self.last_page_url = \
+            self.cursor_url(self.encode_cursor(CURSOR_LAST, None)) if has_next else None
+
+    def seek_filter(self, values, inclusive=False, backwards=False) -> Q:
+        """
+        Build the filter for rows strictly after ``values`` in keyset order,
+        or before them when ``backwards`` is set.
+        """
+        condition = Q()
+        for index, (field, descending) in enumerate(self.keyset):
+            lookup = 'lt' if descending != backwards else 'gt'
+            if inclusive and index == len(self.keyset) - 1:
+                lookup += 'e'
+            equal = {
+                previous.attname: value
+                for (previous, _), value in zip(self.keyset[:index], values)
+            }
+            condition |= Q(**equal, **{f'{field.attname}__{lookup}': values[index]})
+
+        # A range on the leading column lets the database seek on the index
+        field, descending = self.keyset[0]
+        lookup = 'lte' if descending != backwards else 'gte'
+        return Q(**{f'{field.attname}__{lookup}': values[0]}) & condition
+
+    def encode_cursor(self, direction: str, values) -> str:
+        if values is not None:
+            # Keep full precision, DjangoJSONEncoder truncates microseconds
+            values = [
+                value.isoformat() if isinstance(value, (datetime.date, datetime.time))
+                else str(value) if isinstance(value, Decimal)
+                else value
+                for value in values
+            ]
+        payload = json.dumps([direction, values])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return CURSOR_NEXT, None
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if values is not None:
+                if len(values) != len(self.keyset):
+                    raise ValueError
+                values = [
+                    field.to_python(value)
+                    for (field, _), value in zip(self.keyset, values)
+                ]
+        except (TypeError, ValueError, ValidationError):
+            return CURSOR_NEXT, None
+        return direction, values
+
+    def cursor_url(self, cursor):
+        if cursor is None:
+            return self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+        return self.get_query_string({CURSOR_VAR: cursor}, [PAGE_VAR])
+
+
+class KeysetPaginationMixin:
+    """Page a ModelAdmin changelist with KeysetChangeList."""
+
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
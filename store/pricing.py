@@ -0,0 +1,83 @@
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+
+
+CENT = Decimal('0.01')
+
+
+def discount_factor(discounts, stack: bool = None) -> Decimal:
+    """
+    Return the fraction of the unit price left to pay after ``discounts``.
+
+    A promotion's discount is the fraction taken off the price, 0.1 for
+    10% off, clamped between 0 and 1. By default only the best promotion
+    applies. With PRICING_STACK_PROMOTIONS every promotion applies in turn
+    to the price left by the previous ones.
+    """
+    if stack is None:
+        stack = settings.PRICING_STACK_PROMOTIONS
+    # str() keeps 0.1 from becoming 0.1000000000000000055511151231257827
+    discounts = [min(max(Decimal(str(discount)), Decimal(0)), Decimal(1))
+                 for discount in discounts]
+
+    if not stack:
+        return 1 - max(discounts, default=Decimal(0))
+    factor = Decimal(1)
+    for discount in discounts:
+        factor *= 1 - discount
+    return factor
+
+
+def effective_price(unit_price: Decimal, discounts, stack: bool = None) -> Decimal:
+    """The price a customer pays, rounded half up to the cent."""
+    return (unit_price * discount_factor(discounts, stack)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def refresh_effective_prices(product_ids=None, batch_size: int = 1000) -> list:
+    """
+    Recompute the stored ``effective_price`` of ``product_ids``, or of every
+    product, ``batch_size`` products at a time.
+
+    Each batch reads prices and discounts with two queries and writes only
+    the products whose price changed, with one bulk_update. Returns the ids
+    of those products.
+
+    bulk_update sends no signals, callers are expected to invalidate the
+    catalog cache.
+    """
+    from .models import Product
+    Through = Product.promotions.through
+
+    if product_ids is None:
+        product_ids = Product.objects.values_list('pk', flat=True)
+    ids = iter(sorted(set(product_ids)))
+
+    changed = []
+    while True:
+        batch = list(islice(ids, batch_size))
+        if not batch:
+            return changed
+
+        discounts = {}
+        for product_id, discount in Through.objects \
+                .filter(product_id__in=batch) \
+                .values_list('product_id', 'promotion__discount'):
+            discounts.setdefault(product_id, []).append(discount)
+
+        stale = []
+        now = timezone.now()
+        for product in Product.objects \
+                .filter(pk__in=batch) \
+                .only('pk', 'unit_price', 'effective_price'):
+            price = effective_price(product.unit_price, discounts.get(product.pk, []))
+            if price != product.effective_price:
+                product.effective_price = price
+                product.last_update = now
+                stale.append(product)
+
+        # last_update too, it is part of the catalog API's ETags
+        Product.objects.bulk_update(stale, ['effective_price', 'last_update'])
+        changed.extend(product.pk for product in stale)
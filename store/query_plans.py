@@ -0,0 +1,128 @@
+import re
+import json
+import datetime
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+from . import models
+
+
+# Changelist URLs for every admin filter, search and sort on a hot path,
+# with the fields of the index the page may walk in full. Reading a whole
+# index is only fine when its rows come in the order of the page, so the
+# LIMIT stops the walk after a page.
+ADMIN_ACCESS_PATHS = [
+    (models.Product, {}, ['title', 'unit_price']),
+    (models.Product, {'inventory': '<5'}, None),
+    (models.Product, {'inventory': '<20'}, None),
+    (models.Product, {'inventory': '<40'}, None),
+    (models.Product, {'inventory': '>40'}, None),
+    (models.Product, {'last_update__gte': '{week_ago}'}, None),
+    (models.Product, {'collection__id__exact': '1'}, None),
+    (models.Product, {'q': 'a'}, None),
+    (models.Product, {'o': '3'}, ['effective_price', 'id']),
+    (models.Customer, {}, ['first_name', 'last_name']),
+    (models.Customer, {'q': 'a'}, None),
+    (models.Customer, {'o': '6'}, ['orders_count']),
+    (models.Order, {}, ['placed_at', 'id']),
+    (models.Order, {'payment_status__exact': 'P'}, None),
+    (models.Order, {'customer__id': '1'}, None),
+    (models.Collection, {}, ['title']),
+    (models.Collection, {'o': '2'}, ['product_count']),
+]
+
+
+def index_name(model, fields: list) -> str:
+    """Return the name of the index of ``model`` on ``fields``."""
+    for index in model._meta.indexes:
+        if list(index.fields) == list(fields):
+            return index.name
+    raise LookupError(f"{model.__name__} has no index on {fields}.")
+
+
+def get_changelist_queryset(model, params: dict):
+    """Build the queryset the admin changelist runs for ``params``."""
+    model_admin = admin.site._registry[model]
+    week_ago = (timezone.now() - datetime.timedelta(days=7)).isoformat()
+    params = {key: value.format(week_ago=week_ago) for key, value in params.items()}
+
+    request = RequestFactory().get('/', params)
+    request.user = User(is_active=True, is_staff=True, is_superuser=True)
+
+    changelist = model_admin.get_changelist_instance(request)
+    return changelist.queryset[:changelist.list_per_page]
+
+
+def full_table_scans(queryset, ordered_index: str = None) -> list:
+    """
+    Return the tables the database would read in full to run ``queryset``,
+    through a table scan or a scan of a whole index other than
+    ``ordered_index``.
+    """
+    vendor = connection.vendor
+
+    if vendor == 'sqlite':
+        plan = queryset.explain()
+        return [
+            table for table, index in re.findall(
+                r'\bSCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?\s*$',
+                plan, re.MULTILINE
+            )
+            if not index or index != ordered_index
+        ]
+
+    if vendor == 'mysql':
+        def scanned(node):
+            table = node.get('table')
+            if not isinstance(table, dict):
+                return None
+            # 'index' reads the whole index, 'ALL' the whole table
+            if table.get('access_type') == 'ALL' or \
+                    table.get('access_type') == 'index' and table.get('key') != ordered_index:
+                return table.get('table_name')
+
+    elif vendor == 'postgresql':
+        def scanned(node):
+            node_type = node.get('Node Type')
+            if node_type == 'Seq Scan' or \
+                    node_type in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in node \
+                    and node.get('Index Name') != ordered_index:
+                return node.get('Relation Name')
+
+    else:
+        raise NotImplementedError(f"Query plans can't be inspected on {vendor}.")
+
+    scans = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            table = scanned(node)
+            if table:
+                scans.append(table)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(queryset.explain(format='json')))
+    return scans
+
+
+def check_admin_query_plans() -> list:
+    """
+    EXPLAIN the changelist query behind every path in ADMIN_ACCESS_PATHS.
+
+    Returns a list of ``(description, tables)`` for the queries that fall
+    back to a full table scan, or read a whole index out of order.
+    """
+    problems = []
+    for model, params, ordered_by in ADMIN_ACCESS_PATHS:
+        queryset = get_changelist_queryset(model, params)
+        scans = full_table_scans(queryset, ordered_by and index_name(model, ordered_by))
+        if scans:
+            problems.append((f"{model.__name__} {params}", scans))
+    return problems
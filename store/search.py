@@ -0,0 +1,411 @@
+import os
+import re
+import pickle
+import logging
+import uuid
+import tempfile
+import threading
+import unicodedata
+from pathlib import Path
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.admin.views.main import ORDER_VAR
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Case, FloatField, Value, When
+from .models import Customer, Product
+from .pagination import KeysetChangeList
+
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+# Extra weight of words starting with a search term over mid-word matches
+PREFIX_BONUS = 0.5
+
+# Bumped when the format of the pickled index changes
+FORMAT_VERSION = 1
+
+
+def normalize(text: str) -> list:
+    """Split ``text`` into lowercase words without accents."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return WORD_RE.findall(text.lower())
+
+
+def word_grams(word: str) -> set:
+    """
+    The trigrams of a word padded like pg_trgm, two spaces in front and
+    one behind, so "ab" gives "  a", " ab" and "ab ".
+    """
+    padded = f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def text_grams(text: str) -> frozenset:
+    grams = set()
+    for word in normalize(text):
+        grams |= word_grams(word)
+    return frozenset(grams)
+
+
+def query_grams(term: str) -> tuple:
+    """
+    Return the trigrams a document must have to match ``term``, and the
+    ones that make it rank higher.
+
+    Words of three letters or more match anywhere in a word, shorter ones
+    only at the start of a word. Either way, words starting with the term
+    rank higher.
+    """
+    required, prefixes = set(), set()
+    for word in normalize(term):
+        leading = {f'  {word[0]}', f' {word[:2]}'}
+        if len(word) < 3:
+            required |= leading if len(word) == 2 else {f'  {word}'}
+        else:
+            required |= {word[index:index + 3] for index in range(len(word) - 2)}
+            prefixes |= leading
+    return required, prefixes
+
+
+class SearchIndex:
+    """
+    In-process trigram index over some text fields of a model, for
+    substring search ranked by field weight.
+
+    Every process holds its own copy, loaded from SEARCH_INDEX_DIR or built
+    from the database. Saves and deletes are recorded in a change log in
+    the default cache by ``record_changes``, which every copy replays before
+    searching. The cache must be shared by every process, like Redis or
+    Memcached, for the copies to see each other's changes.
+
+    Copies that fall behind the log, or whose epoch was changed by
+    ``record_rebuild``, reload the index saved by build_search_index if it
+    is recent enough, and otherwise rebuild in a background thread,
+    serving their stale copy meanwhile. Only a process without any copy
+    builds on the request thread.
+    """
+
+    def __init__(self, name: str, model, fields: dict):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.rebuilding = None
+        self.reset()
+
+    def reset(self):
+        self.postings = defaultdict(set)
+        self.documents = {}
+        self.epoch = None
+        self.seq = 0
+        self.unsaved = 0
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.SEARCH_INDEX_DIR) / f'{self.name}.pickle'
+
+    def key(self, suffix: str) -> str:
+        return f'search:{self.name}:{suffix}'
+
+    # Change log
+
+    def current_state(self) -> tuple:
+        """
+        Return the current epoch and log sequence number. The epoch is a
+        random token, so an index saved before the cache was flushed can't
+        mistake the new log for its own.
+        """
+        values = cache.get_many([self.key('epoch'), self.key('seq')])
+        epoch = values.get(self.key('epoch'))
+        if epoch is None:
+            cache.add(self.key('epoch'), uuid.uuid4().hex, None)
+            epoch = cache.get(self.key('epoch'))
+        return epoch, values.get(self.key('seq'), 0)
+
+    def record_changes(self, pks):
+        """Make every process reindex ``pks`` once the transaction commits."""
+        pks = list(pks)
+        if pks:
+            transaction.on_commit(lambda: self._append_log(pks))
+
+    def _append_log(self, pks: list):
+        if not cache.add(self.key('seq'), 1, None):
+            try:
+                seq = cache.incr(self.key('seq'))
+            except ValueError:
+                seq = 1
+                cache.set(self.key('seq'), seq, None)
+        else:
+            seq = 1
+        cache.set(self.key(f'log:{seq}'), pks, settings.SEARCH_LOG_TIMEOUT)
+
+    def record_rebuild(self):
+        """Make every process rebuild, for bulk writes that don't send signals."""
+        transaction.on_commit(lambda: cache.set(self.key('epoch'), uuid.uuid4().hex, None))
+
+    # Documents
+
+    def add(self, pk, values):
+        self.remove(pk)
+        grams = tuple(text_grams(value) for value in values)
+        self.documents[pk] = grams
+        for field_grams in grams:
+            for gram in field_grams:
+                self.postings[gram].add(pk)
+
+    def remove(self, pk):
+        grams = self.documents.pop(pk, None)
+        if grams is None:
+            return
+        for gram in frozenset().union(*grams):
+            pks = self.postings.get(gram)
+            if pks is not None:
+                pks.discard(pk)
+                if not pks:
+                    del self.postings[gram]
+
+    def index_rows(self, pks=None):
+        """Index the rows of ``pks``, or of the whole table, in chunks."""
+        queryset = self.model.objects.order_by('pk')
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(chunk.values_list('pk', *self.fields)[:settings.SEARCH_INDEX_CHUNK_SIZE])
+            for pk, *values in rows:
+                self.add(pk, values)
+            if len(rows) < settings.SEARCH_INDEX_CHUNK_SIZE:
+                return
+            last_pk = rows[-1][0]
+
+    # Lifecycle
+
+    def build(self):
+        """
+        Index the whole table, then swap the result in and save it. Searches
+        keep using the previous copy until then.
+        """
+        epoch, seq = self.current_state()
+        fresh = SearchIndex(self.name, self.model, self.fields)
+        fresh.index_rows()
+        with self.lock:
+            self.postings, self.documents = fresh.postings, fresh.documents
+            # Changes logged while indexing are replayed by the next sync
+            self.epoch, self.seq = epoch, seq
+            self.loaded = True
+            self.save()
+
+    def rebuild_in_background(self):
+        """Start a build in a thread, unless one is running already."""
+        with self.lock:
+            if self.rebuilding is not None and self.rebuilding.is_alive():
+                return
+            self.rebuilding = threading.Thread(target=self._rebuild, name=f'search-{self.name}', daemon=True)
+            self.rebuilding.start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Rebuilding the %s search index failed", self.name)
+        finally:
+            connections.close_all()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, 'rb') as file:
+                state = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if state.get('version') != FORMAT_VERSION or state.get('fields') != list(self.fields):
+            return False
+
+        self.reset()
+        self.postings = state['postings']
+        self.documents = state['documents']
+        self.epoch = state['epoch']
+        self.seq = state['seq']
+        self.loaded = True
+        return True
+
+    def reload(self, epoch: str, seq: int) -> bool:
+        """
+        Switch to the saved index if it has ``epoch`` and the cache still
+        has the changes since it was saved, e.g. after build_search_index.
+        Keeps the current copy otherwise.
+        """
+        current = self.postings, self.documents, self.epoch, self.seq
+        if self.load() and self.epoch == epoch and self.seq <= seq \
+                and self.log_entries(seq) is not None:
+            return True
+        self.postings, self.documents, self.epoch, self.seq = current
+        self.loaded = True
+        return False
+
+    def save(self):
+        """Write the index to disk atomically, readers never see half a file."""
+        directory = Path(settings.SEARCH_INDEX_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        state = {
+            'version': FORMAT_VERSION,
+            'fields': list(self.fields),
+            'postings': self.postings,
+            'documents': self.documents,
+            'epoch': self.epoch,
+            'seq': self.seq,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.unsaved = 0
+
+    def log_entries(self, seq: int) -> list:
+        """The changes logged after ``self.seq`` up to ``seq``, or None if some expired."""
+        keys = [self.key(f'log:{number}') for number in range(self.seq + 1, seq + 1)]
+        entries = cache.get_many(keys)
+        if len(entries) < len(keys):
+            return None
+        return [entries[key] for key in keys]
+
+    def sync(self):
+        """Load or build the index, then replay the changes it hasn't seen."""
+        with self.lock:
+            if not self.loaded and not self.load():
+                self.build()
+                return
+            if self.rebuilding is not None and self.rebuilding.is_alive():
+                return
+
+            epoch, seq = self.current_state()
+            entries = None
+            if epoch == self.epoch and seq >= self.seq:
+                entries = self.log_entries(seq)
+            if entries is None:
+                # Rebuilt elsewhere, or part of the log expired and the
+                # changes are unknown
+                if not self.reload(epoch, seq):
+                    self.rebuild_in_background()
+                    return
+                entries = self.log_entries(seq)
+            if not entries:
+                return
+
+            pks = set()
+            for entry in entries:
+                pks.update(entry)
+            for pk in pks:
+                self.remove(pk)
+            self.index_rows(pks)
+            self.seq = seq
+
+            self.unsaved += len(entries)
+            if self.unsaved >= settings.SEARCH_INDEX_SAVE_EVERY:
+                self.save()
+
+    # Searching
+
+    def search(self, term: str, limit: int = None) -> list:
+        """
+        Return up to ``limit`` ``(pk, score)`` pairs matching every word of
+        ``term``, best first.
+        """
+        if limit is None:
+            limit = settings.SEARCH_MAX_RESULTS
+        required, prefixes = query_grams(term)
+        if not required:
+            return []
+
+        self.sync()
+        with self.lock:
+            postings = sorted((self.postings.get(gram, set()) for gram in required), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+
+            weights = list(self.fields.values())
+            total_weight = sum(weights)
+            scored = []
+            for pk in candidates:
+                grams = self.documents[pk]
+                score = sum(
+                    weight * len(required & field_grams) / len(required)
+                    for weight, field_grams in zip(weights, grams)
+                ) / total_weight
+                if prefixes and any(prefixes <= field_grams for field_grams in grams):
+                    score += PREFIX_BONUS
+                scored.append((pk, score))
+
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+
+product_index = SearchIndex('products', Product, {'title': 2, 'description': 1})
+customer_index = SearchIndex('customers', Customer, {'first_name': 2, 'last_name': 2, 'email': 1})
+
+INDEXES = {index.name: index for index in (product_index, customer_index)}
+
+
+class SearchChangeList(KeysetChangeList):
+    """Shows search results best match first unless a column is sorted."""
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        limit = getattr(request, 'search_truncated', None)
+        if limit:
+            self.model_admin.message_user(
+                request,
+                f"Only the {limit} best matches are shown, refine the search to see the others.",
+                messages.WARNING,
+                fail_silently=True
+            )
+        return queryset
+
+    def get_ordering(self, request, queryset):
+        if ORDER_VAR not in self.params and 'search_rank' in queryset.query.annotations:
+            return ['-search_rank', '-pk']
+        return super().get_ordering(request, queryset)
+
+
+class IndexedSearchMixin:
+    """
+    Answer the admin search box from ``search_index`` instead of LIKE
+    queries, annotating each result with its ``search_rank``.
+    """
+
+    search_index = None
+
+    def get_changelist(self, request, **kwargs):
+        return SearchChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.search_index is None or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+
+        limit = settings.SEARCH_MAX_RESULTS
+        results = self.search_index.search(search_term, limit + 1)
+        if not results:
+            return queryset.none(), False
+        if len(results) > limit:
+            results = results[:limit]
+            # Shown by SearchChangeList, not by autocomplete widgets
+            request.search_truncated = limit
+
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in results],
+            output_field=FloatField()
+        )
+        queryset = queryset \
+            .filter(pk__in=[pk for pk, _ in results]) \
+            .annotate(search_rank=rank)
+        return queryset, False
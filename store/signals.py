@@ -0,0 +1,180 @@
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from . import catalog
+from .counters import adjust_count, move_count
+from .invoice_cache import invoice_cache
+from .pricing import effective_price, refresh_effective_prices
+from .search import customer_index, product_index
+from . import models
+
+
+@receiver([post_save, post_delete], sender=models.Order)
+def invalidate_order_invoice(sender, instance, **kwargs):
+    invoice_cache.invalidate([instance.id])
+
+
+@receiver([post_save, post_delete], sender=models.OrderItem)
+def invalidate_order_item_invoice(sender, instance, **kwargs):
+    invoice_cache.invalidate([instance.order_id])
+
+
+@receiver([post_save, post_delete], sender=models.Customer)
+def invalidate_customer_invoices(sender, instance, **kwargs):
+    if kwargs.get('created'):
+        return
+    order_ids = models.Order.objects \
+                      .filter(customer_id=instance.id) \
+                      .values_list('id', flat=True)
+    invoice_cache.invalidate(order_ids)
+
+
+def remember_previous(instance, field: str, update_fields):
+    """
+    Stash the stored value of a foreign key before it is overwritten,
+    so that post_save can move counters from the old row to the new one.
+
+    The row is locked for the rest of the save's transaction, see
+    ``StoredValuesMixin.locked_fields``: concurrent saves of the same row
+    wait for this one and move the counters from the value it wrote.
+    """
+    instance._previous_fk = None
+    if instance._state.adding:
+        return
+    if not instance.writes(f'{field}_id', update_fields):
+        return
+    instance._previous_fk = type(instance).objects \
+        .select_for_update() \
+        .filter(pk=instance.pk) \
+        .values_list(f'{field}_id', flat=True) \
+        .first()
+
+
+@receiver(pre_save, sender=models.Order)
+def remember_order_customer(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        remember_previous(instance, 'customer', update_fields)
+
+
+@receiver(post_save, sender=models.Order)
+def count_saved_order(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_count(models.Customer, 'orders_count', instance.customer_id, 1)
+    elif instance._previous_fk is not None:
+        move_count(models.Customer, 'orders_count',
+                   instance._previous_fk, instance.customer_id)
+
+
+@receiver(post_delete, sender=models.Order)
+def count_deleted_order(sender, instance, **kwargs):
+    adjust_count(models.Customer, 'orders_count', instance.customer_id, -1)
+
+
+@receiver(pre_save, sender=models.Product)
+def remember_product_collection(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        remember_previous(instance, 'collection', update_fields)
+
+
+@receiver(post_save, sender=models.Product)
+def count_saved_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_count(models.Collection, 'product_count', instance.collection_id, 1)
+    elif instance._previous_fk is not None:
+        move_count(models.Collection, 'product_count',
+                   instance._previous_fk, instance.collection_id)
+
+
+@receiver(post_delete, sender=models.Product)
+def count_deleted_product(sender, instance, **kwargs):
+    adjust_count(models.Collection, 'product_count', instance.collection_id, -1)
+
+
+@receiver(pre_save, sender=models.Product)
+def price_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'unit_price', 'effective_price'} & set(update_fields):
+        return
+    discounts = []
+    if not instance._state.adding:
+        if not instance.has_changed('unit_price'):
+            # Promotion changes reprice the stored products themselves
+            return
+        discounts = models.Product.promotions.through.objects \
+            .filter(product_id=instance.pk) \
+            .values_list('promotion__discount', flat=True)
+    instance.effective_price = effective_price(instance.unit_price, discounts)
+
+
+@receiver(post_save, sender=models.Product)
+def reprice_partially_saved_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'effective_price' not in update_fields \
+            and 'unit_price' in update_fields:
+        refresh_effective_prices([instance.id])
+
+
+@receiver([post_save, post_delete], sender=models.Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    # Their product counts, featured products are cached on their own
+    collection_ids = {instance.collection_id, getattr(instance, '_previous_fk', None)}
+    catalog.bump(
+        catalog.product_scope(instance.id),
+        catalog.PRODUCTS,
+        catalog.COLLECTIONS,
+        catalog.PRODUCT_SLUGS,
+        *(catalog.collection_scope(pk) for pk in collection_ids if pk is not None)
+    )
+
+
+@receiver([post_save, post_delete], sender=models.Collection)
+def invalidate_cached_collection(sender, instance, **kwargs):
+    catalog.bump(catalog.collection_scope(instance.id), catalog.COLLECTIONS)
+
+
+@receiver(m2m_changed, sender=models.Product.promotions.through)
+def reprice_promoted_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The products are unknown once the promotion has been cleared
+        instance._promoted_ids = list(instance.product_set.values_list('id', flat=True))
+    elif action.startswith('post_'):
+        if not reverse:
+            refresh_effective_prices([instance.id])
+        else:
+            refresh_effective_prices(instance._promoted_ids if action == 'post_clear' else pk_set)
+
+
+@receiver([pre_save, pre_delete], sender=models.Promotion)
+def remember_promoted_products(sender, instance, **kwargs):
+    instance._promoted_ids = []
+    if instance.pk is not None:
+        instance._promoted_ids = list(
+            models.Product.promotions.through.objects
+                  .filter(promotion_id=instance.pk)
+                  .values_list('product_id', flat=True)
+        )
+
+
+@receiver([post_save, post_delete], sender=models.Promotion)
+def reprice_promotion_products(sender, instance, **kwargs):
+    refresh_effective_prices(instance._promoted_ids)
+
+
+# Registered after the pricing receivers, so prices are up to date by the
+# time cached products are invalidated
+@receiver([post_save, post_delete], sender=models.Promotion)
+@receiver(m2m_changed, sender=models.Product.promotions.through)
+def invalidate_cached_promotions(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        catalog.invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=models.Product)
+def reindex_product(sender, instance, **kwargs):
+    product_index.record_changes([instance.id])
+
+
+@receiver([post_save, post_delete], sender=models.Customer)
+def reindex_customer(sender, instance, **kwargs):
+    customer_index.record_changes([instance.id])
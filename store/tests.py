@@ -1,3 +1,1351 @@
-from django.test import TestCase
+import io
+import os
+import pathlib
+import csv
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import threading
+import zipfile
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from . import carts, catalog, counters, exports, imports, invoices, models
+from .checkout import EmptyCart, InsufficientInventory, checkout
+from .invoice_cache import InvoiceCache, invoice_cache
+from .pricing import effective_price
+from .pagination import CachedCountPaginator, KeysetChangeList
+from .query_plans import ADMIN_ACCESS_PATHS, full_table_scans, get_changelist_queryset, index_name
+from .search import INDEXES, SearchIndex, normalize, product_index, query_grams, word_grams
+from .views import CART_SESSION_KEY
+from storefront.queries import assert_no_repeated_queries, fingerprint, query_stats
+
+
+class AdminQueryCountTests(TestCase):
+    """
+    Every admin changelist and changeform must load with a fixed number of
+    queries, no matter how many rows it displays.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.collection = models.Collection.objects.create(title='Collection')
+        cls.order = cls.create_rows(cls.collection, 'a', 2)
+
+    @staticmethod
+    def create_rows(collection, prefix: str, count: int) -> models.Order:
+        order = None
+        for index in range(count):
+            customer = models.Customer.objects.create(
+                first_name=f'{prefix}{index}',
+                last_name='Customer',
+                email=f'{prefix}{index}@example.com',
+                phone='1234567890'
+            )
+            product = models.Product.objects.create(
+                title=f'{prefix}{index}',
+                slug=f'{prefix}{index}',
+                description='',
+                unit_price=Decimal('10.00'),
+                inventory=index,
+                collection=collection
+            )
+            order = models.Order.objects.create(customer=customer)
+            models.OrderItem.objects.create(
+                order=order,
+                product=product,
+                quantity=1,
+                unit_price=product.unit_price
+            )
+            models.Collection.objects.create(title=f'{prefix}{index}', featured_product=product)
+        return order
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertConstantQueries(self, url: str, add_rows):
+        # Warm up per-process caches (content types, admin theme) first
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        add_rows()
+
+        with self.assertNumQueries(len(context.captured_queries)):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def add_rows(self):
+        self.create_rows(self.collection, 'b', 5)
+
+    def add_order_items(self):
+        for product in models.Product.objects.all()[:5]:
+            models.OrderItem.objects.create(
+                order=self.order,
+                product=product,
+                quantity=2,
+                unit_price=product.unit_price
+            )
+
+    def test_order_changelist(self):
+        self.assertConstantQueries('/admin/store/order/', self.add_rows)
+
+    def test_order_changeform(self):
+        self.assertConstantQueries(f'/admin/store/order/{self.order.id}/change/', self.add_order_items)
+
+    def test_customer_changelist(self):
+        self.assertConstantQueries('/admin/store/customer/', self.add_rows)
+
+    def test_customer_changeform(self):
+        url = f'/admin/store/customer/{self.order.customer_id}/change/'
+        self.assertConstantQueries(url, self.add_rows)
+
+    def test_product_changelist(self):
+        self.assertConstantQueries('/admin/store/product/', self.add_rows)
+
+    def test_product_changeform(self):
+        product = models.Product.objects.first()
+        self.assertConstantQueries(f'/admin/store/product/{product.id}/change/', self.add_rows)
+
+    def test_collection_changelist(self):
+        self.assertConstantQueries('/admin/store/collection/', self.add_rows)
+
+    def test_collection_changeform(self):
+        url = f'/admin/store/collection/{self.collection.id}/change/'
+        self.assertConstantQueries(url, self.add_rows)
+
+
+class TemporarySearchIndexes:
+    """
+    Saves the search indexes in a temporary SEARCH_INDEX_DIR, and starts
+    every test without them.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overridden = override_settings(SEARCH_INDEX_DIR=directory)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+        cache.clear()
+        for index in INDEXES.values():
+            index.reset()
+            index.loaded = False
+
+
+class QueryPlanTests(TemporarySearchIndexes, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Enough rows, with statistics, for the planner to prefer indexes
+        collection = models.Collection.objects.create(title='Collection')
+        AdminQueryCountTests.create_rows(collection, 'a', 10)
+        AdminQueryCountTests.create_rows(collection, 'b', 90)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_admin_queries_use_indexes(self):
+        for model, params, ordered_by in ADMIN_ACCESS_PATHS:
+            with self.subTest(model=model.__name__, params=params):
+                queryset = get_changelist_queryset(model, params)
+                ordered_index = ordered_by and index_name(model, ordered_by)
+                self.assertEqual(full_table_scans(queryset, ordered_index), [])
+
+    def test_full_scans(self):
+        self.assertEqual(
+            full_table_scans(models.Product.objects.filter(description='a')),
+            ['store_product']
+        )
+        # Reads the whole index, unless it is the one the page is sorted by
+        queryset = models.Product.objects.order_by('inventory')[:20]
+        self.assertEqual(full_table_scans(queryset), ['store_product'])
+        self.assertEqual(
+            full_table_scans(queryset, index_name(models.Product, ['inventory'])), [])
+        self.assertEqual(full_table_scans(models.Product.objects.filter(inventory=1)), [])
+
+    def test_check_query_plans_command(self):
+        call_command('check_query_plans', stdout=io.StringIO())
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        # Ties on the leading columns, the keyset has to fall through to the pk
+        for index in range(45):
+            models.Customer.objects.create(
+                first_name=f'First {index % 4}', last_name=f'Last {index % 3}',
+                email=f'{index}@example.com', phone='1234567890')
+        cls.ids = list(models.Customer.objects
+                             .order_by('first_name', 'last_name', '-pk')
+                             .values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get(self, query: str = ''):
+        response = self.client.get('/admin/store/customer/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def page_ids(self, cl) -> list:
+        return [customer.id for customer in cl.result_list]
+
+    def walk(self, query: str, link: str) -> tuple:
+        """Follow ``link`` from page to page, return the pages and their query counts."""
+        pages, queries = [], []
+        while query:
+            with CaptureQueriesContext(connection) as context:
+                cl = self.get(query)
+                pages.append(self.page_ids(cl))
+            queries.append(len(context.captured_queries))
+            query = getattr(cl, link)
+        return pages, queries
+
+    def test_pages_forward(self):
+        cl = self.get()
+        self.assertTrue(cl.keyset_enabled)
+        self.assertEqual([field.name for field, _ in cl.keyset], ['first_name', 'last_name', 'id'])
+        self.assertIsNone(cl.previous_page_url)
+
+        pages, queries = self.walk(cl.next_page_url, 'next_page_url')
+        pages.insert(0, self.page_ids(cl))
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), self.ids)
+        # The count is cached, every page after the first costs the same
+        self.assertEqual(len(set(queries)), 1)
+
+    def test_pages_backward(self):
+        last = self.get(self.get().last_page_url)
+        self.assertIsNone(last.next_page_url)
+        self.assertIsNone(last.last_page_url)
+        self.assertEqual(self.page_ids(last), self.ids[-20:])
+
+        pages, queries = self.walk(last.previous_page_url, 'previous_page_url')
+        pages.reverse()
+        self.assertEqual(sum(pages, []) + self.page_ids(last), self.ids)
+        self.assertEqual(len(set(queries)), 1)
+        # The first page reached backwards links forward again
+        first = self.get(last.first_page_url)
+        self.assertEqual(self.page_ids(first), self.ids[:20])
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        # Not base64, not JSON, values of the wrong number and type
+        cursors = ['garbage!', 'bm90IGpzb24=', KeysetChangeList.encode_cursor(None, 'n', [1]),
+                   KeysetChangeList.encode_cursor(None, 'n', ['a', 'b', 'c'])]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.page_ids(self.get(f'?cursor={cursor}')), self.ids[:20])
+
+    def test_page_numbers_and_orderings_without_a_seek_key(self):
+        cl = self.get('?p=2')
+        self.assertFalse(cl.keyset_enabled)
+        self.assertEqual(self.page_ids(cl), self.ids[20:40])
+
+        # Not unique, nullable, an annotation
+        self.assertIsNone(cl.get_keyset(['first_name', 'last_name']))
+        self.assertIsNone(cl.get_keyset(['birth_date', 'id']))
+        self.assertIsNone(cl.get_keyset(['orders', 'id']))
+        self.assertEqual(len(cl.get_keyset(['-email'])), 1)
+
+    def test_count_is_cached(self):
+        queryset = models.Customer.objects.filter(first_name='First 0').order_by('id')
+        self.assertEqual(CachedCountPaginator(queryset, 20).count, 12)
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(queryset, 20).count, 12)
+
+    def test_estimated_count(self):
+        with mock.patch.object(CachedCountPaginator, 'estimated_count', return_value=1000000):
+            paginator = CachedCountPaginator(models.Customer.objects.order_by('id'), 20)
+            self.assertEqual(paginator.count, 1000000)
+            self.assertTrue(paginator.is_estimate)
+
+            cl = self.get()
+            self.assertTrue(cl.count_is_estimate)
+            # Filtered lists are counted
+            filtered = CachedCountPaginator(models.Customer.objects.filter(last_name='Last 0'), 20)
+            self.assertEqual(filtered.count, 15)
+            self.assertFalse(filtered.is_estimate)
+        # Too small a table for the estimate
+        self.assertIsNone(CachedCountPaginator(models.Customer.objects.all(), 20).estimated_count())
+
+class RepeatedQueryTests(TestCase):
+    """Admin pages and actions must not run a query per displayed row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        AdminQueryCountTests.create_rows(
+            models.Collection.objects.create(title='Collection'), 'a', 10)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT "id" FROM "t"  WHERE "id" IN (%s, %s, %s) AND "x" = \'a\' LIMIT 21'),
+            'SELECT "id" FROM "t" WHERE "id" IN (...) AND "x" = ? LIMIT ?'
+        )
+        self.assertEqual(
+            fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" ("a", "b") VALUES (...)'
+        )
+
+    def test_repeated_queries_fail(self):
+        with self.assertRaises(AssertionError):
+            with assert_no_repeated_queries(threshold=2):
+                for customer in models.Customer.objects.all():
+                    list(customer.order_set.all())
+
+    def test_admin_changelists(self):
+        for url in ['/admin/store/order/', '/admin/store/customer/',
+                    '/admin/store/product/', '/admin/store/collection/']:
+            with self.subTest(url=url), assert_no_repeated_queries():
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(INVOICE_RENDER_WORKERS=1)
+    def test_download_invoices(self):
+        with assert_no_repeated_queries():
+            response = self.client.post('/admin/store/order/', {
+                'action': 'download_invoices',
+                '_selected_action': list(models.Order.objects.values_list('id', flat=True)),
+            })
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_INSPECTION_SAMPLE_RATE=1.0, ROOT_URLCONF=__name__)
+    def test_middleware_reports_repeated_queries(self):
+        query_stats.reset()
+        with self.assertLogs('storefront.queries', 'WARNING') as logs:
+            self.client.get('/collection-titles/')
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('repeated 10 times by collection_titles', logs.output[0])
+
+        stats = query_stats.snapshot()['collection_titles']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['repeated_requests'], 1)
+
+    @override_settings(QUERY_INSPECTION_SAMPLE_RATE=1.0)
+    def test_middleware_ignores_admin_pages(self):
+        query_stats.reset()
+        with self.assertNoLogs('storefront.queries', 'WARNING'):
+            self.client.get('/admin/store/order/')
+        stats = query_stats.snapshot()['admin:store_order_changelist']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['repeated_requests'], 0)
+
+    @override_settings(QUERY_EXPLAIN_MAX_FINGERPRINTS=2)
+    def test_explained_fingerprints_are_capped(self):
+        query_stats.reset()
+        for table in 'abc':
+            self.assertTrue(query_stats.should_explain(f'SELECT * FROM {table}'))
+        self.assertEqual(list(query_stats.explained), ['SELECT * FROM b', 'SELECT * FROM c'])
+        self.assertFalse(query_stats.should_explain('SELECT * FROM c'))
+
+
+def collection_titles(request):
+    # A loop running one query per product
+    titles = [product.collection.title for product in models.Product.objects.order_by('id')]
+    return HttpResponse(len(titles))
+
+
+urlpatterns = [
+    path('collection-titles/', collection_titles, name='collection_titles'),
+]
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdminQueryCountTests.create_rows(
+            models.Collection.objects.create(title='Collection'), 'a', 10)
+        cls.customer = models.Customer.objects.first()
+        cls.products = list(models.Product.objects.order_by('id'))
+        models.Product.objects.update(inventory=5)
+
+    def create_cart(self, products, quantity: int = 2) -> models.Cart:
+        cart = models.Cart.objects.create()
+        for product in products:
+            models.CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def test_checkout(self):
+        cart = self.create_cart(self.products[:3])
+        promotion = models.Promotion.objects.create(description='Sale', discount=0.1)
+        product = models.Product.objects.get(pk=self.products[0].pk)
+        product.unit_price = Decimal('12.50')
+        product.save()
+        product.promotions.add(promotion)
+
+        order = checkout(cart.id, self.customer)
+
+        items = order.orderitem_set.order_by('product_id')
+        self.assertEqual(
+            [(item.product_id, item.quantity, item.unit_price) for item in items],
+            [(self.products[0].pk, 2, Decimal('11.25')),
+             (self.products[1].pk, 2, Decimal('10.00')),
+             (self.products[2].pk, 2, Decimal('10.00'))]
+        )
+        self.assertEqual(
+            list(models.Product.objects.order_by('id').values_list('inventory', flat=True)[:4]),
+            [3, 3, 3, 5]
+        )
+        self.assertFalse(models.CartItem.objects.filter(cart=cart).exists())
+
+    def test_constant_statements(self):
+        cart = self.create_cart(self.products[:1])
+        with CaptureQueriesContext(connection) as context:
+            checkout(cart.id, self.customer)
+        cart = self.create_cart(self.products)
+        with self.assertNumQueries(len(context.captured_queries)):
+            checkout(cart.id, self.customer)
+
+    def test_insufficient_inventory(self):
+        cart = self.create_cart(self.products[:3])
+        models.Product.objects.filter(pk=self.products[1].pk).update(inventory=1)
+
+        with self.assertRaises(InsufficientInventory) as context:
+            checkout(cart.id, self.customer)
+
+        self.assertEqual(context.exception.product_ids, [self.products[1].pk])
+        self.assertEqual(
+            list(models.Product.objects.order_by('id').values_list('inventory', flat=True)[:3]),
+            [5, 1, 5]
+        )
+        self.assertEqual(models.CartItem.objects.filter(cart=cart).count(), 3)
+        self.assertFalse(models.OrderItem.objects.filter(order__customer=self.customer,
+                                                         quantity=2).exists())
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCart):
+            checkout(models.Cart.objects.create().id, self.customer)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Many threads check out carts holding the same products at once. Every
+    unit of inventory must be sold exactly once.
+    """
+
+    threads = 8
+    carts_per_thread = 10
+
+    def test_no_oversell(self):
+        collection = models.Collection.objects.create(title='Collection')
+        AdminQueryCountTests.create_rows(collection, 'a', 3)
+        customer = models.Customer.objects.first()
+        products = list(models.Product.objects.order_by('id'))
+        models.Product.objects.update(inventory=25)
+
+        carts = []
+        for _ in range(self.threads * self.carts_per_thread):
+            cart = models.Cart.objects.create()
+            for product in products:
+                models.CartItem.objects.create(cart=cart, product=product, quantity=1)
+            carts.append(cart.id)
+
+        outcomes = []
+
+        def worker(cart_ids):
+            try:
+                for cart_id in cart_ids:
+                    while True:
+                        try:
+                            checkout(cart_id, customer)
+                            outcomes.append('ordered')
+                        except InsufficientInventory:
+                            outcomes.append('short')
+                        except OperationalError:
+                            # SQLite allows a single writer and reports
+                            # the others as locked, try again
+                            time.sleep(0.01)
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(carts[index::self.threads],))
+            for index in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('ordered'), 25)
+        self.assertEqual(outcomes.count('short'), len(carts) - 25)
+        self.assertEqual(
+            list(models.Product.objects.values_list('inventory', flat=True)), [0, 0, 0])
+        for product in products:
+            self.assertEqual(
+                models.OrderItem.objects.filter(product=product).aggregate(sold=Sum('quantity'))['sold'],
+                25 + 1  # create_rows() adds one order item per product
+            )
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.collection = models.Collection.objects.create(title='Collection')
+        AdminQueryCountTests.create_rows(cls.collection, 'a', 3)
+
+    def get_products(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/store/products/', **headers)
+
+    def test_not_modified(self):
+        etag = self.get_products()['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_products(etag).status_code, 304)
+
+    def test_product_changes_change_etag(self):
+        etag = self.get_products()['ETag']
+        product = models.Product.objects.order_by('id').first()
+        product.title = 'Renamed'
+        product.save()
+        response = self.get_products(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['title'], 'Renamed')
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_clear_inventory_changes_etag(self):
+        response = self.get_products()
+        etag = response['ETag']
+        self.client.force_login(self.user)
+        self.client.post('/admin/store/product/', {
+            'action': 'clear_inventory',
+            '_selected_action': list(models.Product.objects.values_list('id', flat=True)),
+        })
+
+        response = self.get_products(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({product['inventory'] for product in response.json()['results']}, {0})
+
+    def test_clear_inventory_refreshes_product_detail(self):
+        product = models.Product.objects.order_by('id').last()
+        url = f'/store/products/{product.slug}/'
+        self.assertEqual(self.client.get(url).json()['inventory'], product.inventory)
+        self.client.force_login(self.user)
+        self.client.post('/admin/store/product/', {
+            'action': 'clear_inventory',
+            '_selected_action': [product.id],
+        })
+
+        self.assertEqual(self.client.get(url).json()['inventory'], 0)
+
+    def test_replaced_product_changes_etag(self):
+        etag = self.get_products()['ETag']
+        product = models.Product.objects.order_by('id').last()
+        last_update = product.last_update
+        models.OrderItem.objects.filter(product=product).delete()
+        models.Collection.objects.filter(featured_product=product).delete()
+        product.delete()
+        replacement = models.Product.objects.create(
+            title='b', slug='b', description='', unit_price=Decimal('1.00'),
+            inventory=1, collection=self.collection
+        )
+        models.Product.objects.filter(pk=replacement.pk).update(last_update=last_update)
+
+        self.assertEqual(self.get_products(etag).status_code, 200)
+
+
+@override_settings(CART_WRITE_THROUGH=False, CART_LOCK_TIMEOUT=0.05)
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdminQueryCountTests.create_rows(
+            models.Collection.objects.create(title='Collection'), 'a', 3)
+        cls.products = list(models.Product.objects.order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.cart_id = carts.create_cart()
+
+    def saved_items(self, cart_id=None) -> dict:
+        return dict(models.CartItem.objects
+                          .filter(cart_id=cart_id or self.cart_id)
+                          .values_list('product_id', 'quantity'))
+
+    def dirty_since(self):
+        return models.Cart.objects.values_list('dirty_since', flat=True).get(id=self.cart_id)
+
+    def test_changes_are_cached_until_flushed(self):
+        carts.add_item(self.cart_id, self.products[0], 2)
+        carts.add_item(self.cart_id, self.products[1])
+        carts.set_quantity(self.cart_id, self.products[1], 0)
+
+        self.assertEqual(carts.get_items(self.cart_id), {self.products[0]: 2})
+        self.assertEqual(self.saved_items(), {})
+        self.assertIsNotNone(self.dirty_since())
+
+        self.assertTrue(carts.flush(self.cart_id))
+        self.assertEqual(self.saved_items(), {self.products[0]: 2})
+        self.assertIsNone(self.dirty_since())
+        self.assertFalse(carts.flush(self.cart_id))
+
+        carts.set_quantity(self.cart_id, self.products[0], 5)
+        carts.add_item(self.cart_id, self.products[2])
+        carts.flush(self.cart_id)
+        self.assertEqual(self.saved_items(), {self.products[0]: 5, self.products[2]: 1})
+
+    def test_load_falls_back_to_the_database(self):
+        carts.add_item(self.cart_id, self.products[0], 3)
+        carts.flush(self.cart_id)
+        cache.clear()
+        self.assertEqual(carts.get_items(self.cart_id), {self.products[0]: 3})
+
+    def test_flush_carts_command(self):
+        carts.add_item(self.cart_id, self.products[0])
+        other_id = carts.create_cart()
+        carts.add_item(other_id, self.products[1])
+
+        call_command('flush_carts', stdout=io.StringIO())
+        self.assertEqual(self.saved_items(), {})
+
+        output = io.StringIO()
+        call_command('flush_carts', '--idle', '0', stdout=output)
+        self.assertIn('Flushed 2 carts', output.getvalue())
+        self.assertEqual(self.saved_items(), {self.products[0]: 1})
+        self.assertEqual(self.saved_items(other_id), {self.products[1]: 1})
+        self.assertFalse(models.Cart.objects.exclude(dirty_since=None).exists())
+
+    def test_flush_evicted_cart(self):
+        carts.add_item(self.cart_id, self.products[0])
+        cache.clear()
+        self.assertEqual(carts.flush_idle_carts(0), 0)
+        self.assertIsNone(self.dirty_since())
+
+    @override_settings(CART_WRITE_THROUGH=None)
+    def test_process_local_cache_writes_through(self):
+        carts.add_item(self.cart_id, self.products[0], 2)
+        self.assertEqual(self.saved_items(), {self.products[0]: 2})
+        self.assertIsNone(self.dirty_since())
+
+    def test_lock_timeout(self):
+        lock_key = carts.cart_key(self.cart_id) + carts.LOCK_SUFFIX
+        cache.add(lock_key, 'other', 60)
+        with self.assertRaises(carts.CartLocked):
+            carts.add_item(self.cart_id, self.products[0])
+        self.assertEqual(cache.get(lock_key), 'other')
+
+        session = self.client.session
+        session[CART_SESSION_KEY] = self.cart_id
+        session.save()
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.post('/store/cart/items/', {'product_id': self.products[0]},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+    def test_lock_is_released_by_its_holder_only(self):
+        lock_key = 'key' + carts.LOCK_SUFFIX
+        with carts.locked('key'):
+            # Expired and taken by another process meanwhile
+            cache.set(lock_key, 'other')
+        self.assertEqual(cache.get(lock_key), 'other')
+
+        cache.delete(lock_key)
+        with carts.locked('key'):
+            pass
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_checkout_flushes_the_cart(self):
+        models.Product.objects.update(inventory=5)
+        carts.add_item(self.cart_id, self.products[0], 2)
+        order = carts.checkout(self.cart_id, models.Customer.objects.first())
+        self.assertEqual(list(order.orderitem_set.values_list('product_id', 'quantity')),
+                         [(self.products[0], 2)])
+        self.assertEqual(carts.get_items(self.cart_id), {})
+
+    def test_purge_carts_command(self):
+        carts.add_item(self.cart_id, self.products[0])
+        carts.flush(self.cart_id)
+        recent_id = carts.create_cart()
+        models.Cart.objects.filter(id=self.cart_id).update(
+            created_at=timezone.now() - datetime.timedelta(days=31))
+
+        output = io.StringIO()
+        call_command('purge_carts', '--days', '30', stdout=output)
+        self.assertIn('Deleted 1 carts', output.getvalue())
+        self.assertEqual(list(models.Cart.objects.values_list('id', flat=True)), [recent_id])
+        self.assertFalse(models.CartItem.objects.exists())
+        self.assertIsNone(cache.get(carts.cart_key(self.cart_id)))
+
+    def test_purged_cart_is_replaced(self):
+        session = self.client.session
+        session[CART_SESSION_KEY] = self.cart_id
+        session.save()
+        carts.purge_carts(timezone.now() + datetime.timedelta(seconds=1))
+
+        self.assertEqual(self.client.get('/store/cart/').json(), {'id': None, 'items': []})
+        response = self.client.post('/store/cart/items/', {'product_id': self.products[0]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        cart_id = response.json()['id']
+        self.assertNotEqual(cart_id, self.cart_id)
+        self.assertEqual(self.client.session[CART_SESSION_KEY], cart_id)
+        self.assertIsNotNone(models.Cart.objects.get(id=cart_id).dirty_since)
+        carts.flush(cart_id)
+        self.assertEqual(self.saved_items(cart_id), {self.products[0]: 1})
+
+
+class SearchTests(TemporarySearchIndexes, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.collection = models.Collection.objects.create(title='Collection')
+        cls.lamp = cls.create_product('Desk Lamp', 'A lamp for the desk.')
+        cls.lampshade = cls.create_product('Lampshade', '')
+        cls.chair = cls.create_product('Chair', 'Goes well with the lamp.')
+
+    @classmethod
+    def create_product(cls, title: str, description: str) -> models.Product:
+        return models.Product.objects.create(
+            title=title, slug=title.lower().replace(' ', '-'), description=description,
+            unit_price=Decimal('10.00'), inventory=1, collection=cls.collection
+        )
+
+    def search(self, term: str, index=product_index) -> list:
+        return [pk for pk, _ in index.search(term)]
+
+    def test_grams(self):
+        self.assertEqual(normalize('Café  Crème-brûlée!'), ['cafe', 'creme', 'brulee'])
+        self.assertEqual(word_grams('ab'), {'  a', ' ab', 'ab '})
+        self.assertEqual(query_grams('la'), ({'  l', ' la'}, set()))
+        self.assertEqual(query_grams('lamp'), ({'lam', 'amp'}, {'  l', ' la'}))
+
+    def test_search(self):
+        # Titles weigh more than descriptions, words starting with the term
+        # more than words containing it
+        self.assertEqual(self.search('lamp'), [self.lamp.pk, self.lampshade.pk, self.chair.pk])
+        self.assertEqual(self.search('amp'), [self.lamp.pk, self.lampshade.pk, self.chair.pk])
+        self.assertEqual(self.search('desk lamp'), [self.lamp.pk])
+        self.assertEqual(self.search('ch'), [self.chair.pk])
+        self.assertEqual(self.search('xyz'), [])
+        self.assertEqual(product_index.search('lamp', limit=1)[0][0], self.lamp.pk)
+
+    def test_changes_are_replayed(self):
+        self.assertEqual(self.search('table'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            table = self.create_product('Table', '')
+        self.assertEqual(self.search('table'), [table.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Product.objects.filter(pk=self.chair.pk).update(title='Armchair')
+            product_index.record_changes([self.chair.pk])
+            table.delete()
+        self.assertEqual(self.search('table'), [])
+        self.assertEqual(self.search('armchair'), [self.chair.pk])
+
+    def test_saved_index_is_loaded(self):
+        product_index.sync()
+        other = SearchIndex(product_index.name, models.Product, product_index.fields)
+        with mock.patch.object(SearchIndex, 'index_rows') as index_rows:
+            self.assertEqual(self.search('lamp', other)[0], self.lamp.pk)
+        index_rows.assert_not_called()
+
+    def test_rebuild_runs_in_background(self):
+        product_index.sync()
+        with self.captureOnCommitCallbacks(execute=True):
+            # bulk_create sends no signals
+            models.Product.objects.bulk_create([models.Product(
+                title='Table', slug='table', description='', unit_price=Decimal('1.00'),
+                effective_price=Decimal('1.00'), inventory=1, collection=self.collection
+            )])
+            product_index.record_rebuild()
+
+        with mock.patch.object(SearchIndex, 'rebuild_in_background') as rebuild:
+            # The stale copy is served meanwhile
+            self.assertEqual(self.search('table'), [])
+        rebuild.assert_called_once()
+
+        # build_search_index saved a fresh copy, which is loaded instead
+        SearchIndex(product_index.name, models.Product, product_index.fields).build()
+        with mock.patch.object(SearchIndex, 'rebuild_in_background') as rebuild:
+            self.assertEqual(len(self.search('table')), 1)
+        rebuild.assert_not_called()
+
+    def test_build_search_index_command(self):
+        call_command('build_search_index', 'products', stdout=io.StringIO())
+        self.assertTrue(product_index.path.exists())
+        self.assertTrue(str(product_index.path).startswith(tempfile.gettempdir()))
+
+    @override_settings(SEARCH_MAX_RESULTS=2)
+    def test_admin_search_says_when_results_are_truncated(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/store/product/', {'q': 'lamp'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertEqual(len(list(response.context['messages'])), 1)
+
+        response = self.client.get('/admin/store/product/', {'q': 'desk'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertEqual(list(response.context['messages']), [])
+
+
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = models.Collection.objects.create(title='Collection')
+        AdminQueryCountTests.create_rows(cls.collection, 'a', 3)
+        cls.sale = models.Promotion.objects.create(description='Sale', discount=0.1)
+        cls.clearance = models.Promotion.objects.create(description='Clearance', discount=0.25)
+
+    def setUp(self):
+        cache.clear()
+
+    def prices(self) -> dict:
+        return dict(models.Product.objects.values_list('title', 'effective_price'))
+
+    def assertPricesMatchDatabase(self):
+        for product in models.Product.objects.with_effective_price():
+            self.assertEqual(product.effective_price, product.current_price, product.title)
+
+    def test_effective_price(self):
+        self.assertEqual(effective_price(Decimal('10.00'), []), Decimal('10.00'))
+        self.assertEqual(effective_price(Decimal('10.00'), [0.1, 0.25]), Decimal('7.50'))
+        self.assertEqual(effective_price(Decimal('10.00'), [0.1, 0.25], stack=True), Decimal('6.75'))
+        # Discounts are clamped between 0 and 1
+        self.assertEqual(effective_price(Decimal('10.00'), [1.5]), Decimal('0.00'))
+        self.assertEqual(effective_price(Decimal('10.00'), [-0.2]), Decimal('10.00'))
+        # Rounded half up to the cent
+        self.assertEqual(effective_price(Decimal('0.05'), [0.5]), Decimal('0.03'))
+        self.assertEqual(effective_price(Decimal('19.99'), [0.15]), Decimal('16.99'))
+
+    def test_promotion_changes_reprice_products(self):
+        a0, a1, a2 = models.Product.objects.order_by('title')
+        a0.promotions.add(self.sale, self.clearance)
+        self.clearance.product_set.add(a1)
+        self.assertEqual(self.prices(), {'a0': Decimal('7.50'), 'a1': Decimal('7.50'), 'a2': Decimal('10.00')})
+
+        self.clearance.discount = 0.05
+        self.clearance.save()
+        self.assertEqual(self.prices(), {'a0': Decimal('9.00'), 'a1': Decimal('9.50'), 'a2': Decimal('10.00')})
+
+        a0.promotions.remove(self.sale)
+        self.assertEqual(self.prices()['a0'], Decimal('9.50'))
+        self.clearance.product_set.clear()
+        self.assertEqual(self.prices(), {'a0': Decimal('10.00'), 'a1': Decimal('10.00'), 'a2': Decimal('10.00')})
+
+        a2.promotions.set([self.sale])
+        self.sale.delete()
+        self.assertEqual(self.prices()['a2'], Decimal('10.00'))
+        self.assertPricesMatchDatabase()
+
+    @override_settings(PRICING_STACK_PROMOTIONS=True)
+    def test_stacked_promotions(self):
+        product = models.Product.objects.order_by('title').first()
+        product.promotions.add(self.sale, self.clearance)
+        self.assertEqual(self.prices()['a0'], Decimal('6.75'))
+        self.assertPricesMatchDatabase()
+
+    def test_unit_price_changes_reprice_the_product(self):
+        product = models.Product.objects.order_by('title').first()
+        product.promotions.add(self.sale)
+
+        product = models.Product.objects.get(pk=product.pk)
+        product.unit_price = Decimal('20.00')
+        product.save()
+        self.assertEqual(self.prices()['a0'], Decimal('18.00'))
+
+        product.unit_price = Decimal('30.00')
+        product.save(update_fields=['unit_price'])
+        self.assertEqual(self.prices()['a0'], Decimal('27.00'))
+
+        models.Product.objects.filter(pk=product.pk).update(unit_price=Decimal('40.00'))
+        product.refresh_from_db()
+        product.unit_price = Decimal('30.00')
+        product.save()
+        self.assertEqual(self.prices()['a0'], Decimal('27.00'))
+
+    def test_save_only_queries_for_changed_fields(self):
+        product = models.Product.objects.order_by('title').first()
+        product.promotions.add(self.sale)
+        product = models.Product.objects.get(pk=product.pk)
+
+        product.title = 'Renamed'
+        with self.assertNumQueries(1):
+            product.save()
+        product.unit_price = Decimal('20.00')
+        # The promotions, to reprice it
+        with self.assertNumQueries(2):
+            product.save()
+        self.assertEqual(product.effective_price, Decimal('18.00'))
+        with self.assertNumQueries(1):
+            product.save()
+
+    def test_featured_product_stays_fresh(self):
+        product = models.Product.objects.order_by('title').first()
+        collection = models.Collection.objects.filter(featured_product=product).get()
+        self.assertEqual(catalog.get_collection(collection.pk).featured_product.title, 'a0')
+
+        product.title = 'Renamed'
+        product.save()
+        self.assertEqual(catalog.get_collection(collection.pk).featured_product.title, 'Renamed')
+        product.orderitem_set.all().delete()
+        product.delete()
+        collection = catalog.get_collection(collection.pk)
+        self.assertIsNone(collection.featured_product)
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first, cls.second, cls.third = [
+            models.Collection.objects.create(title=title) for title in ('First', 'Second', 'Third')]
+        AdminQueryCountTests.create_rows(cls.first, 'a', 2)
+
+    def setUp(self):
+        cache.clear()
+
+    def product_counts(self) -> list:
+        return [models.Collection.objects.get(pk=collection.pk).product_count
+                for collection in (self.first, self.second, self.third)]
+
+    def assertCountsMatchRows(self):
+        self.assertEqual(counters.repair_collection_product_count(), 0)
+        self.assertEqual(counters.repair_customer_orders_count(), 0)
+
+    def test_counts_follow_saves(self):
+        product = models.Product.objects.get(title='a0')
+        self.assertEqual(self.product_counts(), [2, 0, 0])
+        product.collection = self.second
+        product.save()
+        self.assertEqual(self.product_counts(), [1, 1, 0])
+        product.collection = self.third
+        product.save(update_fields=['collection'])
+        self.assertEqual(self.product_counts(), [1, 0, 1])
+
+        order = models.Order.objects.select_related('customer').first()
+        other = models.Customer.objects.exclude(pk=order.customer_id).get()
+        order.customer = other
+        order.save()
+        self.assertEqual(models.Customer.objects.get(pk=other.pk).orders_count, 2)
+        order.orderitem_set.all().delete()
+        order.delete()
+        self.assertEqual(models.Customer.objects.get(pk=other.pk).orders_count, 1)
+        self.assertCountsMatchRows()
+
+    def test_saves_without_moves_dont_touch_the_counters(self):
+        order = models.Order.objects.first()
+        order.payment_status = models.Order.PAYMENT_STATUS_COMPLETE
+        with CaptureQueriesContext(connection) as context:
+            order.save()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('customer_id', context.captured_queries[0]['sql'])
+
+    def test_stale_instances_dont_undo_moves(self):
+        product = models.Product.objects.get(title='a0')
+        stale = models.Product.objects.get(title='a0')
+        product.collection = self.second
+        product.save()
+
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(models.Product.objects.get(pk=product.pk).collection_id, self.second.pk)
+        self.assertEqual(self.product_counts(), [1, 1, 0])
+
+        # Moved from where the row is, not where the stale instance thinks it is
+        stale.collection = self.third
+        stale.save()
+        self.assertEqual(self.product_counts(), [1, 0, 1])
+        self.assertCountsMatchRows()
+
+    def test_copies_are_inserted(self):
+        product = models.Product.objects.get(title='a0')
+        product.pk = None
+        product.slug = 'a0-copy'
+        product.save()
+        self.assertEqual(models.Product.objects.filter(title='a0').count(), 2)
+        self.assertEqual(self.product_counts(), [3, 0, 0])
+
+        order = models.Order.objects.first()
+        order.pk = None
+        order.save()
+        self.assertEqual(models.Customer.objects.get(pk=order.customer_id).orders_count, 2)
+        self.assertCountsMatchRows()
+
+    def test_deleted_rows_are_inserted_again(self):
+        order = models.Order.objects.first()
+        order.orderitem_set.all().delete()
+        models.Order.objects.filter(pk=order.pk).delete()
+
+        order.payment_status = models.Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        self.assertEqual(models.Order.objects.get(pk=order.pk).payment_status,
+                         models.Order.PAYMENT_STATUS_COMPLETE)
+        self.assertCountsMatchRows()
+
+
+@override_settings(INVOICE_RENDER_WORKERS=1, INVOICE_EXPORT_JOB_TIMEOUT=60)
+class ExportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Collection'), 'a', 2)
+
+    def setUp(self):
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        settings = override_settings(INVOICE_EXPORT_DIR=export_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.export_dir = export_dir
+
+    def enqueue(self, **fields) -> models.InvoiceExportJob:
+        job = invoices.enqueue_export_job(models.Order.objects.all())
+        models.InvoiceExportJob.objects.filter(pk=job.pk).update(**fields)
+        return job
+
+    def test_claim_pending_job(self):
+        job = self.enqueue()
+        claimed = invoices.claim_export_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, models.InvoiceExportJob.STATUS_RUNNING)
+        self.assertIsNone(invoices.claim_export_job())
+
+    def test_abandoned_jobs_are_claimed_again(self):
+        Job = models.InvoiceExportJob
+        now = timezone.now()
+        self.enqueue(status=Job.STATUS_RUNNING, started_at=now - datetime.timedelta(seconds=30))
+        abandoned = self.enqueue(status=Job.STATUS_RUNNING, processed=1,
+                                 started_at=now - datetime.timedelta(seconds=90))
+        self.enqueue(status=Job.STATUS_COMPLETE, started_at=now - datetime.timedelta(seconds=90))
+
+        claimed = invoices.claim_export_job()
+        self.assertEqual(claimed.pk, abandoned.pk)
+        self.assertGreaterEqual(claimed.started_at, now)
+        self.assertEqual(claimed.processed, 0)
+        self.assertIsNone(invoices.claim_export_job())
+
+    def test_run_job(self):
+        job = self.enqueue()
+        invoices.run_export_job(invoices.claim_export_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.InvoiceExportJob.STATUS_COMPLETE)
+        self.assertEqual(job.processed, 2)
+        self.assertEqual(os.listdir(self.export_dir), [job.archive])
+        with zipfile.ZipFile(os.path.join(self.export_dir, job.archive)) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+
+    def test_superseded_worker_leaves_the_job_alone(self):
+        job = self.enqueue()
+        superseded = invoices.claim_export_job()
+        # Claimed again by another worker in the meantime
+        models.InvoiceExportJob.objects.filter(pk=job.pk).update(
+            started_at=superseded.started_at + datetime.timedelta(seconds=1))
+
+        invoices.run_export_job(superseded)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.InvoiceExportJob.STATUS_RUNNING)
+        self.assertIsNone(job.finished_at)
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Old'), 'a', 2)
+
+    def setUp(self):
+        cache.clear()
+
+    def product_counts(self) -> dict:
+        return dict(models.Collection.objects
+                          .filter(title__in=['Old', 'New'])
+                          .values_list('title', 'product_count'))
+
+    def catalog_version(self):
+        return cache.get(catalog.VERSION_PREFIX + catalog.CATALOG)
+
+    def test_batches_repair_counts_and_invalidate_the_catalog(self):
+        rows = io.StringIO(
+            'slug,title,unit_price,inventory,collection\n'
+            'a0,,,,New\n'
+            'b0,b0,5.00,1,New\n'
+            'b1,b1,5.00,1,Old\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            result = imports.import_products(rows, 'csv', batch_size=2)
+        self.assertEqual((result.created, result.updated), (2, 1))
+        self.assertEqual(self.product_counts(), {'Old': 2, 'New': 2})
+        self.assertEqual(self.catalog_version(), 2)
+        self.assertEqual(counters.repair_collection_product_count(), 0)
+
+    def test_failed_import_leaves_committed_batches_consistent(self):
+        def rows():
+            yield 2, {'slug': 'a0', 'collection': 'New'}
+            raise ValueError('Broken feed')
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValueError):
+            imports.ProductImporter(batch_size=1).run(rows())
+        self.assertEqual(self.product_counts(), {'Old': 1, 'New': 1})
+        self.assertEqual(self.catalog_version(), 1)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.order = AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Collection'), 'a', 3)
+        models.OrderItem.objects.create(order=cls.order, product=models.Product.objects.get(title='a0'),
+                                        quantity=2, unit_price=Decimal('5.00'))
+        cls.empty = models.Order.objects.create(customer=cls.order.customer)
+
+    def read_csv(self, lines) -> list:
+        return list(csv.reader(io.StringIO(''.join(lines))))
+
+    def read_jsonl(self, lines) -> list:
+        return [json.loads(line) for line in ''.join(lines).splitlines()]
+
+    def test_csv(self):
+        exporter = exports.OrderExporter(models.Order.objects.all(), chunk_size=2)
+        header, *rows = self.read_csv(exports.stream_csv(exporter))
+        self.assertEqual(header, exports.OrderExporter.fields)
+        # One row per item, the order without items has empty item columns
+        self.assertEqual([int(row[0]) for row in rows], sorted(
+            [*models.OrderItem.objects.values_list('order_id', flat=True), self.empty.id]))
+        self.assertEqual(rows[-1][len(exports.OrderExporter.order_fields):], [''] * 5)
+        self.assertEqual(self.read_csv(exports.stream_csv(exports.OrderExporter(models.Order.objects.all()))),
+                         [header, *rows])
+
+    def test_jsonl_groups_items_under_their_order(self):
+        exporter = exports.OrderExporter(models.Order.objects.all(), chunk_size=1)
+        records = {record['id']: record for record in self.read_jsonl(exports.stream_jsonl(exporter))}
+        self.assertEqual(len(records), models.Order.objects.count())
+
+        order = records[self.order.id]
+        self.assertEqual(order['item_count'], 2)
+        self.assertEqual(Decimal(order['grand_total']), Decimal('20.00'))
+        self.assertEqual([(item['product__title'], item['quantity']) for item in order['items']],
+                         [('a2', 1), ('a0', 2)])
+        self.assertEqual(records[self.empty.id]['items'], [])
+
+    def test_chunks_are_seeked(self):
+        exporter = exports.CustomerExporter(models.Customer.objects.all(), chunk_size=2)
+        with self.assertNumQueries(2):
+            rows = list(exporter.rows())
+        self.assertEqual([row[0] for row in rows],
+                         list(models.Customer.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_admin_actions(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/admin/store/customer/', {
+            'action': 'export_csv',
+            '_selected_action': list(models.Customer.objects.values_list('id', flat=True)[:2]),
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], r'^attachment; filename="customers-\d{8}\.csv"$')
+        self.assertEqual(len(self.read_csv([b''.join(response.streaming_content).decode()])), 3)
+
+        response = self.client.post('/admin/store/order/', {
+            'action': 'export_jsonl',
+            '_selected_action': [self.order.id],
+        })
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        [record] = self.read_jsonl([b''.join(response.streaming_content).decode()])
+        self.assertEqual(len(record['items']), 2)
+
+    def test_export_store_command(self):
+        output = io.StringIO()
+        call_command('export_store', 'products', '--format', 'jsonl', '--chunk-size', '2', stdout=output)
+        self.assertEqual([record['title'] for record in self.read_jsonl([output.getvalue()])],
+                         ['a0', 'a1', 'a2'])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'customers.csv')
+        call_command('export_store', 'customers', '--output', path)
+        with open(path, newline='', encoding='utf-8') as fileobj:
+            self.assertEqual(len(list(csv.reader(fileobj))), 4)
+
+
+class TemporaryInvoiceCache:
+    """Gives every test an empty invoice cache of its own."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(invoice_cache, 'directory', pathlib.Path(directory))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = directory
+
+
+class InvoiceCacheTests(TemporaryInvoiceCache, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Collection'), 'a', 2)
+
+    def payload(self) -> dict:
+        return next(invoices.get_invoice_payloads(models.Order.objects.filter(pk=self.order.pk)))
+
+    def cached_files(self) -> list:
+        return list(invoice_cache.directory.glob('*/*.pdf'))
+
+    def test_hit_doesnt_render(self):
+        with mock.patch.object(invoices, 'render_invoice', return_value=b'%PDF') as render:
+            self.assertEqual(invoices.open_invoice(self.payload()).read(), b'%PDF')
+            # The next day, the order unchanged
+            payload = {**self.payload(), 'invoice_date': '01/01/2099'}
+            with invoices.open_invoice(payload) as fileobj:
+                self.assertEqual(fileobj.read(), b'%PDF')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(self.cached_files()), 1)
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = InvoiceCache(self.directory, max_bytes=250)
+        payloads = [{'order_id': order_id, 'grand_total': order_id} for order_id in (1, 2, 3)]
+        for age, payload in zip((200, 100), payloads):
+            cache.set(payload, b'x' * 100)
+            os.utime(cache.path(payload), (time.time() - age, time.time() - age))
+        # Used since, the second one is now the least recently used
+        self.assertIsNotNone(cache.get(payloads[0]))
+
+        cache.set(payloads[2], b'x' * 100)
+        self.assertEqual([cache.get(payload) is not None for payload in payloads], [True, False, True])
+
+    def test_order_changes_invalidate(self):
+        payload = self.payload()
+        invoice_cache.set(payload, b'%PDF')
+        self.order.payment_status = models.Order.PAYMENT_STATUS_COMPLETE
+        self.order.save()
+        self.assertEqual(self.cached_files(), [])
+
+        invoice_cache.set(payload, b'%PDF')
+        item = self.order.orderitem_set.get()
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.cached_files(), [])
+
+        invoice_cache.set(payload, b'%PDF')
+        customer = self.order.customer
+        customer.first_name = 'Renamed'
+        customer.save()
+        self.assertEqual(self.cached_files(), [])
+        # A changed order never matches the file of its old state
+        self.assertNotEqual(invoice_cache.path(self.payload()), invoice_cache.path(payload))
+
+
+class RenderInvoicesTests(TestCase):
+    def payloads(self, count: int) -> list:
+        # Sizes grow with the number of lines, telling the PDFs apart
+        return [
+            {'order_id': order_id, 'customer_name': 'Customer', 'placed_at': '01-01-2022',
+             'invoice_date': '01/01/2022', 'grand_total': Decimal('1.00'),
+             'product_set': [{'title': 'Product', 'unit_price': Decimal('1.00'), 'quantity': 1,
+                              'net_price': Decimal('1.00')}] * order_id}
+            for order_id in range(count)
+        ]
+
+    def sizes(self, pdfs) -> list:
+        return [len(pdf) for pdf in pdfs]
+
+    def test_pool_keeps_the_input_order(self):
+        payloads = self.payloads(7)
+        expected = self.sizes(invoices.render_invoice(**payload) for payload in payloads)
+        self.assertEqual(len(set(expected)), 7)
+
+        with mock.patch.object(invoices, 'ProcessPoolExecutor', wraps=invoices.ProcessPoolExecutor) as pool:
+            pdfs = list(invoices.render_invoices(iter(payloads), max_workers=2, batch_size=2))
+        pool.assert_called_once()
+        self.assertEqual(self.sizes(pdfs), expected)
+
+    def test_serial_rendering(self):
+        payloads = self.payloads(5)
+        expected = self.sizes(invoices.render_invoice(**payload) for payload in payloads)
+        with mock.patch.object(invoices, 'ProcessPoolExecutor', side_effect=AssertionError):
+            # One worker, or too few invoices for a second batch
+            self.assertEqual(self.sizes(invoices.render_invoices(payloads, max_workers=1, batch_size=2)), expected)
+            self.assertEqual(self.sizes(invoices.render_invoices(payloads, max_workers=4, batch_size=10)), expected)
+            self.assertEqual(list(invoices.render_invoices([], max_workers=4)), [])
+
+
+@override_settings(INVOICE_RENDER_WORKERS=1, INVOICE_EXPORT_SYNC_LIMIT=10)
+class DownloadInvoicesTests(TemporaryInvoiceCache, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Collection'), 'a', 6)
+        cls.order_ids = list(models.Order.objects.order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def download(self, order_ids):
+        return self.client.post('/admin/store/order/', {
+            'action': 'download_invoices',
+            '_selected_action': order_ids,
+        })
+
+    def test_single_invoice(self):
+        response = self.download(self.order_ids[:1])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn(f'filename="invoice-{self.order_ids[0]}.pdf"', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_archive(self):
+        response = self.download(self.order_ids[:3])
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(sorted(archive.namelist()),
+                             sorted(f'invoice-{order_id}.pdf' for order_id in self.order_ids[:3]))
+            self.assertTrue(archive.read(f'invoice-{self.order_ids[0]}.pdf').startswith(b'%PDF'))
+
+    def test_constant_queries(self):
+        # Warm up the admin's per-process caches
+        self.download(self.order_ids[:2])
+        with CaptureQueriesContext(connection) as context:
+            self.download(self.order_ids[:2])
+        with self.assertNumQueries(len(context.captured_queries)):
+            self.download(self.order_ids)
+
+    @override_settings(INVOICE_EXPORT_SYNC_LIMIT=2)
+    def test_large_selections_are_exported_in_the_background(self):
+        response = self.download(self.order_ids[:3])
+        job = models.InvoiceExportJob.objects.get()
+        self.assertRedirects(response, f'/admin/store/invoiceexportjob/{job.id}/change/')
+        self.assertEqual(job.order_ids, self.order_ids[:3])
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.order = AdminQueryCountTests.create_rows(models.Collection.objects.create(title='Collection'), 'a', 2)
+        models.OrderItem.objects.create(order=cls.order, product=models.Product.objects.get(title='a0'),
+                                        quantity=3, unit_price=Decimal('2.50'))
+        cls.empty = models.Order.objects.create(customer=cls.order.customer)
+
+    def test_with_totals(self):
+        totals = {
+            order.id: (order.item_count, order.grand_total)
+            for order in models.Order.objects.with_totals()
+        }
+        first = models.Order.objects.order_by('id').first()
+        self.assertEqual(totals, {
+            first.id: (1, Decimal('10.00')),
+            self.order.id: (2, Decimal('17.50')),
+            self.empty.id: (0, Decimal('0.00')),
+        })
+
+    def test_changelist_sorts_by_total(self):
+        self.client.force_login(self.user)
+        # The total column, descending
+        response = self.client.get('/admin/store/order/', {'o': '-5'})
+        self.assertEqual([order.id for order in response.context['cl'].result_list],
+                         [self.order.id, models.Order.objects.order_by('id').first().id, self.empty.id])
+        self.assertContains(response, '17.50 INR')
@@ -2,6 +2,12 @@ from django.urls import path
 from . import views
 
 # URLConf
-# urlpatterns = [
-#     path('store/order/download_pdf', views.download_pdf)
-# ]
+urlpatterns = [
+    path('products/', views.product_list, name='product-list'),
+    path('products/<slug:slug>/', views.product_detail, name='product-detail'),
+    path('collections/', views.collection_list, name='collection-list'),
+    path('collections/<int:pk>/products/', views.collection_products, name='collection-products'),
+    path('cart/', views.cart_detail, name='cart-detail'),
+    path('cart/items/', views.cart_add, name='cart-add'),
+    path('cart/items/<int:product_id>/', views.cart_item, name='cart-item'),
+]
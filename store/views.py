@@ -1,12 +1,252 @@
 import io
 import os
+import json
+import hashlib
+from calendar import timegm
 # from django.shortcuts import render
-from django.http import FileResponse
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_response_headers
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
 from reportlab.pdfgen import canvas
 from collections import namedtuple
+from . import carts, catalog
+from .models import Product
 
 # Product = namedtuple()
 
+PRODUCT_FIELDS = ['id', 'title', 'slug', 'description', 'unit_price', 'effective_price',
+                  'inventory', 'last_update', 'collection_id']
+DEFAULT_PRODUCT_FIELDS = ['id', 'title', 'slug', 'unit_price', 'effective_price',
+                          'inventory', 'collection_id']
+
+COLLECTION_FIELDS = ['id', 'title', 'product_count', 'featured_product_id']
+
+CART_SESSION_KEY = 'cart_id'
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Serialized bodies are cached under their ETag, which changes with the data
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+
+def get_fields(request, allowed: list, default: list) -> list:
+    """Parse ``?fields=a,b`` into the allowed field names, in allowed order."""
+    requested = request.GET.get('fields')
+    if not requested:
+        return default
+    requested = set(requested.split(','))
+    fields = [field for field in allowed if field in requested]
+    return fields or default
+
+
+def with_field(fields: list, name: str) -> list:
+    return fields if name in fields else fields + [name]
+
+
+def get_page_size(request) -> int:
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def get_cursor(request) -> int:
+    """The cursor is the id of the last product on the previous page."""
+    try:
+        return int(request.GET.get('cursor', 0))
+    except ValueError:
+        return 0
+
+
+def cached_json_response(request, etag: str, last_modified, build):
+    """
+    Answer with 304 when the client already has this version, otherwise
+    serve the body cached under its ETag, calling ``build`` on a miss.
+    """
+    etag = quote_etag(etag)
+    last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = f'store:api:{request.path}:{etag}'
+        body = cache.get(key)
+        if body is None:
+            body = JsonResponse(build()).content
+            cache.set(key, body, RESPONSE_CACHE_TIMEOUT)
+        response = HttpResponse(body, content_type='application/json')
+
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_response_headers(response, cache_timeout=0)
+    return response
+
+
+def product_page(request, queryset):
+    """
+    Serve one page of ``queryset`` ordered by id, starting after ``?cursor=``.
+    """
+    fields = get_fields(request, PRODUCT_FIELDS, DEFAULT_PRODUCT_FIELDS)
+    limit = get_page_size(request)
+    cursor = get_cursor(request)
+
+    # The catalog version changes with every product write, bulk ones
+    # included, so a conditional request is answered without a query
+    etag = hashlib.md5(
+        f"{catalog.products_version()}:{request.GET.urlencode()}".encode()
+    ).hexdigest()
+
+    def build():
+        rows = list(
+            queryset.filter(id__gt=cursor)
+                    .order_by('id')
+                    .values(*with_field(fields, 'id'))[:limit + 1]
+        )
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            query = request.GET.copy()
+            query['cursor'] = rows[-1]['id']
+            next_url = f"{request.path}?{query.urlencode()}"
+        if 'id' not in fields:
+            for row in rows:
+                del row['id']
+        return {'count': queryset.count(), 'next': next_url, 'results': rows}
+
+    return cached_json_response(request, etag, None, build)
+
+
+@require_GET
+def product_list(request):
+    queryset = Product.objects.all()
+    collection_id = request.GET.get('collection')
+    if collection_id and collection_id.isdigit():
+        queryset = queryset.filter(collection_id=collection_id)
+    return product_page(request, queryset)
+
+
+@require_GET
+def product_detail(request, slug: str):
+    fields = get_fields(request, PRODUCT_FIELDS, PRODUCT_FIELDS)
+    product = catalog.get_product_by_slug(slug)
+    if product is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    etag = hashlib.md5(
+        f"{product.id}:{product.last_update}:{','.join(fields)}".encode()
+    ).hexdigest()
+    return cached_json_response(
+        request, etag, product.last_update,
+        lambda: {field: getattr(product, field) for field in fields}
+    )
+
+
+@require_GET
+def collection_list(request):
+    fields = get_fields(request, COLLECTION_FIELDS, COLLECTION_FIELDS)
+    collections = [
+        {field: getattr(collection, field) for field in fields}
+        for collection in sorted(catalog.get_collections(), key=lambda collection: collection.id)
+    ]
+
+    # Collections have no timestamp, their rows make up the ETag instead
+    etag = hashlib.md5(repr(collections).encode()).hexdigest()
+    return cached_json_response(request, etag, None, lambda: {'results': collections})
+
+
+@require_GET
+def collection_products(request, pk: int):
+    if catalog.get_collection(pk) is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return product_page(request, Product.objects.filter(collection_id=pk))
+
+
+def get_session_cart(request, create=False):
+    """Return the id of the visitor's cart, creating one if asked."""
+    cart_id = request.session.get(CART_SESSION_KEY)
+    if cart_id is not None and not carts.exists(cart_id):
+        # Purged since, the visitor starts over
+        del request.session[CART_SESSION_KEY]
+        cart_id = None
+    if cart_id is None and create:
+        cart_id = carts.create_cart()
+        request.session[CART_SESSION_KEY] = cart_id
+    return cart_id
+
+
+def cart_response(cart_id) -> JsonResponse:
+    items = carts.get_items(cart_id) if cart_id is not None else {}
+    return JsonResponse({
+        'id': cart_id,
+        'items': [
+            {'product_id': product_id, 'quantity': quantity}
+            for product_id, quantity in sorted(items.items())
+        ]
+    })
+
+
+def cart_busy_response() -> JsonResponse:
+    return JsonResponse({'detail': 'The cart is being changed, try again.'}, status=409)
+
+
+def get_cart_change(request, product_id=None):
+    """
+    Parse ``{"product_id": ..., "quantity": ...}`` from a JSON body, or
+    return an error response.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+        if product_id is None:
+            product_id = int(data['product_id'])
+        quantity = int(data.get('quantity', 1))
+    except (ValueError, TypeError, KeyError):
+        return None, None, JsonResponse({'detail': 'Expected product_id and quantity.'}, status=400)
+
+    if catalog.get_product(product_id) is None:
+        return None, None, JsonResponse({'detail': 'Product not found.'}, status=404)
+    return product_id, quantity, None
+
+
+@require_GET
+def cart_detail(request):
+    return cart_response(get_session_cart(request))
+
+
+@require_POST
+def cart_add(request):
+    product_id, quantity, error = get_cart_change(request)
+    if error:
+        return error
+    if quantity < 1:
+        return JsonResponse({'detail': 'quantity must be positive.'}, status=400)
+
+    cart_id = get_session_cart(request, create=True)
+    try:
+        carts.add_item(cart_id, product_id, quantity)
+    except carts.CartLocked:
+        return cart_busy_response()
+    return cart_response(cart_id)
+
+
+@require_http_methods(['PUT', 'DELETE'])
+def cart_item(request, product_id: int):
+    cart_id = get_session_cart(request, create=True)
+    quantity = 0
+    if request.method == 'PUT':
+        product_id, quantity, error = get_cart_change(request, product_id)
+        if error:
+            return error
+    try:
+        carts.set_quantity(cart_id, product_id, quantity)
+    except carts.CartLocked:
+        return cart_busy_response()
+    return cart_response(cart_id)
+
+
 # Create your views here.
 def download_pdf(request, customer_name: str, placed_at: str, invoice_date: str, product_set):
     # Create a file-like buffer to receive PDF data.
@@ -0,0 +1,254 @@
+"""
+Lightweight request metrics, cheap enough to leave on in production.
+
+PerfMiddleware times a random PERF_SAMPLE_RATE share of the requests:
+wall time, SQL queries and their time, template rendering time and
+response size. The samples are kept per view in a ring buffer of the
+process, summarized by ``report`` for staff and by ``prometheus_metrics``
+in the Prometheus text format. Every process has its own buffers, so
+scrape each worker, or read the figures as a sample of the whole.
+"""
+import math
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from django.template.base import Template
+from django.views.decorators.http import require_GET
+
+
+# Fields of a sample, in the order they are stored
+FIELDS = ['wall_ms', 'sql_count', 'sql_ms', 'render_ms', 'bytes']
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+# Prometheus name, help and scale of every field, in base units
+PROMETHEUS = {
+    'wall_ms': ('storefront_request_duration_seconds', 'Time spent handling the request.', 0.001),
+    'sql_count': ('storefront_request_queries', 'SQL queries run by the request.', 1),
+    'sql_ms': ('storefront_request_sql_seconds', 'Time spent in SQL queries.', 0.001),
+    'render_ms': ('storefront_request_render_seconds', 'Time spent rendering templates.', 0.001),
+    'bytes': ('storefront_response_bytes', 'Size of the response body.', 1),
+}
+
+_current = ContextVar('perf_sample', default=None)
+
+
+class Sample:
+    __slots__ = ['sql_count', 'sql_time', 'render_time', 'rendering']
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper, see connection.execute_wrapper()."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+
+
+class Metrics:
+    """Request counts and the last PERF_BUFFER_SIZE samples of every view."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = defaultdict(int)
+            self.samples = {}
+            # Running totals for the Prometheus _count and _sum series
+            self.sampled = defaultdict(int)
+            self.sums = defaultdict(lambda: [0.0] * len(FIELDS))
+
+    def count(self, view: str):
+        with self.lock:
+            self.requests[view] += 1
+
+    def record(self, view: str, values: tuple):
+        with self.lock:
+            buffer = self.samples.get(view)
+            if buffer is None:
+                buffer = self.samples[view] = deque(maxlen=settings.PERF_BUFFER_SIZE)
+            buffer.append(values)
+            self.sampled[view] += 1
+            sums = self.sums[view]
+            for index, value in enumerate(values):
+                sums[index] += value
+
+    def snapshot(self) -> dict:
+        """
+        Return, per view, the request count and the count, sum and
+        quantiles of every field over the buffered samples.
+        """
+        with self.lock:
+            requests = dict(self.requests)
+            samples = {view: list(buffer) for view, buffer in self.samples.items()}
+            sampled = dict(self.sampled)
+            sums = {view: list(values) for view, values in self.sums.items()}
+
+        views = {}
+        for view, count in requests.items():
+            columns = list(zip(*samples.get(view, [])))
+            views[view] = {
+                'requests': count,
+                'sampled': sampled.get(view, 0),
+                **{
+                    field: {
+                        'sum': sums[view][index] if view in sums else 0,
+                        **percentiles(columns[index] if columns else []),
+                    }
+                    for index, field in enumerate(FIELDS)
+                },
+            }
+        return views
+
+
+def percentiles(values) -> dict:
+    """Nearest-rank quantiles and maximum of ``values``."""
+    values = sorted(values)
+    if not values:
+        return {}
+    result = {f'p{round(q * 100)}': values[max(math.ceil(q * len(values)) - 1, 0)] for q in QUANTILES}
+    result['max'] = values[-1]
+    return result
+
+
+metrics = Metrics()
+
+
+def _timed_render(self, context):
+    """
+    Template._render timing the outermost template of a sampled request.
+    Includes and parents are rendered inside it and aren't counted twice.
+    """
+    sample = _current.get()
+    if sample is None or sample.rendering:
+        return _timed_render.original(self, context)
+    sample.rendering = True
+    start = time.perf_counter()
+    try:
+        return _timed_render.original(self, context)
+    finally:
+        sample.render_time += time.perf_counter() - start
+        sample.rendering = False
+
+
+def instrument_templates():
+    # The way django.test.utils instruments templates for assertTemplateUsed
+    if Template._render is not _timed_render:
+        _timed_render.original = Template._render
+        Template._render = _timed_render
+
+
+class PerfMiddleware:
+    """
+    Records metrics of a sample of the requests. Put it first in
+    MIDDLEWARE, so the wall time covers every other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            response = self.get_response(request)
+            metrics.count(view_name(request))
+            return response
+
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                response = self.get_response(request)
+        finally:
+            wall_time = time.perf_counter() - start
+            _current.reset(token)
+
+        view = view_name(request)
+        metrics.count(view)
+        metrics.record(view, (
+            wall_time * 1000,
+            sample.sql_count,
+            sample.sql_time * 1000,
+            sample.render_time * 1000,
+            response_size(response),
+        ))
+        return response
+
+
+def view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+def response_size(response) -> int:
+    """The size of the body, without consuming streamed ones."""
+    if response.streaming:
+        return int(response.get('Content-Length', 0))
+    return len(response.content)
+
+
+@require_GET
+@staff_member_required
+def report(request):
+    return JsonResponse({
+        'sample_rate': settings.PERF_SAMPLE_RATE,
+        'buffer_size': settings.PERF_BUFFER_SIZE,
+        'views': metrics.snapshot(),
+    })
+
+
+@require_GET
+def prometheus_metrics(request):
+    """The metrics in the Prometheus text format, for PERF_METRICS_IPS only."""
+    if request.META.get('REMOTE_ADDR') not in settings.PERF_METRICS_IPS:
+        raise PermissionDenied
+
+    lines = [
+        '# HELP storefront_requests_total Requests handled, sampled or not.',
+        '# TYPE storefront_requests_total counter',
+    ]
+    views = metrics.snapshot()
+    for view, stats in sorted(views.items()):
+        lines.append(f'storefront_requests_total{{view="{escape(view)}"}} {stats["requests"]}')
+
+    for field in FIELDS:
+        name, description, scale = PROMETHEUS[field]
+        lines += [
+            f'# HELP {name} {description} Quantiles over the last samples.',
+            f'# TYPE {name} summary',
+        ]
+        for view, stats in sorted(views.items()):
+            if not stats['sampled']:
+                continue
+            label = f'view="{escape(view)}"'
+            for q in QUANTILES:
+                lines.append(f'{name}{{{label},quantile="{q}"}} {stats[field][f"p{round(q * 100)}"] * scale:g}')
+            lines.append(f'{name}_sum{{{label}}} {stats[field]["sum"] * scale:g}')
+            lines.append(f'{name}_count{{{label}}} {stats["sampled"]}')
+
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
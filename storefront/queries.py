@@ -0,0 +1,245 @@
+"""
+SQL fingerprinting, to find N+1 patterns and slow queries.
+
+Every statement is reduced to a fingerprint with its literals and
+placeholders replaced by ``?`` and IN/VALUES lists collapsed, so that the
+queries of a loop over rows all share one fingerprint.
+
+QueryInspectionMiddleware inspects a QUERY_INSPECTION_SAMPLE_RATE share of
+the requests. It logs the fingerprints repeated more than
+QUERY_REPEAT_THRESHOLD times, and the queries slower than QUERY_SLOW_MS
+with their EXPLAIN output. It also keeps per-view statistics, served to
+staff by ``report``. ``assert_no_repeated_queries`` applies the same
+check in tests.
+"""
+import re
+import time
+import random
+import logging
+import threading
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from .perf import view_name
+
+
+logger = logging.getLogger(__name__)
+
+STRING_RE = re.compile(r"'(?:''|[^'])*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%s')
+IN_LIST_RE = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+VALUES_RE = re.compile(r'\((?:\?, )*\?\)(?:, \((?:\?, )*\?\))+')
+SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql: str) -> str:
+    """
+    ``SELECT ... WHERE "id" IN (%s, %s) LIMIT 21`` gives
+    ``SELECT ... WHERE "id" IN (...) LIMIT ?``.
+    """
+    sql = SPACE_RE.sub(' ', sql).strip()
+    sql = STRING_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return VALUES_RE.sub('(...)', sql)
+
+
+class QueryRecorder:
+    """Database execute wrapper keeping every query with its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((
+                context['connection'].alias, sql, params, many, time.perf_counter() - start
+            ))
+
+    def repeated(self, threshold: int) -> dict:
+        """The fingerprints run more than ``threshold`` times, with their count."""
+        counts = defaultdict(int)
+        for _, sql, _, _, _ in self.queries:
+            counts[fingerprint(sql)] += 1
+        return {sql: count for sql, count in counts.items() if count > threshold}
+
+
+@contextmanager
+def record_queries():
+    """Record the queries run on every database inside the block."""
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+@contextmanager
+def assert_no_repeated_queries(threshold: int = None):
+    """
+    Fail when a fingerprint runs more than ``threshold`` times inside the
+    block, QUERY_REPEAT_THRESHOLD by default. Unlike assertNumQueries it
+    only fails on loops of queries, not on an extra query.
+    """
+    if threshold is None:
+        threshold = settings.QUERY_REPEAT_THRESHOLD
+    with record_queries() as recorder:
+        yield recorder
+    repeated = recorder.repeated(threshold)
+    if repeated:
+        raise AssertionError(
+            f"{len(repeated)} queries ran more than {threshold} times:\n"
+            + '\n'.join(f'{count} x {sql}' for sql, count in repeated.items())
+        )
+
+
+def explain(alias: str, sql: str, params) -> str:
+    """The plan of a SELECT, or None for other statements."""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+    except Exception as error:
+        return f'EXPLAIN failed: {error}'
+
+
+class QueryStats:
+    """
+    Per view: inspected requests, queries, N+1 requests and, for up to
+    QUERY_STATS_MAX_FINGERPRINTS fingerprints, their count and time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            # Last time the plan of a fingerprint was logged
+            self.explained = {}
+
+    def record(self, view: str, queries: list, repeated: dict):
+        per_request = defaultdict(lambda: [0, 0.0])
+        for _, sql, _, _, duration in queries:
+            entry = per_request[fingerprint(sql)]
+            entry[0] += 1
+            entry[1] += duration
+
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'requests': 0, 'queries': 0, 'repeated_requests': 0, 'fingerprints': {}
+                }
+            stats['requests'] += 1
+            stats['queries'] += len(queries)
+            stats['repeated_requests'] += bool(repeated)
+            fingerprints = stats['fingerprints']
+            for sql, (count, duration) in per_request.items():
+                entry = fingerprints.get(sql)
+                if entry is None:
+                    if len(fingerprints) >= settings.QUERY_STATS_MAX_FINGERPRINTS:
+                        continue
+                    entry = fingerprints[sql] = {
+                        'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'max_per_request': 0
+                    }
+                entry['count'] += count
+                entry['total_ms'] += duration * 1000
+                entry['max_ms'] = max(entry['max_ms'], duration * 1000)
+                entry['max_per_request'] = max(entry['max_per_request'], count)
+
+    def should_explain(self, sql: str) -> bool:
+        """
+        Log the plan of a slow fingerprint once per QUERY_EXPLAIN_INTERVAL.
+        Only the last QUERY_EXPLAIN_MAX_FINGERPRINTS are remembered.
+        """
+        now = time.monotonic()
+        key = fingerprint(sql)
+        with self.lock:
+            last = self.explained.get(key)
+            if last is not None and now - last < settings.QUERY_EXPLAIN_INTERVAL:
+                return False
+            # Oldest first, the first entries are the ones to forget
+            self.explained.pop(key, None)
+            self.explained[key] = now
+            while len(self.explained) > settings.QUERY_EXPLAIN_MAX_FINGERPRINTS:
+                del self.explained[next(iter(self.explained))]
+            return True
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                view: {
+                    **stats,
+                    'fingerprints': dict(sorted(
+                        ((sql, dict(entry)) for sql, entry in stats['fingerprints'].items()),
+                        key=lambda item: -item[1]['total_ms']
+                    )),
+                }
+                for view, stats in self.views.items()
+            }
+
+
+query_stats = QueryStats()
+
+
+def request_label(request) -> str:
+    """The view name, with the admin action run by the request if any."""
+    label = view_name(request)
+    action = None
+    # Admin actions are posted as forms, other bodies may not be parsable
+    if request.method == 'POST' and request.content_type == 'application/x-www-form-urlencoded':
+        action = request.POST.get('action')
+    return f'{label}:{action}' if action else label
+
+
+class QueryInspectionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.QUERY_INSPECTION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        label = request_label(request)
+        repeated = recorder.repeated(settings.QUERY_REPEAT_THRESHOLD)
+        query_stats.record(label, recorder.queries, repeated)
+        for sql, count in repeated.items():
+            logger.warning("Query repeated %d times by %s (N+1?): %s", count, label, sql)
+
+        slow = settings.QUERY_SLOW_MS / 1000
+        for alias, sql, params, many, duration in recorder.queries:
+            if duration >= slow and not many and query_stats.should_explain(sql):
+                logger.warning(
+                    "Slow query (%.1fms) in %s: %s\n%s",
+                    duration * 1000, label, sql, explain(alias, sql, params) or ''
+                )
+        return response
+
+
+@require_GET
+@staff_member_required
+def report(request):
+    return JsonResponse({
+        'sample_rate': settings.QUERY_INSPECTION_SAMPLE_RATE,
+        'repeat_threshold': settings.QUERY_REPEAT_THRESHOLD,
+        'views': query_stats.snapshot(),
+    })
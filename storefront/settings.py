@@ -40,14 +40,16 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'playground',
-    'debug_toolbar',
     'store',
     'tags',
-    'likes'
+    'likes',
+    'analytics',
+    'benchmarks'
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'storefront.perf.PerfMiddleware',
+    'storefront.queries.QueryInspectionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +59,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The toolbar exposes settings and queries, and is slow: development only
+if DEBUG:
+    INSTALLED_APPS += ['debug_toolbar']
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 INTERNAL_IPS = [
     # ...
     '127.0.0.1',
@@ -98,6 +105,16 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -140,3 +157,196 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Invoices
+
+# Number of processes used to render invoice PDFs in bulk.
+# None uses every available CPU, 1 renders on the request thread.
+INVOICE_RENDER_WORKERS = None
+
+INVOICE_RENDER_BATCH_SIZE = 25
+
+# Rendered invoices are cached on disk until the order changes.
+INVOICE_CACHE_DIR = BASE_DIR / 'invoice_cache'
+
+INVOICE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Selections larger than this are exported by the process_invoice_jobs worker.
+INVOICE_EXPORT_SYNC_LIMIT = 50
+
+INVOICE_EXPORT_DIR = BASE_DIR / 'invoice_exports'
+
+INVOICE_EXPORT_PROGRESS_STEP = 25
+
+# Seconds after which a running export job is assumed abandoned by its
+# worker and claimed again. Longer than the slowest export.
+INVOICE_EXPORT_JOB_TIMEOUT = 60 * 60
+
+
+# Admin pagination
+
+# Seconds a changelist's COUNT(*) is reused between page loads.
+ADMIN_COUNT_CACHE_TIMEOUT = 60
+
+# Unfiltered changelists on tables at least this large show the
+# database's row estimate instead of counting every row.
+ADMIN_APPROXIMATE_COUNT_THRESHOLD = 100000
+
+
+# Catalog cache
+
+CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Seconds other readers wait for a cache miss to be recomputed
+CATALOG_CACHE_LOCK_TIMEOUT = 10
+
+
+# Exports
+
+# Rows fetched per query by the streaming CSV/JSONL exports
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Imports
+
+# Rows validated and written per transaction by the product import
+IMPORT_BATCH_SIZE = 1000
+
+
+# Carts
+
+# The cart id is kept in the session, read it from the cache on every request
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Active carts live in the default cache and are written to the database
+# in batches by flush_carts. That needs a cache shared by every process,
+# like Redis or Memcached, sized so that active carts aren't evicted: an
+# evicted cart loses its changes since the last flush.
+CART_CACHE_TIMEOUT = 30 * 24 * 60 * 60
+
+# Save every change right away instead. None does so when the default
+# cache is process-local (LocMemCache or DummyCache).
+CART_WRITE_THROUGH = None
+
+CART_LOCK_TIMEOUT = 5
+
+# Seconds without changes after which flush_carts saves a cart
+CART_IDLE_TIMEOUT = 5 * 60
+
+CART_MAX_QUANTITY = 100
+
+# Carts older than this are deleted by purge_carts
+CART_ABANDONED_DAYS = 30
+
+
+# Pricing
+
+# Apply every promotion of a product in turn instead of only the best one
+PRICING_STACK_PROMOTIONS = False
+
+
+# Search
+
+# Every process keeps its own copy of the search indexes, kept in step
+# through a change log in the default cache. The cache must be shared by
+# every process, like Redis or Memcached, or their copies go stale.
+SEARCH_INDEX_DIR = BASE_DIR / 'search_index'
+
+# Rows read per query when building an index
+SEARCH_INDEX_CHUNK_SIZE = 5000
+
+# Changes replayed by a process before it saves its index to disk again
+SEARCH_INDEX_SAVE_EVERY = 1000
+
+# Seconds the change log is kept, processes further behind rebuild
+SEARCH_LOG_TIMEOUT = 24 * 60 * 60
+
+# Best matches shown by an admin search, which says when there are more
+SEARCH_MAX_RESULTS = 1000
+
+
+# Likes
+
+# Rows each object's like count is split over
+LIKE_COUNTER_SHARDS = 8
+
+# Seconds likes are buffered in process before being written
+LIKE_COUNTER_FLUSH_INTERVAL = 5
+
+# Objects with buffered likes that trigger an immediate write
+LIKE_COUNTER_FLUSH_SIZE = 500
+
+
+# Tags
+
+# Seconds the sorted id arrays of tags and the tag clouds stay cached
+TAG_INDEX_TIMEOUT = 24 * 60 * 60
+
+TAG_INDEX_LOCK_TIMEOUT = 5
+
+# Ids a tag filter passes inline to the changelist query, larger matches
+# are filtered with a subquery on TaggedItem instead
+TAG_FILTER_MAX_IDS = 1000
+
+
+# Analytics
+
+# Orders aggregated per transaction by update_sales_rollups
+ANALYTICS_ROLLUP_BATCH_SIZE = 5000
+
+# Seconds an order must be old before it is aggregated or added to the
+# sales cube, longer than any transaction placing an order
+ANALYTICS_ROLLUP_LAG = 5 * 60
+
+ANALYTICS_DASHBOARD_DAYS = 30
+
+# Columnar copy of the order items used by the sales report
+ANALYTICS_CUBE_DIR = BASE_DIR / 'sales_cube'
+
+# Orders whose items are read per query when refreshing the cube
+ANALYTICS_CUBE_CHUNK_SIZE = 20000
+
+# Refreshes append a part each, merged into one once there are this many
+ANALYTICS_CUBE_MAX_PARTS = 20
+
+
+# Performance metrics
+
+# Share of requests timed by storefront.perf.PerfMiddleware. A sampled
+# request costs a few microseconds per query, keep the overhead under 1%.
+PERF_SAMPLE_RATE = 0.1
+
+# Samples kept per view by every process for the percentiles
+PERF_BUFFER_SIZE = 1000
+
+# Addresses allowed to scrape /perf/metrics/
+PERF_METRICS_IPS = ['127.0.0.1']
+
+
+# Query inspection
+
+# Share of requests whose queries are fingerprinted by
+# storefront.queries.QueryInspectionMiddleware
+QUERY_INSPECTION_SAMPLE_RATE = 0.05
+
+# Runs of one fingerprint in a request above which it is reported as N+1
+QUERY_REPEAT_THRESHOLD = 5
+
+# Queries slower than this are logged with their plan
+QUERY_SLOW_MS = 200
+
+# Seconds before the plan of the same slow query is logged again
+QUERY_EXPLAIN_INTERVAL = 10 * 60
+
+# Distinct fingerprints tracked per view
+QUERY_STATS_MAX_FINGERPRINTS = 200
+
+# Slow fingerprints whose last EXPLAIN time is remembered
+QUERY_EXPLAIN_MAX_FINGERPRINTS = 1000
+
+
+# Tests
+
+# Turns the sampling middleware off, see storefront.test_runner
+TEST_RUNNER = 'storefront.test_runner.TestRunner'
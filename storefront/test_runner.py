@@ -0,0 +1,19 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests without the performance and query sampling middleware,
+    so assertNumQueries and the logs don't depend on chance. Tests of the
+    middleware turn them on with override_settings.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.unsampled = override_settings(PERF_SAMPLE_RATE=0, QUERY_INSPECTION_SAMPLE_RATE=0)
+        self.unsampled.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.unsampled.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,137 @@
+import io
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import path
+from . import perf
+
+
+def rendered(request):
+    User.objects.count()
+    User.objects.exists()
+    return HttpResponse(Template('{% for i in items %}{{ i }}{% endfor %}').render(Context({'items': range(10)})))
+
+
+def downloaded(request):
+    return FileResponse(io.BytesIO(b'x' * 100))
+
+
+def streamed(request):
+    def chunks():
+        request.consumed = True
+        yield b'x' * 100
+    request.consumed = False
+    response = StreamingHttpResponse(chunks())
+    streamed.request = request
+    return response
+
+
+urlpatterns = [
+    path('rendered/', rendered, name='rendered'),
+    path('downloaded/', downloaded, name='downloaded'),
+    path('streamed/', streamed, name='streamed'),
+    path('admin/', admin.site.urls),
+    path('perf/', perf.report, name='perf_report'),
+    path('perf/metrics/', perf.prometheus_metrics, name='perf_metrics'),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__, PERF_SAMPLE_RATE=1.0)
+class PerfTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        cls.user = User.objects.create_user('user', password='password')
+
+    def setUp(self):
+        perf.metrics.reset()
+
+    def test_percentiles(self):
+        self.assertEqual(perf.percentiles([]), {})
+        self.assertEqual(perf.percentiles([3, 1, 2]), {'p50': 2, 'p90': 3, 'p99': 3, 'max': 3})
+        self.assertEqual(perf.percentiles(range(100, 0, -1)), {'p50': 50, 'p90': 90, 'p99': 99, 'max': 100})
+
+    def test_sampled_request(self):
+        response = self.client.get('/rendered/')
+        stats = perf.metrics.snapshot()['rendered']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['sampled'], 1)
+        self.assertEqual(stats['sql_count'], {'sum': 2, 'p50': 2, 'p90': 2, 'p99': 2, 'max': 2})
+        self.assertEqual(stats['bytes']['max'], len(response.content))
+        self.assertGreater(stats['render_ms']['max'], 0)
+        self.assertGreaterEqual(stats['wall_ms']['max'], stats['sql_ms']['max'] + stats['render_ms']['max'])
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_counted(self):
+        self.client.get('/rendered/')
+        stats = perf.metrics.snapshot()['rendered']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['sampled'], 0)
+        self.assertEqual(stats['wall_ms'], {'sum': 0})
+
+    @override_settings(PERF_BUFFER_SIZE=2)
+    def test_buffer_keeps_the_last_samples(self):
+        for _ in range(3):
+            self.client.get('/rendered/')
+        self.assertEqual(len(perf.metrics.samples['rendered']), 2)
+        stats = perf.metrics.snapshot()['rendered']
+        self.assertEqual((stats['requests'], stats['sampled']), (3, 3))
+        self.assertEqual(stats['sql_count']['sum'], 6)
+
+    def test_streamed_response_size(self):
+        self.client.get('/downloaded/')
+        self.assertEqual(perf.metrics.snapshot()['downloaded']['bytes']['max'], 100)
+
+        response = self.client.get('/streamed/')
+        # Without a Content-Length, the body isn't read to measure it
+        self.assertFalse(streamed.request.consumed)
+        self.assertEqual(perf.metrics.snapshot()['streamed']['bytes']['max'], 0)
+        self.assertEqual(b''.join(response.streaming_content), b'x' * 100)
+
+    def test_report_is_for_staff(self):
+        self.client.get('/rendered/')
+        self.assertEqual(self.client.get('/perf/').status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/perf/').status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/perf/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['views']['rendered']['sampled'], 1)
+
+    @override_settings(PERF_METRICS_IPS=['10.0.0.1'])
+    def test_prometheus_metrics_are_for_listed_addresses(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/perf/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/perf/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_prometheus_metrics(self):
+        for _ in range(2):
+            self.client.get('/rendered/')
+        perf.metrics.count('say "hi"\n')
+
+        response = self.client.get('/perf/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        for line in [
+            '# TYPE storefront_requests_total counter',
+            'storefront_requests_total{view="rendered"} 2',
+            'storefront_requests_total{view="say \\"hi\\"\\n"} 1',
+            '# TYPE storefront_request_queries summary',
+            'storefront_request_queries{view="rendered",quantile="0.5"} 2',
+            'storefront_request_queries{view="rendered",quantile="0.99"} 2',
+            'storefront_request_queries_sum{view="rendered"} 4',
+            'storefront_request_queries_count{view="rendered"} 2',
+        ]:
+            self.assertIn(line, lines)
+        # Views without samples have no summary
+        self.assertFalse([line for line in lines if line.startswith('storefront_request_queries{view="say')])
+
+        durations = [line for line in lines if line.startswith('storefront_request_duration_seconds{')]
+        self.assertEqual(len(durations), 3)
+        for line in durations:
+            # In seconds
+            self.assertLess(float(line.split()[-1]), 10)
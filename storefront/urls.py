@@ -13,9 +13,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-import debug_toolbar
+from . import perf, queries
 
 admin.site.site_header = 'E-Store Manager'
 admin.site.index_title = 'ADMIN CONTROL'
@@ -24,5 +25,13 @@ urlpatterns = [
     # path('', admin.site.urls),
     path('admin/', admin.site.urls),
     path('playground/', include('playground.urls')),
-    path('__debug__/', include(debug_toolbar.urls)),
+    path('store/', include('store.urls')),
+    path('perf/', perf.report, name='perf_report'),
+    path('perf/metrics/', perf.prometheus_metrics, name='perf_metrics'),
+    path('perf/queries/', queries.report, name='perf_queries'),
 ]
+
+if settings.DEBUG:
+    import debug_toolbar
+
+    urlpatterns.append(path('__debug__/', include(debug_toolbar.urls)))
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.contrib import admin
+from django.db.models import QuerySet
+from .index import filter_object_ids, get_tag_cloud
+from .models import TaggedItem
+
+
+class TagFilter(admin.SimpleListFilter):
+    """
+    Filter a changelist by tags through the tag index. Picking tags narrows
+    the list to objects carrying all of them, ``?tags=1|2`` matches any.
+    """
+
+    title = 'tags'
+    parameter_name = 'tags'
+
+    def lookups(self, request, model_admin):
+        return [
+            (str(tag.id), f"{tag.label} ({count})")
+            for tag, count in get_tag_cloud(model_admin.model)
+        ]
+
+    def parse(self, value):
+        """Return the selected tag ids and whether all of them must match."""
+        match_all = '|' not in (value or '')
+        parts = (value or '').replace('|', ',').split(',')
+        return [int(part) for part in parts if part.isdigit()], match_all
+
+    def queryset(self, request, queryset: QuerySet):
+        tag_ids, match_all = self.parse(self.value())
+        if not tag_ids:
+            return None
+        ids = filter_object_ids(queryset.model, tag_ids, match_all, settings.TAG_FILTER_MAX_IDS)
+        if ids is None:
+            # Too many to inline, the database matches the tags itself
+            ids = TaggedItem.objects.get_object_ids(queryset.model, tag_ids, match_all)
+        return queryset.filter(pk__in=ids)
+
+    def choices(self, changelist):
+        selected, match_all = self.parse(self.value())
+        yield {
+            'selected': not selected,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'All',
+        }
+        for lookup, title in self.lookup_choices:
+            tag_id = int(lookup)
+            # Each choice toggles its tag in or out of the selection
+            toggled = [other for other in selected if other != tag_id] if tag_id in selected \
+                else selected + [tag_id]
+            separator = ',' if match_all else '|'
+            yield {
+                'selected': tag_id in selected,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: separator.join(map(str, toggled))}
+                ) if toggled else changelist.get_query_string(remove=[self.parameter_name]),
+                'display': title,
+            }
@@ -0,0 +1,181 @@
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
+
+
+INDEX_PREFIX = 'tags:index:'
+CLOUD_PREFIX = 'tags:cloud:'
+LOCK_SUFFIX = ':lock'
+
+# Unsigned 32-bit ints, object_id is a PositiveIntegerField
+TYPECODE = 'I'
+
+
+def index_key(content_type_id: int, tag_id: int) -> str:
+    return f'{INDEX_PREFIX}{content_type_id}:{tag_id}'
+
+
+def cloud_key(content_type_id: int) -> str:
+    return f'{CLOUD_PREFIX}{content_type_id}'
+
+
+def load_ids(content_type_id: int, tag_id: int) -> array:
+    from .models import TaggedItem
+
+    return array(TYPECODE, TaggedItem.objects
+                 .filter(content_type_id=content_type_id, tag_id=tag_id)
+                 .order_by('object_id')
+                 .values_list('object_id', flat=True)
+                 .distinct())
+
+
+def get_tagged_ids(content_type_id: int, tag_ids) -> dict:
+    """
+    Return the sorted ids of the objects carrying each tag, as a dict of
+    tag id to array. Cached arrays are fetched with one cache round trip,
+    missing ones are loaded with one query each.
+    """
+    tag_ids = list(tag_ids)
+    keys = {index_key(content_type_id, tag_id): tag_id for tag_id in tag_ids}
+    cached = cache.get_many(keys)
+
+    result = {}
+    for key, tag_id in keys.items():
+        if key in cached:
+            ids = array(TYPECODE)
+            ids.frombytes(cached[key])
+        else:
+            ids = cache_ids(content_type_id, tag_id)
+        result[tag_id] = ids
+    return result
+
+
+def cache_ids(content_type_id: int, tag_id: int) -> array:
+    """
+    Load the array of a tag and cache it, under the lock ``update_index``
+    takes. A change committed while loading is then either in the array
+    or applied to it by ``update_index`` once the lock is released. The
+    array isn't cached while another process holds the lock.
+    """
+    key = index_key(content_type_id, tag_id)
+    lock_key = key + LOCK_SUFFIX
+    if not cache.add(lock_key, 1, settings.TAG_INDEX_LOCK_TIMEOUT):
+        return load_ids(content_type_id, tag_id)
+
+    try:
+        ids = load_ids(content_type_id, tag_id)
+        cache.add(key, ids.tobytes(), settings.TAG_INDEX_TIMEOUT)
+        return ids
+    finally:
+        cache.delete(lock_key)
+
+
+def update_index(content_type_id: int, tag_id: int, object_id: int, tagged: bool):
+    """
+    Add or remove one object in the cached array of a tag, if it is cached.
+    The array is rebuilt from the database when the lock can't be taken.
+    """
+    key = index_key(content_type_id, tag_id)
+    lock_key = key + LOCK_SUFFIX
+    deadline = time.monotonic() + settings.TAG_INDEX_LOCK_TIMEOUT
+    while not cache.add(lock_key, 1, settings.TAG_INDEX_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            cache.delete(key)
+            return
+        time.sleep(0.01)
+
+    try:
+        cached = cache.get(key)
+        if cached is None:
+            return
+        ids = array(TYPECODE)
+        ids.frombytes(cached)
+        position = bisect_left(ids, object_id)
+        present = position < len(ids) and ids[position] == object_id
+        if tagged and not present:
+            ids.insert(position, object_id)
+        elif not tagged and present:
+            if still_tagged(content_type_id, tag_id, object_id):
+                return
+            del ids[position]
+        else:
+            return
+        cache.set(key, ids.tobytes(), settings.TAG_INDEX_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+
+
+def still_tagged(content_type_id: int, tag_id: int, object_id: int) -> bool:
+    """An object can carry the same tag twice, removing one keeps it tagged."""
+    from .models import TaggedItem
+
+    return TaggedItem.objects \
+        .filter(content_type_id=content_type_id, tag_id=tag_id, object_id=object_id) \
+        .exists()
+
+
+def filter_object_ids(model, tag_ids, match_all: bool = True, max_ids: int = None):
+    """
+    Return the sorted ids of the ``model`` objects carrying all of
+    ``tag_ids``, or any of them when ``match_all`` is false.
+
+    With ``max_ids``, return None instead once the match is bound to hold
+    more ids than that, telling from the tags' array sizes before they
+    are combined.
+    """
+    tag_ids = list(tag_ids)
+    if not tag_ids:
+        return []
+    content_type = ContentType.objects.get_for_model(model)
+    arrays = sorted(get_tagged_ids(content_type.id, tag_ids).values(), key=len)
+    # All tags match at most the smallest array, any tag at least the largest
+    bound = len(arrays[0] if match_all else arrays[-1])
+    if max_ids is not None and bound > max_ids:
+        return None
+
+    if match_all:
+        # Probe the smaller arrays' ids into the larger ones
+        ids = set(arrays[0])
+        for other in arrays[1:]:
+            if not ids:
+                break
+            ids.intersection_update(other)
+    else:
+        ids = set().union(*arrays)
+        if max_ids is not None and len(ids) > max_ids:
+            return None
+    return sorted(ids)
+
+
+def get_tag_cloud(model) -> list:
+    """
+    Return ``(tag, count)`` for every tag used on ``model``, by label.
+    The counts are computed with one query and cached until a tag is added
+    or removed.
+    """
+    from .models import Tag, TaggedItem
+
+    content_type = ContentType.objects.get_for_model(model)
+    key = cloud_key(content_type.id)
+    counts = cache.get(key)
+    if counts is None:
+        counts = dict(
+            TaggedItem.objects
+                      .filter(content_type=content_type)
+                      .order_by()
+                      .values_list('tag_id')
+                      .annotate(count=Count('object_id', distinct=True))
+        )
+        cache.set(key, counts, settings.TAG_INDEX_TIMEOUT)
+
+    tags = Tag.objects.filter(id__in=counts).order_by('label')
+    return [(tag, counts[tag.id]) for tag in tags]
+
+
+def invalidate_cloud(content_type_id: int):
+    cache.delete(cloud_key(content_type_id))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Count
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
@@ -6,9 +7,64 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 class Tag(models.Model):
     label = models.CharField(max_length=255)
 
+    def __str__(self) -> str:
+        return self.label
+
+
+class TaggedItemQuerySet(models.QuerySet):
+    def with_content_objects(self):
+        """
+        Load ``content_object`` for every row with one query per content
+        type. Content types themselves come from ContentType's cache.
+        """
+        return self.prefetch_related('content_object')
+
+
+class TaggedItemManager(models.Manager.from_queryset(TaggedItemQuerySet)):
+    def get_tags_for(self, obj_type, obj_id):
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return self.select_related('tag') \
+                   .filter(content_type=content_type, object_id=obj_id)
+
+    def get_tags_for_objects(self, obj_type, obj_ids) -> dict:
+        """
+        Return the tags of many objects of ``obj_type`` with one query, as a
+        dict of object id to list of tags. Objects without tags are left out.
+        """
+        content_type = ContentType.objects.get_for_model(obj_type)
+        tags = {}
+        for item in self.select_related('tag') \
+                        .filter(content_type=content_type, object_id__in=list(obj_ids)) \
+                        .order_by('object_id', 'tag__label'):
+            tags.setdefault(item.object_id, []).append(item.tag)
+        return tags
+
+    def get_object_ids(self, obj_type, tag_ids, match_all: bool = True):
+        """
+        Return a subquery of the ids of the ``obj_type`` objects carrying
+        all of ``tag_ids``, or any of them when ``match_all`` is false.
+        """
+        tag_ids = set(tag_ids)
+        content_type = ContentType.objects.get_for_model(obj_type)
+        items = self.filter(content_type=content_type, tag_id__in=tag_ids) \
+                    .order_by() \
+                    .values('object_id')
+        if match_all:
+            items = items.annotate(tag_count=Count('tag_id', distinct=True)) \
+                         .filter(tag_count=len(tag_ids))
+        else:
+            items = items.distinct()
+        return items.values('object_id')
+
 
 class TaggedItem(models.Model):
+    objects = TaggedItemManager()
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from . import index
+from .models import TaggedItem
+
+
+def reindex(content_type_id: int, tag_id: int, object_id: int, tagged: bool):
+    def update():
+        index.update_index(content_type_id, tag_id, object_id, tagged)
+        index.invalidate_cloud(content_type_id)
+    transaction.on_commit(update)
+
+
+@receiver(pre_save, sender=TaggedItem)
+def remember_tagged_object(sender, instance, raw=False, **kwargs):
+    instance._previous_tagging = None
+    if not raw and not instance._state.adding:
+        instance._previous_tagging = TaggedItem.objects \
+            .filter(pk=instance.pk) \
+            .values_list('content_type_id', 'tag_id', 'object_id') \
+            .first()
+
+
+@receiver(post_save, sender=TaggedItem)
+def index_tagged_object(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = instance._previous_tagging
+    current = (instance.content_type_id, instance.tag_id, instance.object_id)
+    if previous == current:
+        return
+    if previous is not None:
+        reindex(*previous, tagged=False)
+    reindex(*current, tagged=True)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def unindex_tagged_object(sender, instance, **kwargs):
+    reindex(instance.content_type_id, instance.tag_id, instance.object_id, tagged=False)
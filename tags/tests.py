@@ -1,3 +1,119 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from store.models import Collection, Product
+from . import index
+from .models import Tag, TaggedItem
+
+
+class TagIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.products = [
+            Product.objects.create(
+                title=f'Product {number}', slug=f'product-{number}', description='',
+                unit_price=Decimal('10.00'), inventory=1, collection=collection
+            )
+            for number in range(4)
+        ]
+        cls.red, cls.blue = Tag.objects.create(label='red'), Tag.objects.create(label='blue')
+        cls.content_type = ContentType.objects.get_for_model(Product)
+        for product, tags in zip(cls.products, [[cls.red], [cls.red, cls.blue], [cls.blue], []]):
+            for tag in tags:
+                TaggedItem.objects.create(tag=tag, content_object=product)
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self, *products) -> list:
+        return [product.id for product in products]
+
+    def test_filter_object_ids(self):
+        red, blue = self.red.id, self.blue.id
+        first, second, third, _ = self.products
+        self.assertEqual(index.filter_object_ids(Product, [red]), self.ids(first, second))
+        self.assertEqual(index.filter_object_ids(Product, [red, blue]), self.ids(second))
+        self.assertEqual(index.filter_object_ids(Product, [red, blue], match_all=False),
+                         self.ids(first, second, third))
+
+    def test_filter_object_ids_gives_up_past_max_ids(self):
+        red, blue = self.red.id, self.blue.id
+        first, second, third, _ = self.products
+        # Both tags are on two products, judged before intersecting to one
+        self.assertIsNone(index.filter_object_ids(Product, [red, blue], max_ids=1))
+        self.assertEqual(index.filter_object_ids(Product, [red, blue], max_ids=2), self.ids(second))
+        self.assertIsNone(index.filter_object_ids(Product, [red, blue], match_all=False, max_ids=1))
+        self.assertIsNone(index.filter_object_ids(Product, [red, blue], match_all=False, max_ids=2))
+        self.assertEqual(index.filter_object_ids(Product, [red, blue], match_all=False, max_ids=3),
+                         self.ids(first, second, third))
+
+    def test_cached_arrays_follow_tagging(self):
+        index.get_tagged_ids(self.content_type.id, [self.red.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            item = TaggedItem.objects.create(tag=self.red, content_object=self.products[3])
+        with self.assertNumQueries(0):
+            ids = index.get_tagged_ids(self.content_type.id, [self.red.id])[self.red.id]
+        self.assertEqual(list(ids), self.ids(*self.products[:2], self.products[3]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(index.filter_object_ids(Product, [self.red.id]), self.ids(*self.products[:2]))
+
+    def test_array_is_not_cached_while_locked(self):
+        key = index.index_key(self.content_type.id, self.red.id)
+        # An update_index in progress, which found nothing cached
+        cache.add(key + index.LOCK_SUFFIX, 1)
+        ids = index.get_tagged_ids(self.content_type.id, [self.red.id])[self.red.id]
+        self.assertEqual(list(ids), self.ids(*self.products[:2]))
+        self.assertIsNone(cache.get(key))
+
+        cache.delete(key + index.LOCK_SUFFIX)
+        index.get_tagged_ids(self.content_type.id, [self.red.id])
+        self.assertIsNotNone(cache.get(key))
+
+    def test_get_object_ids(self):
+        red, blue = self.red.id, self.blue.id
+        for tag_ids, match_all in [([red], True), ([red, blue], True), ([red, blue], False)]:
+            with self.subTest(tag_ids=tag_ids, match_all=match_all):
+                self.assertEqual(
+                    sorted(TaggedItem.objects.get_object_ids(Product, tag_ids, match_all)
+                                             .values_list('object_id', flat=True)),
+                    index.filter_object_ids(Product, tag_ids, match_all)
+                )
+
+    def test_get_tags_for_objects(self):
+        first, second, third, untagged = self.products
+        ContentType.objects.get_for_model(Product)
+        with self.assertNumQueries(1):
+            tags = TaggedItem.objects.get_tags_for_objects(Product, [first.id, untagged.id, 999])
+        self.assertEqual(tags, {first.id: [self.red]})
+
+        with self.assertNumQueries(1):
+            tags = TaggedItem.objects.get_tags_for_objects(Product, (product.id for product in self.products))
+        self.assertEqual(tags, {first.id: [self.red], second.id: [self.blue, self.red], third.id: [self.blue]})
+
+    def test_with_content_objects(self):
+        collection = self.products[0].collection
+        TaggedItem.objects.create(tag=self.red, content_object=collection)
+        ContentType.objects.get_for_model(Collection)
+        # The items, then one query per content type
+        with self.assertNumQueries(3):
+            objects = [item.content_object for item in TaggedItem.objects.with_content_objects().order_by('id')]
+        self.assertEqual(objects, [self.products[0], self.products[1], self.products[1], self.products[2], collection])
+
+    @override_settings(TAG_FILTER_MAX_IDS=1)
+    def test_admin_filter(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for value, products in [
+            (str(self.blue.id), self.products[1:3]),
+            (f'{self.red.id},{self.blue.id}', self.products[1:2]),
+            (f'{self.red.id}|{self.blue.id}', self.products[:3]),
+        ]:
+            with self.subTest(tags=value):
+                response = self.client.get('/admin/store/product/', {'tags': value})
+                self.assertEqual(sorted(product.id for product in response.context['cl'].result_list),
+                                 self.ids(*products))